@@ -0,0 +1,167 @@
+"""Local stand-in for an OSRM server so provider benchmarks run offline.
+
+Answers ``/route``, ``/table`` and ``/trip`` in OSRM's JSON format with great-circle
+distances stretched by a road detour factor and a fixed average speed.
+"""
+
+import itertools
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from providers.haversine import haversine_matrix_km
+
+ROAD_DETOUR_FACTOR = 1.3
+AVERAGE_SPEED_KMPH = 35.0
+# /trip tries every order up to this many intermediate stops, then greedy.
+MAX_BRUTE_FORCE_TRIP_STOPS = 7
+
+
+def _road_metrics(
+    points: np.ndarray, sources: list[int], destinations: list[int]
+) -> tuple[np.ndarray, np.ndarray]:
+    """(metres, seconds) matrices between ``points`` rows given as (lon, lat)."""
+    radians = np.radians(points)
+    distances_km = haversine_matrix_km(
+        radians[sources, 1],
+        radians[sources, 0],
+        radians[destinations, 1],
+        radians[destinations, 0],
+    )
+    distances_km *= ROAD_DETOUR_FACTOR
+    return distances_km * 1000.0, distances_km * (3600.0 / AVERAGE_SPEED_KMPH)
+
+
+def _trip_visits(seconds: np.ndarray) -> list[int]:
+    """Visiting order from the first to the last point (roundtrip=false)."""
+    last = len(seconds) - 1
+    middle = list(range(1, last))
+    if len(middle) <= MAX_BRUTE_FORCE_TRIP_STOPS:
+        best = min(
+            itertools.permutations(middle),
+            key=lambda order: sum(
+                seconds[a, b] for a, b in zip((0, *order), (*order, last))
+            ),
+        )
+        return [0, *best, last]
+
+    visits = [0]
+    while middle:
+        nearest = min(middle, key=lambda index: seconds[visits[-1], index])
+        visits.append(nearest)
+        middle.remove(nearest)
+    return [*visits, last]
+
+
+def _indexes(value: str) -> list[int]:
+    # OSRM separates indexes with ";"; accept "," as well.
+    return [int(index) for index in value.replace(";", ",").split(",")]
+
+
+class _FakeOSRMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeOSRMServer"
+
+    def do_GET(self) -> None:
+        parsed = urlsplit(self.path)
+        service, _, _, coords = parsed.path.strip("/").split("/", 3)
+        points = np.array(
+            [[float(value) for value in pair.split(",")] for pair in coords.split(";")]
+        )
+        with self.server.lock:
+            self.server.requests[service] += 1
+
+        if service == "trip":
+            indexes = list(range(len(points)))
+            metres, seconds = _road_metrics(points, indexes, indexes)
+            visits = _trip_visits(seconds)
+            legs = [
+                {"distance": metres[a, b], "duration": seconds[a, b]}
+                for a, b in zip(visits, visits[1:])
+            ]
+            payload = {
+                "code": "Ok",
+                "waypoints": [
+                    {"waypoint_index": visits.index(index), "trips_index": 0}
+                    for index in indexes
+                ],
+                "trips": [
+                    {
+                        "distance": sum(leg["distance"] for leg in legs),
+                        "duration": sum(leg["duration"] for leg in legs),
+                        "legs": legs,
+                    }
+                ],
+            }
+        elif service == "route":
+            indexes = list(range(len(points)))
+            metres, seconds = _road_metrics(points, indexes, indexes)
+            legs = [
+                {"distance": metres[i, i + 1], "duration": seconds[i, i + 1]}
+                for i in range(len(points) - 1)
+            ]
+            payload = {
+                "code": "Ok",
+                "routes": [
+                    {
+                        "distance": sum(leg["distance"] for leg in legs),
+                        "duration": sum(leg["duration"] for leg in legs),
+                        "legs": legs,
+                    }
+                ],
+            }
+        else:
+            query = parse_qs(parsed.query)
+            everything = list(range(len(points)))
+            sources = query.get("sources", ["all"])[0]
+            destinations = query.get("destinations", ["all"])[0]
+            metres, seconds = _road_metrics(
+                points,
+                everything if sources == "all" else _indexes(sources),
+                everything if destinations == "all" else _indexes(destinations),
+            )
+            payload = {
+                "code": "Ok",
+                "distances": metres.tolist(),
+                "durations": seconds.tolist(),
+            }
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class FakeOSRMServer(ThreadingHTTPServer):
+    """Threaded fake OSRM on an ephemeral localhost port; use as a context manager."""
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeOSRMHandler)
+        self.lock = threading.Lock()
+        self.requests: Counter[str] = Counter()
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> "FakeOSRMServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,96 @@
+"""Synthetic city scenarios for the benchmark suite.
+
+Every generator returns ``(destination, drivers, passengers)`` for a given
+rider (passenger) count and seed, laid out in km around a city centre and
+converted to latitude/longitude, so runs are reproducible and offline.
+"""
+
+import math
+from collections.abc import Callable
+
+import numpy as np
+
+from models import Driver, Location, Passenger
+
+CITY_CENTRE = Location(-37.8136, 144.9631)
+CITY_RADIUS_KM = 25.0
+RIDERS_PER_DRIVER = 3
+DRIVER_CAPACITY = 4
+KM_PER_DEGREE_LATITUDE = 111.32
+
+Scenario = tuple[Location, list[Driver], list[Passenger]]
+
+
+def _to_locations(offsets_km: np.ndarray) -> list[Location]:
+    latitudes = CITY_CENTRE.latitude + offsets_km[:, 1] / KM_PER_DEGREE_LATITUDE
+    longitudes = CITY_CENTRE.longitude + offsets_km[:, 0] / (
+        KM_PER_DEGREE_LATITUDE * math.cos(math.radians(CITY_CENTRE.latitude))
+    )
+    return [
+        Location(latitude, longitude)
+        for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist())
+    ]
+
+
+def _scenario(
+    offsets_km: np.ndarray, rider_count: int, rng: np.random.Generator
+) -> Scenario:
+    """Split shuffled points into drivers and riders; the centre is the destination."""
+    rng.shuffle(offsets_km)
+    locations = _to_locations(offsets_km)
+    drivers = [
+        Driver(f"d{index}", f"Driver {index}", location, capacity=DRIVER_CAPACITY)
+        for index, location in enumerate(locations[rider_count:])
+    ]
+    passengers = [
+        Passenger(f"p{index}", f"Rider {index}", location)
+        for index, location in enumerate(locations[:rider_count])
+    ]
+    return CITY_CENTRE, drivers, passengers
+
+
+def _driver_count(rider_count: int) -> int:
+    return max(math.ceil(rider_count / RIDERS_PER_DRIVER), 1)
+
+
+def uniform(rider_count: int, seed: int = 0) -> Scenario:
+    """Riders and drivers spread evenly over a square city."""
+    rng = np.random.default_rng(seed)
+    total = rider_count + _driver_count(rider_count)
+    offsets = rng.uniform(-CITY_RADIUS_KM, CITY_RADIUS_KM, size=(total, 2))
+    return _scenario(offsets, rider_count, rng)
+
+
+def clustered(rider_count: int, seed: int = 0) -> Scenario:
+    """Dense suburbs: Gaussian clusters scattered around the city."""
+    rng = np.random.default_rng(seed)
+    total = rider_count + _driver_count(rider_count)
+    suburb_count = min(max(round(math.sqrt(rider_count) / 2), 3), 60)
+    centres = rng.uniform(-CITY_RADIUS_KM, CITY_RADIUS_KM, size=(suburb_count, 2))
+    spreads = rng.uniform(0.5, 2.5, size=suburb_count)
+    suburbs = rng.integers(suburb_count, size=total)
+    offsets = centres[suburbs] + rng.normal(size=(total, 2)) * spreads[suburbs, None]
+    return _scenario(offsets, rider_count, rng)
+
+
+def hub_and_spoke(rider_count: int, seed: int = 0) -> Scenario:
+    """Commuters strung along radial corridors into the CBD destination."""
+    rng = np.random.default_rng(seed)
+    total = rider_count + _driver_count(rider_count)
+    spoke_count = 6
+    angles = (
+        rng.integers(spoke_count, size=total) * (2 * math.pi / spoke_count)
+        + rng.normal(scale=0.05, size=total)
+    )
+    # Most commuters live in the middle ring, fewer near the CBD or the fringe.
+    radii = np.clip(rng.gamma(3.0, CITY_RADIUS_KM / 6, size=total), 0.5, None)
+    offsets = np.column_stack((radii * np.cos(angles), radii * np.sin(angles)))
+    offsets += rng.normal(scale=0.4, size=(total, 2))
+    return _scenario(offsets, rider_count, rng)
+
+
+GENERATORS: dict[str, Callable[[int, int], Scenario]] = {
+    "uniform": uniform,
+    "clustered": clustered,
+    "hub_and_spoke": hub_and_spoke,
+}
@@ -0,0 +1,334 @@
+"""Assignment, TSP and provider-matrix benchmarks on synthetic cities.
+
+Run from backend/: PYTHONPATH=python python benchmarks/suite.py
+
+Each case reports wall time, provider calls (plus HTTP requests and time
+spent in them for the fake OSRM server), peak traced memory and solution
+quality (total route minutes and unassigned riders). ``--save`` writes the
+results as JSON; ``--baseline`` compares against such a file and exits
+non-zero when a case regresses beyond the tolerances, for use as a CI gate.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from assignment import assign_passengers_to_drivers
+from fake_osrm import FakeOSRMServer
+from providers.base import DistanceProvider
+from providers.haversine import HaversineProvider
+from providers.instrumentation import InstrumentedProvider
+from providers.osrm import OSRMProvider
+from providers.tiered import TieredProvider
+from scenarios import GENERATORS, Scenario
+from tsp import nearest_neighbor_tsp
+
+DEFAULT_SIZES = (100, 1_000, 10_000, 100_000)
+# Above this many riders the full matrix no longer fits comfortably in
+# memory, so assignment switches to candidate pruning.
+FULL_MATRIX_MAX_RIDERS = 2_000
+PRUNED_CANDIDATE_COUNT = 16
+# nearest_neighbor_tsp and the matrix case always build a full matrix.
+MAX_TSP_STOPS = 1_000
+MAX_MATRIX_LOCATIONS = 2_000
+DEFAULT_OSRM_MAX_RIDERS = 1_000
+
+
+@dataclass
+class CaseResult:
+    name: str
+    wall_seconds: float
+    provider_calls: dict[str, int]
+    http_seconds: float = 0.0
+    peak_memory_mb: float | None = None
+    total_minutes: float | None = None
+    unassigned: int | None = None
+    notes: dict[str, object] = field(default_factory=dict)
+
+
+# A case factory returns run(provider) -> solution, score(solution, provider)
+# -> (total_minutes, unassigned) and notes; only run() is timed and counted.
+Run = Callable[[DistanceProvider], object]
+Score = Callable[[object, DistanceProvider], tuple[float | None, int | None]]
+CaseFactory = Callable[[Scenario], tuple[Run, Score, dict[str, object]]]
+
+
+def assignment_case(scenario: Scenario) -> tuple[Run, Score, dict[str, object]]:
+    destination, drivers, passengers = scenario
+    candidate_count = (
+        PRUNED_CANDIDATE_COUNT if len(passengers) > FULL_MATRIX_MAX_RIDERS else None
+    )
+
+    def run(provider: DistanceProvider) -> object:
+        return assign_passengers_to_drivers(
+            drivers,
+            passengers,
+            destination,
+            provider=provider,
+            candidate_count=candidate_count,
+        )
+
+    def score(solution: object, provider: DistanceProvider) -> tuple[float, int]:
+        routes, unassigned = solution
+        return sum(route.total_travel_time_minutes for route in routes), len(unassigned)
+
+    return run, score, {"drivers": len(drivers), "candidate_count": candidate_count}
+
+
+def tsp_case(scenario: Scenario) -> tuple[Run, Score, dict[str, object]]:
+    _, drivers, passengers = scenario
+    start = drivers[0].location
+    stops = [passenger.location for passenger in passengers[:MAX_TSP_STOPS]]
+
+    def run(provider: DistanceProvider) -> object:
+        return nearest_neighbor_tsp(start, stops, provider=provider)
+
+    def score(solution: object, provider: DistanceProvider) -> tuple[float, None]:
+        legs = provider.route_legs([start, *solution])
+        return sum(leg[1] for leg in legs), None
+
+    return run, score, {"stops": len(stops)}
+
+
+def matrix_case(scenario: Scenario) -> tuple[Run, Score, dict[str, object]]:
+    _, drivers, passengers = scenario
+    locations = [
+        user.location for user in [*drivers, *passengers][:MAX_MATRIX_LOCATIONS]
+    ]
+
+    def run(provider: DistanceProvider) -> object:
+        return provider.matrix_metrics(locations, locations)
+
+    def score(solution: object, provider: DistanceProvider) -> tuple[None, None]:
+        return None, None
+
+    return run, score, {"locations": len(locations)}
+
+
+CASES: dict[str, CaseFactory] = {
+    "assign": assignment_case,
+    "tsp": tsp_case,
+    "matrix": matrix_case,
+}
+
+
+def measure(
+    name: str,
+    run: Run,
+    score: Score,
+    make_provider: Callable[[], DistanceProvider],
+    notes: dict[str, object],
+    trace_memory: bool,
+) -> CaseResult:
+    """Time one case on a fresh provider, then re-run it traced for memory."""
+    provider = InstrumentedProvider(make_provider())
+    gc.collect()
+    started = time.perf_counter()
+    solution = run(provider)
+    wall_seconds = time.perf_counter() - started
+
+    snapshot = provider.instrumentation.snapshot()
+    calls = dict(snapshot["calls"])
+    for service, histogram in snapshot["http"].items():
+        calls[f"http_{service}"] = histogram["count"]
+
+    peak_memory_mb = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run(make_provider())
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    total_minutes, unassigned = score(solution, provider.inner)
+
+    return CaseResult(
+        name=name,
+        wall_seconds=wall_seconds,
+        provider_calls=calls,
+        http_seconds=sum(
+            histogram["sum_seconds"] for histogram in snapshot["http"].values()
+        ),
+        peak_memory_mb=peak_memory_mb,
+        total_minutes=total_minutes,
+        unassigned=unassigned,
+        notes=notes,
+    )
+
+
+def compare(
+    results: list[CaseResult],
+    baseline: dict[str, dict],
+    time_tolerance: float,
+    memory_tolerance: float,
+    quality_tolerance: float,
+    min_seconds: float,
+) -> list[str]:
+    """Human-readable regressions of ``results`` against a saved baseline."""
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous is None:
+            continue
+
+        allowed = previous["wall_seconds"] * (1 + time_tolerance)
+        if result.wall_seconds > max(allowed, previous["wall_seconds"] + min_seconds):
+            regressions.append(
+                f"{result.name}: wall {result.wall_seconds:.3f}s > "
+                f"baseline {previous['wall_seconds']:.3f}s"
+            )
+        if (
+            result.peak_memory_mb is not None
+            and previous.get("peak_memory_mb") is not None
+            and result.peak_memory_mb
+            > previous["peak_memory_mb"] * (1 + memory_tolerance)
+        ):
+            regressions.append(
+                f"{result.name}: peak memory {result.peak_memory_mb:.1f}MB > "
+                f"baseline {previous['peak_memory_mb']:.1f}MB"
+            )
+        for method, count in result.provider_calls.items():
+            if count > previous["provider_calls"].get(method, 0):
+                regressions.append(
+                    f"{result.name}: {method} calls {count} > "
+                    f"baseline {previous['provider_calls'].get(method, 0)}"
+                )
+        if (
+            result.total_minutes is not None
+            and previous.get("total_minutes") is not None
+            and result.total_minutes
+            > previous["total_minutes"] * (1 + quality_tolerance)
+        ):
+            regressions.append(
+                f"{result.name}: total minutes {result.total_minutes:.1f} > "
+                f"baseline {previous['total_minutes']:.1f}"
+            )
+        if (result.unassigned or 0) > (previous.get("unassigned") or 0):
+            regressions.append(
+                f"{result.name}: unassigned {result.unassigned} > "
+                f"baseline {previous['unassigned']}"
+            )
+    return regressions
+
+
+def print_result(result: CaseResult) -> None:
+    calls = " ".join(
+        f"{key}={value}" for key, value in sorted(result.provider_calls.items())
+    )
+    memory = "-" if result.peak_memory_mb is None else f"{result.peak_memory_mb:.1f}"
+    minutes = "-" if result.total_minutes is None else f"{result.total_minutes:.1f}"
+    unassigned = "-" if result.unassigned is None else str(result.unassigned)
+    if result.http_seconds:
+        calls += f" http_seconds={result.http_seconds:.3f}"
+    print(
+        f"{result.name:<38} {result.wall_seconds:>9.3f} {memory:>9} "
+        f"{minutes:>12} {unassigned:>6}  {calls}",
+        flush=True,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(GENERATORS), default=list(GENERATORS)
+    )
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument(
+        "--providers",
+        nargs="+",
+        choices=["haversine", "osrm", "tiered"],
+        default=["haversine", "osrm", "tiered"],
+    )
+    parser.add_argument(
+        "--osrm-max-riders",
+        type=int,
+        default=DEFAULT_OSRM_MAX_RIDERS,
+        help="skip fake-OSRM and tiered cases above this many riders (HTTP-bound)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced re-run")
+    parser.add_argument("--save", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="fail on regressions against JSON")
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--quality-tolerance", type=float, default=0.01)
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="ignore slowdowns smaller than this (timer noise on tiny cases)",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'case':<38} {'wall_s':>9} {'peak_mb':>9} {'total_min':>12} "
+        f"{'unasg':>6}  provider_calls"
+    )
+    results: list[CaseResult] = []
+    with FakeOSRMServer() as server:
+        providers: dict[str, Callable[[], DistanceProvider]] = {
+            "haversine": HaversineProvider,
+            "osrm": lambda: OSRMProvider(
+                base_url=server.base_url, requests_per_second=0.0
+            ),
+            "tiered": lambda: TieredProvider(
+                OSRMProvider(base_url=server.base_url, requests_per_second=0.0)
+            ),
+        }
+        for scenario_name in args.scenarios:
+            for size in args.sizes:
+                scenario = GENERATORS[scenario_name](size, args.seed)
+                for case_name in args.cases:
+                    run, score, notes = CASES[case_name](scenario)
+                    for provider_name in args.providers:
+                        if (
+                            provider_name != "haversine"
+                            and size > args.osrm_max_riders
+                        ):
+                            continue
+                        result = measure(
+                            f"{case_name}/{scenario_name}/{size}/{provider_name}",
+                            run,
+                            score,
+                            providers[provider_name],
+                            notes,
+                            trace_memory=not args.no_memory,
+                        )
+                        results.append(result)
+                        print_result(result)
+
+    if args.save:
+        args.save.write_text(
+            json.dumps({result.name: asdict(result) for result in results}, indent=2)
+        )
+
+    if args.baseline:
+        regressions = compare(
+            results,
+            json.loads(args.baseline.read_text()),
+            args.time_tolerance,
+            args.memory_tolerance,
+            args.quality_tolerance,
+            args.min_seconds,
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Per-route pickup ordering latency and quality, by stop count.
+
+Run from backend/: PYTHONPATH=python python benchmarks/tsp_latency.py
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections.abc import Callable
+
+from tsp import (
+    DEFAULT_EXACT_STOP_LIMIT,
+    held_karp_order,
+    nearest_neighbor_order,
+    solve_open_tsp,
+    solve_pickup_order,
+)
+
+Solver = Callable[[list[list[float]], int, list[int], int], list[int]]
+
+SOLVERS: dict[str, Solver] = {
+    "nearest_neighbor": lambda cost, start, stops, end: nearest_neighbor_order(
+        cost, start, stops
+    ),
+    "local_search": lambda cost, start, stops, end: solve_open_tsp(
+        cost, start, stops, end=end
+    ),
+    "held_karp": lambda cost, start, stops, end: held_karp_order(
+        cost, start, stops, end=end
+    ),
+    "auto": lambda cost, start, stops, end: solve_pickup_order(
+        cost, start, stops, end=end
+    ),
+}
+
+
+def random_route(stop_count: int, rng: random.Random) -> list[list[float]]:
+    """Travel-time matrix for driver (0), stops (1..n) and destination (n + 1)."""
+    points = [(rng.uniform(0, 20), rng.uniform(0, 20)) for _ in range(stop_count + 2)]
+    return [
+        [((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5 * 1.5 for bx, by in points]
+        for ax, ay in points
+    ]
+
+
+def path_cost(cost: list[list[float]], start: int, order: list[int], end: int) -> float:
+    sequence = [start, *order, end]
+    return sum(cost[a][b] for a, b in zip(sequence, sequence[1:]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-stops", type=int, default=2)
+    parser.add_argument("--max-stops", type=int, default=10)
+    parser.add_argument("--routes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"exact_stop_limit={DEFAULT_EXACT_STOP_LIMIT} routes/size={args.routes}")
+    print(f"{'stops':>5} {'solver':>16} {'median_us':>10} {'p95_us':>10} {'gap_%':>7}")
+
+    for stop_count in range(args.min_stops, args.max_stops + 1):
+        routes = [random_route(stop_count, rng) for _ in range(args.routes)]
+        stops = list(range(1, stop_count + 1))
+        end = stop_count + 1
+        optimal = [
+            path_cost(cost, 0, held_karp_order(cost, 0, stops, end=end), end)
+            for cost in routes
+        ]
+
+        for name, solver in SOLVERS.items():
+            latencies: list[float] = []
+            gap = 0.0
+            for cost, best in zip(routes, optimal):
+                started = time.perf_counter()
+                order = solver(cost, 0, stops, end)
+                latencies.append((time.perf_counter() - started) * 1e6)
+                gap += path_cost(cost, 0, order, end) / best - 1.0
+
+            latencies.sort()
+            print(
+                f"{stop_count:>5} {name:>16} "
+                f"{statistics.median(latencies):>10.1f} "
+                f"{latencies[int(len(latencies) * 0.95) - 1]:>10.1f} "
+                f"{100 * gap / len(routes):>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
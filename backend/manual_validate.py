@@ -1,7 +1,11 @@
+import argparse
+from pathlib import Path
+
 from assignment import assign_passengers_to_drivers
 from models import Driver, Location, Passenger
 from providers.haversine import HaversineProvider
 from providers.osrm import OSRMProvider
+from tracing import RecordingTracer
 
 
 def melbourne_scenario() -> tuple[Location, list[Driver], list[Passenger]]:
@@ -74,8 +78,40 @@ def validate_with_osrm() -> None:
     print_routes("OSRM PROVIDER (MELBOURNE)", drivers, passengers, routes, unassigned)
 
 
+def profile_with_haversine(output: Path) -> None:
+    """Trace the Melbourne scenario and write folded stacks for a flame graph."""
+    destination, drivers, passengers = melbourne_scenario()
+
+    tracer = RecordingTracer()
+    assign_passengers_to_drivers(
+        drivers, passengers, destination, provider=HaversineProvider(), tracer=tracer
+    )
+    output.write_text(tracer.folded())
+
+    print(f"\n=== PROFILE (folded stacks written to {output}) ===")
+    for path, entry in tracer.summary().items():
+        counters = " ".join(
+            f"{key}={value}" for key, value in entry["counters"].items()
+        )
+        print(
+            f"{path:<45} spans={entry['count']:<3} "
+            f"ms={entry['seconds'] * 1000:8.3f} {counters}"
+        )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="PATH",
+        help="write a folded-stack profile (flamegraph.pl / speedscope) to PATH",
+    )
+    args = parser.parse_args()
+
     validate_with_haversine()
+    if args.profile:
+        profile_with_haversine(args.profile)
     try:
         validate_with_osrm()
     except Exception as e:
@@ -1,95 +1,543 @@
-from models import Driver, Location, Passenger, Route
+from collections.abc import Sequence
+from itertools import chain
+from typing import Any
+
+import numpy as np
+
+from models import Driver, Location, LocationTable, Passenger, Route
 from providers.base import DistanceProvider
+from providers.condensed import CondensedMatrix
 from providers.haversine import HaversineProvider
-from tsp import nearest_neighbor_tsp
+from spatial import SpatialIndex
+from tracing import NULL_SPAN, NULL_TRACER, Tracer
+from tsp import solve_pickup_order
+from vrp import DEFAULT_TIME_LIMIT_SECONDS, solve_capacitated_vrp
+
+ENGINES = ("greedy", "vrp")
+
+Matrix = Sequence[Sequence[float]] | np.ndarray | CondensedMatrix
 
 
 def route_metrics(
     stops: list[Location], provider: DistanceProvider
 ) -> tuple[float, float]:
-    if len(stops) < 2:
-        return 0.0, 0.0
+    legs = provider.route_legs(stops)
+    return sum(leg[0] for leg in legs), sum(leg[1] for leg in legs)
+
+
+def indexed_route_legs(
+    stops: list[int],
+    distances: Matrix,
+    travel_times: Matrix,
+) -> list[tuple[float, float]]:
+    """(distance_km, travel_time_minutes) per leg, read from the matrices."""
+    if isinstance(distances, CondensedMatrix):
+        # Row indexing would densify a whole row per leg; read the cells.
+        return [
+            (
+                float(distances[origin, destination]),
+                float(travel_times[origin, destination]),
+            )
+            for origin, destination in zip(stops, stops[1:])
+        ]
+    return [
+        (
+            float(distances[origin][destination]),
+            float(travel_times[origin][destination]),
+        )
+        for origin, destination in zip(stops, stops[1:])
+    ]
+
+
+def indexed_route_metrics(
+    stops: list[int],
+    distances: Matrix,
+    travel_times: Matrix,
+) -> tuple[float, float]:
+    legs = indexed_route_legs(stops, distances, travel_times)
+    return sum(leg[0] for leg in legs), sum(leg[1] for leg in legs)
 
-    total_distance_km = 0.0
-    total_travel_time_minutes = 0.0
-    for index in range(len(stops) - 1):
-        origin = stops[index]
-        destination = stops[index + 1]
-        total_distance_km += provider.distance_km(origin, destination)
-        total_travel_time_minutes += provider.travel_time_minutes(origin, destination)
 
-    return total_distance_km, total_travel_time_minutes
+class _SeatBuckets:
+    """Unassigned passengers grouped by seats required.
 
+    Finding the nearest passenger that fits only looks at buckets needing no
+    more than the free seats, with a vectorised argmin over each bucket's
+    matrix columns; assignment just clears a flag. Buckets are compacted
+    once half their entries are gone. ``scanned`` counts the candidate
+    entries examined so far.
+    """
 
-def assign_passengers_to_drivers(
+    def __init__(self, seats_required: list[int]):
+        self.remaining = np.ones(len(seats_required), dtype=bool)
+        self.count = len(seats_required)
+        self.scanned = 0
+        grouped: dict[int, list[int]] = {}
+        for passenger_index, seats in enumerate(seats_required):
+            grouped.setdefault(seats, []).append(passenger_index)
+        self.buckets = {
+            seats: np.array(indexes, dtype=np.int64)
+            for seats, indexes in sorted(grouped.items())
+        }
+        self.alive = {seats: len(indexes) for seats, indexes in grouped.items()}
+
+    def nearest(self, row: np.ndarray, free_seats: int) -> int | None:
+        """Lowest-cost remaining passenger needing at most ``free_seats``.
+
+        ``row`` holds one cost per passenger; ties go to the lowest index.
+        """
+        best: tuple[float, int] | None = None
+        for seats, indexes in self.buckets.items():
+            if seats > free_seats:
+                break
+            if not self.alive[seats]:
+                continue
+            if self.alive[seats] * 2 < len(indexes):
+                indexes = indexes[self.remaining[indexes]]
+                self.buckets[seats] = indexes
+            self.scanned += len(indexes)
+            costs = np.where(self.remaining[indexes], row[indexes], np.inf)
+            position = int(np.argmin(costs))
+            candidate = (float(costs[position]), int(indexes[position]))
+            if best is None or candidate < best:
+                best = candidate
+        return best[1] if best is not None else None
+
+    def take(self, passenger_index: int, seats: int) -> None:
+        self.remaining[passenger_index] = False
+        self.alive[seats] -= 1
+        self.count -= 1
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def _greedy_assignment(
     drivers: list[Driver],
     passengers: list[Passenger],
-    destination: Location | None = None,
-    provider: DistanceProvider | None = None,
-) -> tuple[list[Route], list[Passenger]]:
-    if provider is None:
-        provider = HaversineProvider()
+    travel_times: Matrix,
+    passenger_offset: int,
+    span: Any = NULL_SPAN,
+) -> tuple[list[tuple[int, list[int]]], list[int]]:
+    seats_required = [passenger.seats_required for passenger in passengers]
+    remaining_passengers = _SeatBuckets(seats_required)
+    passenger_columns = slice(passenger_offset, passenger_offset + len(passengers))
+    assignments: list[tuple[int, list[int]]] = []
+
+    for driver_index, driver in sorted(
+        enumerate(drivers), key=lambda item: item[1].capacity, reverse=True
+    ):
+        assigned: list[int] = []
+        seats_taken = 0
+        anchor = driver_index
+
+        while len(remaining_passengers) and seats_taken < driver.capacity:
+            anchor_row = np.asarray(travel_times[anchor][passenger_columns])
+            nearest = remaining_passengers.nearest(
+                anchor_row, driver.capacity - seats_taken
+            )
+            if nearest is None:
+                break
 
-    remaining_passengers = passengers.copy()
-    routes: list[Route] = []
+            assigned.append(nearest)
+            remaining_passengers.take(nearest, seats_required[nearest])
+            seats_taken += seats_required[nearest]
+            anchor = passenger_offset + nearest
+
+        assignments.append((driver_index, assigned))
+
+    span.count("candidates_scanned", remaining_passengers.scanned)
+    return assignments, np.flatnonzero(remaining_passengers.remaining).tolist()
 
-    for driver in sorted(drivers, key=lambda item: item.capacity, reverse=True):
-        assigned: list[Passenger] = []
+
+def _vrp_assignment(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    travel_times: Matrix,
+    passenger_offset: int,
+    destination_index: int | None,
+    time_limit_seconds: float,
+) -> tuple[list[tuple[int, list[int]]], list[int]]:
+    sequences, unassigned = solve_capacitated_vrp(
+        travel_times,
+        driver_nodes=list(range(len(drivers))),
+        capacities=[driver.capacity for driver in drivers],
+        passenger_nodes=[
+            passenger_offset + index for index in range(len(passengers))
+        ],
+        demands=[passenger.seats_required for passenger in passengers],
+        destination=destination_index,
+        time_limit_seconds=time_limit_seconds,
+    )
+    # Same driver order as the greedy engine so callers see a stable layout.
+    assignments = sorted(
+        enumerate(sequences), key=lambda item: drivers[item[0]].capacity, reverse=True
+    )
+    return assignments, unassigned
+
+
+def _pruned_greedy_assignment(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    locations: LocationTable,
+    passenger_offset: int,
+    provider: DistanceProvider,
+    candidate_count: int,
+    span: Any = NULL_SPAN,
+) -> tuple[list[tuple[int, list[int]]], list[int]]:
+    """Greedy assignment scoring only the haversine-nearest passengers.
+
+    Each step asks the provider for one row: anchor to the ``candidate_count``
+    closest unassigned passengers that still fit (widening the search only
+    when none of them fit), so no full matrix is ever built.
+    """
+    passenger_locations = locations.take(
+        range(passenger_offset, passenger_offset + len(passengers))
+    )
+    index = SpatialIndex(passenger_locations)
+    assignments: list[tuple[int, list[int]]] = []
+
+    for driver_index, driver in sorted(
+        enumerate(drivers), key=lambda item: item[1].capacity, reverse=True
+    ):
+        assigned: list[int] = []
         seats_taken = 0
-        anchor = driver.location
-
-        while remaining_passengers and seats_taken < driver.capacity:
-            fitting_passengers = [
-                passenger
-                for passenger in remaining_passengers
-                if seats_taken + passenger.seats_required <= driver.capacity
-            ]
+        anchor_node = driver_index
+
+        while len(index) and seats_taken < driver.capacity:
+            k = candidate_count
+            while True:
+                nearby = index.nearest(locations[anchor_node], k)
+                fitting_passengers = [
+                    passenger_index
+                    for _, passenger_index in nearby
+                    if seats_taken + passengers[passenger_index].seats_required
+                    <= driver.capacity
+                ]
+                if fitting_passengers or len(nearby) < k:
+                    break
+                k *= 2
             if not fitting_passengers:
                 break
 
-            nearest = min(
-                fitting_passengers,
-                key=lambda passenger: provider.travel_time_minutes(
-                    anchor, passenger.location
-                ),
-            )
+            span.count("candidates_scanned", len(nearby))
+            fitting_passengers = fitting_passengers[:candidate_count]
+            span.count("provider_calls")
+            anchor_row = provider.matrix_metrics(
+                locations.take([anchor_node]),
+                passenger_locations.take(fitting_passengers),
+            )["travel_time_minutes"][0]
+            nearest = fitting_passengers[int(np.argmin(anchor_row))]
             assigned.append(nearest)
-            remaining_passengers.remove(nearest)
-            seats_taken += nearest.seats_required
-            anchor = nearest.location
+            index.remove(nearest)
+            seats_taken += passengers[nearest].seats_required
+            anchor_node = passenger_offset + nearest
+
+        assignments.append((driver_index, assigned))
 
-        ordered_pickups = nearest_neighbor_tsp(
+    remaining_passengers = [
+        passenger_index
+        for passenger_index in range(len(passengers))
+        if passenger_index in index
+    ]
+    return assignments, remaining_passengers
+
+
+def _build_route(
+    driver: Driver,
+    passengers: list[Passenger],
+    assigned: list[int],
+    travel_times: Matrix,
+    distances: Matrix,
+    driver_node: int,
+    passenger_offset: int,
+    destination_node: int | None,
+    tracer: Tracer = NULL_TRACER,
+    provider: DistanceProvider | None = None,
+    locations: LocationTable | None = None,
+) -> Route:
+    """Order ``assigned`` pickups on the matrices and total up the route.
+
+    ``passengers[i]`` is matrix node ``passenger_offset + i``. When
+    ``provider`` has an estimated matrix, the ordered route is measured with
+    its ``route_legs`` over ``locations`` (indexed like the matrix nodes).
+    """
+    with tracer.span("pickup_order"):
+        ordered_pickups = solve_pickup_order(
+            travel_times,
+            driver_node,
+            [passenger_offset + passenger_index for passenger_index in assigned],
+            end=destination_node,
+        )
+    with tracer.span("pickups"):
+        pickup_order = [
+            passengers[matrix_index - passenger_offset]
+            for matrix_index in ordered_pickups
+        ]
+
+    route_stops = [driver_node, *ordered_pickups]
+    if destination_node is not None:
+        route_stops.append(destination_node)
+
+    with tracer.span("route_metrics") as span:
+        if provider is not None and provider.has_estimated_matrix:
+            if len(route_stops) > 1:
+                span.count("provider_calls")
+            legs = provider.route_legs(locations.take(route_stops))
+        else:
+            legs = indexed_route_legs(route_stops, distances, travel_times)
+    return _route_from_legs(
+        driver, [passengers[index] for index in assigned], pickup_order, legs
+    )
+
+
+def _provider_route(
+    driver: Driver,
+    passengers: list[Passenger],
+    destination: Location | None,
+    provider: DistanceProvider,
+    tracer: Tracer = NULL_TRACER,
+) -> Route | None:
+    """Route ordered by ``provider.solve_order`` and measured by its route_legs.
+
+    Returns None when the provider cannot order the stops, leaving the
+    caller to fetch a matrix and solve locally.
+    """
+    with tracer.span("solve_order") as span:
+        order = provider.solve_order(
             driver.location,
-            [passenger.location for passenger in assigned],
-            provider=provider,
+            [passenger.location for passenger in passengers],
+            end=destination,
         )
+        if order is None:
+            return None
+        # Zero or one pickup has nothing to order and makes no request.
+        if len(passengers) > 1:
+            span.count("provider_calls")
+
+    pickup_order = [passengers[index] for index in order]
+    stops = [driver.location, *(passenger.location for passenger in pickup_order)]
+    if destination is not None:
+        stops.append(destination)
+    with tracer.span("route_metrics") as span:
+        if len(stops) > 1:
+            span.count("provider_calls")
+        legs = provider.route_legs(stops)
+    return _route_from_legs(driver, passengers, pickup_order, legs)
+
+
+def _route_from_legs(
+    driver: Driver,
+    passengers: list[Passenger],
+    pickup_order: list[Passenger],
+    legs: list[tuple[float, float]],
+) -> Route:
+    leg_distances_km = [leg[0] for leg in legs]
+    leg_travel_times_minutes = [leg[1] for leg in legs]
+    return Route(
+        driver=driver,
+        passengers=passengers,
+        pickup_order=pickup_order,
+        total_distance_km=sum(leg_distances_km),
+        total_travel_time_minutes=sum(leg_travel_times_minutes),
+        unfilled_seats=driver.capacity
+        - sum(passenger.seats_required for passenger in passengers),
+        leg_distances_km=leg_distances_km,
+        leg_travel_times_minutes=leg_travel_times_minutes,
+    )
 
-        pickup_order: list[Passenger] = []
-        unmatched = assigned.copy()
-        for location in ordered_pickups:
-            for passenger in unmatched:
-                if passenger.location == location:
-                    pickup_order.append(passenger)
-                    unmatched.remove(passenger)
-                    break
 
-        route_stops = [driver.location, *[p.location for p in pickup_order]]
-        if destination:
-            route_stops.append(destination)
+def assign_passengers_to_drivers(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    destination: Location | None = None,
+    provider: DistanceProvider | None = None,
+    engine: str = "greedy",
+    time_limit_seconds: float = DEFAULT_TIME_LIMIT_SECONDS,
+    candidate_count: int | None = None,
+    tracer: Tracer | None = None,
+) -> tuple[list[Route], list[Passenger]]:
+    """Assign passengers to drivers and order each driver's pickups.
 
-        total_distance_km, total_travel_time_minutes = route_metrics(
-            route_stops, provider
+    ``engine="greedy"`` fills drivers one at a time, largest capacity first,
+    with the nearest passenger that still fits. ``engine="vrp"`` optimises
+    all drivers together (see ``vrp.solve_capacitated_vrp``), spending at
+    most ``time_limit_seconds`` on improvement moves.
+
+    With ``candidate_count`` set, the greedy engine skips the full travel-time
+    matrix and only scores the ``candidate_count`` haversine-nearest
+    passengers at each step. Each route is then ordered and measured by the
+    provider's ``solve_order`` and ``route_legs`` when it can solve orders
+    (OSRM /trip and /route), and from one small matrix per route otherwise.
+
+    Providers with an estimated matrix (``TieredProvider``) only rank with
+    it: each chosen route is measured with the provider's ``route_legs``.
+
+    ``tracer`` (e.g. ``tracing.RecordingTracer``) receives an ``assign`` span
+    with the matrix, selection and per-driver ``route`` phases, counting
+    provider calls and candidates scanned.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown assignment engine: {engine!r}")
+    if candidate_count is not None and candidate_count < 1:
+        raise ValueError("candidate_count must be at least 1")
+    if candidate_count is not None and engine != "greedy":
+        raise ValueError("candidate_count is only supported by the greedy engine")
+
+    if provider is None:
+        provider = HaversineProvider()
+    if tracer is None:
+        tracer = NULL_TRACER
+
+    if not drivers:
+        return [], passengers.copy()
+
+    with tracer.span(
+        "assign", engine=engine, drivers=len(drivers), passengers=len(passengers)
+    ):
+        return _assign(
+            drivers,
+            passengers,
+            destination,
+            provider,
+            engine,
+            time_limit_seconds,
+            candidate_count,
+            tracer,
         )
 
-        routes.append(
-            Route(
-                driver=driver,
-                passengers=assigned,
-                pickup_order=pickup_order,
-                total_distance_km=total_distance_km,
-                total_travel_time_minutes=total_travel_time_minutes,
-                unfilled_seats=driver.capacity - seats_taken,
-            )
+
+def _assign(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    destination: Location | None,
+    provider: DistanceProvider,
+    engine: str,
+    time_limit_seconds: float,
+    candidate_count: int | None,
+    tracer: Tracer,
+) -> tuple[list[Route], list[Passenger]]:
+    # Matrix layout: drivers first, then passengers, then the destination.
+    passenger_offset = len(drivers)
+    destination_index: int | None = None
+    if destination:
+        destination_index = passenger_offset + len(passengers)
+    locations = LocationTable.from_locations(
+        chain(
+            (driver.location for driver in drivers),
+            (passenger.location for passenger in passengers),
+            [destination] if destination else [],
         )
+    )
+
+    if candidate_count is not None:
+        with tracer.span("pruned_greedy", candidate_count=candidate_count) as span:
+            assignments, remaining_passengers = _pruned_greedy_assignment(
+                drivers,
+                passengers,
+                locations,
+                passenger_offset,
+                provider,
+                candidate_count,
+                span,
+            )
+        routes: list[Route] = []
+        for driver_index, assigned in assignments:
+            with tracer.span("route", driver=drivers[driver_index].user_id):
+                route = _provider_route(
+                    drivers[driver_index],
+                    [passengers[i] for i in assigned],
+                    destination,
+                    provider,
+                    tracer,
+                )
+                if route is not None:
+                    routes.append(route)
+                    continue
+                # Route-local layout: driver, its passengers, then the destination.
+                nodes = [driver_index, *(passenger_offset + i for i in assigned)]
+                if destination_index is not None:
+                    nodes.append(destination_index)
+                route_locations = locations.take(nodes)
+                with tracer.span("matrix") as span:
+                    span.count("provider_calls")
+                    if provider.has_estimated_matrix:
+                        route_matrix = provider.matrix_metrics(
+                            route_locations,
+                            route_locations,
+                            candidate_columns=range(1, len(assigned) + 1),
+                        )
+                    else:
+                        route_matrix = provider.matrix_metrics(
+                            route_locations, route_locations
+                        )
+                routes.append(
+                    _build_route(
+                        drivers[driver_index],
+                        [passengers[i] for i in assigned],
+                        list(range(len(assigned))),
+                        route_matrix["travel_time_minutes"],
+                        route_matrix["distance_km"],
+                        0,
+                        1,
+                        len(assigned) + 1 if destination_index is not None else None,
+                        tracer,
+                        provider,
+                        route_locations,
+                    )
+                )
+        return routes, [passengers[index] for index in remaining_passengers]
 
-    return routes, remaining_passengers
+    with tracer.span("matrix", symmetric=provider.is_symmetric) as span:
+        span.count("provider_calls")
+        # Symmetric providers compute and keep only the upper triangle.
+        if provider.is_symmetric:
+            metrics = provider.condensed_matrix_metrics(locations)
+        elif provider.has_estimated_matrix:
+            # Only passengers are ever picked from a row; refine just those.
+            metrics = provider.matrix_metrics(
+                locations,
+                locations,
+                candidate_columns=range(
+                    passenger_offset, passenger_offset + len(passengers)
+                ),
+            )
+        else:
+            metrics = provider.matrix_metrics(locations, locations)
+    travel_times = metrics["travel_time_minutes"]
+    distances = metrics["distance_km"]
+
+    with tracer.span(engine) as span:
+        if engine == "vrp":
+            assignments, remaining_passengers = _vrp_assignment(
+                drivers,
+                passengers,
+                travel_times,
+                passenger_offset,
+                destination_index,
+                time_limit_seconds,
+            )
+        else:
+            assignments, remaining_passengers = _greedy_assignment(
+                drivers, passengers, travel_times, passenger_offset, span
+            )
+
+    routes = []
+    for driver_index, assigned in assignments:
+        with tracer.span("route", driver=drivers[driver_index].user_id):
+            routes.append(
+                _build_route(
+                    drivers[driver_index],
+                    passengers,
+                    assigned,
+                    travel_times,
+                    distances,
+                    driver_index,
+                    passenger_offset,
+                    destination_index,
+                    tracer,
+                    provider,
+                    locations,
+                )
+            )
+    return routes, [passengers[index] for index in remaining_passengers]
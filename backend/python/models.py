@@ -1,5 +1,8 @@
+from collections.abc import Iterable, Iterator, Sequence
 from dataclasses import dataclass, field
 
+import numpy as np
+
 
 @dataclass(frozen=True)
 class Location:
@@ -7,6 +10,94 @@ class Location:
     longitude: float
 
 
+class LocationRef:
+    """Lightweight handle to one row of a LocationTable."""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: "LocationTable", index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def latitude(self) -> float:
+        return float(self.table.latitudes[self.index])
+
+    @property
+    def longitude(self) -> float:
+        return float(self.table.longitudes[self.index])
+
+    def to_location(self) -> Location:
+        return Location(self.latitude, self.longitude)
+
+    def __repr__(self) -> str:
+        return (
+            f"LocationRef(index={self.index}, "
+            f"latitude={self.latitude}, longitude={self.longitude})"
+        )
+
+
+class LocationTable:
+    """Column store of locations as parallel float64 arrays addressed by index."""
+
+    __slots__ = ("latitudes", "longitudes", "ids")
+
+    def __init__(
+        self,
+        latitudes: Sequence[float] | np.ndarray,
+        longitudes: Sequence[float] | np.ndarray,
+        ids: Sequence[int] | np.ndarray | None = None,
+    ):
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+        if ids is None:
+            self.ids = np.arange(len(self.latitudes), dtype=np.int64)
+        else:
+            self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+
+        if not (len(self.latitudes) == len(self.longitudes) == len(self.ids)):
+            raise ValueError("latitudes, longitudes and ids must have the same length")
+
+    @classmethod
+    def from_locations(cls, locations: Iterable[Location]) -> "LocationTable":
+        coordinates = [(location.latitude, location.longitude) for location in locations]
+        if not coordinates:
+            return cls([], [])
+        latitudes, longitudes = zip(*coordinates)
+        return cls(latitudes, longitudes)
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def __getitem__(self, index: int) -> LocationRef:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("LocationTable index out of range")
+        return LocationRef(self, index)
+
+    def __iter__(self) -> Iterator[LocationRef]:
+        for index in range(len(self)):
+            yield LocationRef(self, index)
+
+    def location(self, index: int) -> Location:
+        return Location(float(self.latitudes[index]), float(self.longitudes[index]))
+
+    def coordinates(self) -> list[tuple[float, float]]:
+        """Return (latitude, longitude) pairs as plain floats, e.g. for hashing."""
+        return list(zip(self.latitudes.tolist(), self.longitudes.tolist()))
+
+    def take(self, indexes: Sequence[int] | np.ndarray) -> "LocationTable":
+        """Return a new table holding the given rows, keeping their ids."""
+        selected = np.asarray(indexes, dtype=np.int64)
+        return LocationTable(
+            self.latitudes[selected], self.longitudes[selected], self.ids[selected]
+        )
+
+
+Locations = Sequence[Location] | LocationTable
+
+
 @dataclass(frozen=True)
 class User:
     user_id: str
@@ -32,3 +123,6 @@ class Route:
     total_distance_km: float = 0.0
     total_travel_time_minutes: float = 0.0
     unfilled_seats: int = 0
+    # Per-leg values along driver -> pickups -> destination, for ETAs.
+    leg_distances_km: list[float] = field(default_factory=list)
+    leg_travel_times_minutes: list[float] = field(default_factory=list)
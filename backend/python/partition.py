@@ -0,0 +1,270 @@
+import dataclasses
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import numpy as np
+
+from assignment import assign_passengers_to_drivers
+from models import Driver, Location, LocationTable, Passenger, Route
+from providers.base import DistanceProvider
+from providers.haversine import EARTH_RADIUS_KM, coordinates_radians
+
+DEFAULT_MAX_CELL_PASSENGERS = 1000
+DEFAULT_KMEANS_ITERATIONS = 12
+
+# A solved cell in index form: per route the driver index, passenger indexes
+# in assignment order and pickup order, and the Route with its totals and
+# legs (passenger lists emptied); then the unassigned indexes.
+CellRoute = tuple[int, list[int], list[int], Route]
+CellResult = tuple[list[CellRoute], list[int]]
+
+
+def _projected_km(locations: LocationTable) -> np.ndarray:
+    """Equirectangular (x, y) km around the mean latitude, shape (n, 2)."""
+    latitudes, longitudes = coordinates_radians(locations)
+    reference_cos = math.cos(float(np.mean(latitudes))) if len(latitudes) else 1.0
+    return np.column_stack(
+        (
+            longitudes * (EARTH_RADIUS_KM * reference_cos),
+            latitudes * EARTH_RADIUS_KM,
+        )
+    )
+
+
+def _squared_distances(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return (
+        np.square(points).sum(axis=1)[:, np.newaxis]
+        - 2.0 * points @ centroids.T
+        + np.square(centroids).sum(axis=1)[np.newaxis, :]
+    )
+
+
+def _kmeans(
+    points: np.ndarray, cell_count: int, iterations: int, seed: int
+) -> np.ndarray:
+    """Centroids of ``cell_count`` clusters (k-means++ seeding, Lloyd steps)."""
+    rng = np.random.default_rng(seed)
+    centroids = np.empty((cell_count, 2))
+    centroids[0] = points[rng.integers(len(points))]
+    closest = np.square(points - centroids[0]).sum(axis=1)
+    for cell in range(1, cell_count):
+        total = closest.sum()
+        if total <= 0.0:
+            centroids[cell:] = centroids[0]
+            break
+        centroids[cell] = points[rng.choice(len(points), p=closest / total)]
+        np.minimum(
+            closest, np.square(points - centroids[cell]).sum(axis=1), out=closest
+        )
+
+    for _ in range(iterations):
+        labels = _squared_distances(points, centroids).argmin(axis=1)
+        counts = np.bincount(labels, minlength=cell_count)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        occupied = counts > 0
+        updated = centroids.copy()
+        updated[occupied] = sums[occupied] / counts[occupied][:, np.newaxis]
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+    return centroids
+
+
+def _rebalance(
+    passenger_points: np.ndarray,
+    passenger_cells: np.ndarray,
+    demands: np.ndarray,
+    capacity: np.ndarray,
+    centroids: np.ndarray,
+) -> None:
+    """Move boundary passengers out of cells with more seat demand than seats.
+
+    Passengers that are cheapest to move (smallest extra distance to the
+    receiving centroid) go first, into the nearest cells with spare seats.
+    """
+    load = np.bincount(passenger_cells, weights=demands, minlength=len(centroids))
+    for cell in np.argsort(capacity - load):
+        excess = load[cell] - capacity[cell]
+        if excess <= 0:
+            break
+
+        members = np.flatnonzero(passenger_cells == cell)
+        own = np.linalg.norm(passenger_points[members] - centroids[cell], axis=1)
+        by_distance = np.argsort(np.linalg.norm(centroids - centroids[cell], axis=1))
+        for target in by_distance:
+            spare = capacity[target] - load[target]
+            if target == cell or spare <= 0:
+                continue
+
+            extra = (
+                np.linalg.norm(passenger_points[members] - centroids[target], axis=1)
+                - own
+            )
+            moved = []
+            for position in np.argsort(extra):
+                demand = demands[members[position]]
+                if demand <= spare and excess > 0:
+                    moved.append(position)
+                    spare -= demand
+                    excess -= demand
+            for position in moved:
+                passenger_cells[members[position]] = target
+                load[cell] -= demands[members[position]]
+                load[target] += demands[members[position]]
+            if moved:
+                keep = np.ones(len(members), dtype=bool)
+                keep[moved] = False
+                members = members[keep]
+                own = own[keep]
+            if excess <= 0:
+                break
+
+
+def partition_batch(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    max_cell_passengers: int = DEFAULT_MAX_CELL_PASSENGERS,
+    seed: int = 0,
+) -> list[tuple[list[int], list[int]]]:
+    """Split a batch into spatial cells of (driver indexes, passenger indexes).
+
+    Drivers and passengers are clustered together with k-means on projected
+    coordinates so that each cell holds roughly ``max_cell_passengers``
+    passengers. Cells whose passengers need more seats than their drivers
+    offer hand their boundary passengers to the nearest cells with room.
+    Empty cells are dropped.
+    """
+    if not drivers or not passengers:
+        return [(list(range(len(drivers))), list(range(len(passengers))))]
+
+    cell_count = min(
+        math.ceil(len(passengers) / max(max_cell_passengers, 1)), len(drivers)
+    )
+    if cell_count <= 1:
+        return [(list(range(len(drivers))), list(range(len(passengers))))]
+
+    points = _projected_km(
+        LocationTable.from_locations(
+            [user.location for user in drivers] + [user.location for user in passengers]
+        )
+    )
+
+    centroids = _kmeans(points, cell_count, DEFAULT_KMEANS_ITERATIONS, seed)
+    driver_points = points[: len(drivers)]
+    passenger_points = points[len(drivers) :]
+    driver_cells = _squared_distances(driver_points, centroids).argmin(axis=1)
+    passenger_cells = _squared_distances(passenger_points, centroids).argmin(axis=1)
+
+    capacity = np.bincount(
+        driver_cells,
+        weights=np.array([driver.capacity for driver in drivers], dtype=np.float64),
+        minlength=cell_count,
+    )
+    demands = np.array(
+        [passenger.seats_required for passenger in passengers], dtype=np.float64
+    )
+    _rebalance(passenger_points, passenger_cells, demands, capacity, centroids)
+
+    cells = []
+    for cell in range(cell_count):
+        cell_drivers = np.flatnonzero(driver_cells == cell).tolist()
+        cell_passengers = np.flatnonzero(passenger_cells == cell).tolist()
+        if cell_drivers or cell_passengers:
+            cells.append((cell_drivers, cell_passengers))
+    return cells
+
+
+def _solve_cell(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    destination: Location | None,
+    provider: DistanceProvider | None,
+    options: dict[str, Any],
+) -> CellResult:
+    """Solve one cell; module level so ProcessPoolExecutor can pickle it."""
+    routes, unassigned = assign_passengers_to_drivers(
+        drivers, passengers, destination=destination, provider=provider, **options
+    )
+    # Positions, not objects, go back to the parent so the merged result
+    # refers to the caller's own Driver and Passenger instances.
+    driver_position = {id(driver): index for index, driver in enumerate(drivers)}
+    passenger_position = {
+        id(passenger): index for index, passenger in enumerate(passengers)
+    }
+    return (
+        [
+            (
+                driver_position[id(route.driver)],
+                [passenger_position[id(p)] for p in route.passengers],
+                [passenger_position[id(p)] for p in route.pickup_order],
+                dataclasses.replace(route, passengers=[], pickup_order=[]),
+            )
+            for route in routes
+        ],
+        [passenger_position[id(p)] for p in unassigned],
+    )
+
+
+def assign_passengers_partitioned(
+    drivers: list[Driver],
+    passengers: list[Passenger],
+    destination: Location | None = None,
+    provider: DistanceProvider | None = None,
+    max_cell_passengers: int = DEFAULT_MAX_CELL_PASSENGERS,
+    max_workers: int | None = None,
+    **options: Any,
+) -> tuple[list[Route], list[Passenger]]:
+    """Solve a large batch cell by cell, in parallel worker processes.
+
+    The batch is split with ``partition_batch`` and each cell is handed to
+    ``assign_passengers_to_drivers`` (``options`` such as ``engine`` or
+    ``candidate_count`` are passed through) on a ``ProcessPoolExecutor``, so
+    ``provider`` must be picklable. ``max_workers=1`` or a single cell
+    solves in-process. Routes come back in the same driver order as
+    ``assign_passengers_to_drivers``, followed by the unassigned passengers
+    in input order.
+    """
+    cells = partition_batch(drivers, passengers, max_cell_passengers)
+    jobs = [
+        (
+            [drivers[i] for i in cell_drivers],
+            [passengers[i] for i in cell_passengers],
+            destination,
+            provider,
+            options,
+        )
+        for cell_drivers, cell_passengers in cells
+    ]
+
+    if len(jobs) == 1 or max_workers == 1:
+        results = [_solve_cell(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_solve_cell, *zip(*jobs)))
+
+    indexed_routes: list[tuple[int, Route]] = []
+    unassigned: list[int] = []
+    for (cell_drivers, cell_passengers), (cell_routes, cell_unassigned) in zip(
+        cells, results
+    ):
+        for driver, assigned, pickups, route in cell_routes:
+            driver_index = cell_drivers[driver]
+            indexed_routes.append(
+                (
+                    driver_index,
+                    dataclasses.replace(
+                        route,
+                        driver=drivers[driver_index],
+                        passengers=[passengers[cell_passengers[i]] for i in assigned],
+                        pickup_order=[passengers[cell_passengers[i]] for i in pickups],
+                    ),
+                )
+            )
+        unassigned.extend(cell_passengers[i] for i in cell_unassigned)
+
+    indexed_routes.sort(key=lambda item: (-drivers[item[0]].capacity, item[0]))
+    return [route for _, route in indexed_routes], [
+        passengers[i] for i in sorted(unassigned)
+    ]
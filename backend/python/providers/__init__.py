@@ -1,5 +1,26 @@
 from providers.base import DistanceProvider
+from providers.cache import LRUMetricsCache, MetricsCache, SQLiteMetricsCache
+from providers.calibrated import CalibratedProvider, CalibrationReport
+from providers.condensed import CondensedMatrix, condensed_index
 from providers.haversine import HaversineProvider
+from providers.instrumentation import InstrumentedProvider, ProviderMetrics
 from providers.osrm import OSRMProvider
+from providers.osrm_async import AsyncOSRMProvider
+from providers.tiered import TieredProvider
 
-__all__ = ["DistanceProvider", "HaversineProvider", "OSRMProvider"]
+__all__ = [
+    "AsyncOSRMProvider",
+    "CalibratedProvider",
+    "CalibrationReport",
+    "CondensedMatrix",
+    "DistanceProvider",
+    "HaversineProvider",
+    "InstrumentedProvider",
+    "LRUMetricsCache",
+    "MetricsCache",
+    "OSRMProvider",
+    "ProviderMetrics",
+    "SQLiteMetricsCache",
+    "TieredProvider",
+    "condensed_index",
+]
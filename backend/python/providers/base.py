@@ -1,31 +1,163 @@
-from abc import ABC, abstractmethod
+from abc import ABC
 
-from models import Location
+import numpy as np
+
+from models import Location, Locations, LocationTable
+from providers.condensed import CondensedMatrix
+
+# One (distance_km, travel_time_minutes) cell of a matrix_metrics result.
+METRICS_DTYPE = np.dtype(
+    [("distance_km", np.float64), ("travel_time_minutes", np.float64)]
+)
 
 
 class DistanceProvider(ABC):
-    """Abstract base for distance calculation providers."""
+    """Abstract base for distance calculation providers.
+
+    Subclasses implement ``metrics`` and ``matrix_metrics``, which produce
+    distance and travel time from one computation or request; the
+    single-quantity methods are derived from them and can be overridden
+    when one quantity alone is cheaper. Providers written against the
+    older interface, which only override ``distance_km``,
+    ``travel_time_minutes`` and their matrix variants, keep working: the
+    combined methods then fall back to those.
+
+    Providers whose metrics satisfy metrics(a, b) == metrics(b, a) set
+    ``is_symmetric``; callers may then ask for ``condensed_matrix_metrics``
+    and store only the upper triangle of a self-matrix.
+
+    Providers whose ``matrix_metrics`` cells may be estimates, good for
+    ranking but not for reporting, set ``has_estimated_matrix``; callers
+    then measure the routes they pick with ``route_legs``, and may pass
+    ``candidate_columns`` to ``matrix_metrics`` so only the columns they
+    choose from are refined.
+
+    Providers backed by a routing service may solve a stop order
+    server-side (``solve_order``) and measure the result with one
+    multi-waypoint ``route_legs`` request; callers that would otherwise
+    fetch a matrix just to order a route use those when offered.
+    """
+
+    is_symmetric: bool = False
+    has_estimated_matrix: bool = False
+
+    def _overrides(self, *names: str) -> bool:
+        return all(
+            getattr(type(self), name) is not getattr(DistanceProvider, name)
+            for name in names
+        )
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        """Return (distance_km, travel_time_minutes) between two locations."""
+        if not self._overrides("distance_km", "travel_time_minutes"):
+            raise NotImplementedError(f"{type(self).__name__} must implement metrics")
+        return (
+            self.distance_km(origin, destination),
+            self.travel_time_minutes(origin, destination),
+        )
+
+    def matrix_metrics(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        """Return an (origins, destinations) array of ``METRICS_DTYPE`` cells."""
+        result = np.empty((len(origins), len(destinations)), dtype=METRICS_DTYPE)
+        if self._overrides("matrix_distances_km", "matrix_travel_times_minutes"):
+            result["distance_km"] = np.asarray(
+                self.matrix_distances_km(origins, destinations), dtype=np.float64
+            ).reshape(result.shape)
+            result["travel_time_minutes"] = np.asarray(
+                self.matrix_travel_times_minutes(origins, destinations),
+                dtype=np.float64,
+            ).reshape(result.shape)
+            return result
+
+        for row, origin in enumerate(origins):
+            for column, destination in enumerate(destinations):
+                result[row, column] = self.metrics(origin, destination)
+        return result
 
-    @abstractmethod
     def distance_km(self, origin: Location, destination: Location) -> float:
         """Calculate distance between two locations in km."""
-        pass
+        return self.metrics(origin, destination)[0]
 
-    @abstractmethod
     def matrix_distances_km(
-        self, origins: list[Location], destinations: list[Location]
+        self, origins: Locations, destinations: Locations
     ) -> list[list[float]]:
         """Calculate distance matrix for multiple origins and destinations."""
-        pass
+        return self.matrix_metrics(origins, destinations)["distance_km"].tolist()
 
-    @abstractmethod
     def travel_time_minutes(self, origin: Location, destination: Location) -> float:
         """Calculate travel time between two locations in minutes."""
-        pass
+        return self.metrics(origin, destination)[1]
 
-    @abstractmethod
     def matrix_travel_times_minutes(
-        self, origins: list[Location], destinations: list[Location]
+        self, origins: Locations, destinations: Locations
     ) -> list[list[float]]:
         """Calculate travel time matrix for multiple origins and destinations."""
-        pass
+        return self.matrix_metrics(origins, destinations)[
+            "travel_time_minutes"
+        ].tolist()
+
+    def condensed_matrix_metrics(self, locations: Locations) -> CondensedMatrix:
+        """Upper triangle of ``matrix_metrics(locations, locations)``.
+
+        Only valid for symmetric providers. The default condenses the full
+        matrix; symmetric providers override it to compute half the cells.
+        """
+        if not self.is_symmetric:
+            raise ValueError(
+                f"{type(self).__name__} is not symmetric; use matrix_metrics"
+            )
+
+        rows, columns = np.triu_indices(len(locations), k=1)
+        full = self.matrix_metrics(locations, locations)
+        return CondensedMatrix(full[rows, columns], len(locations))
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        """``METRICS_DTYPE`` cells for each ``origins[i] -> destinations[i]``.
+
+        Lets callers refine a sparse set of cells (e.g. the best few
+        candidates per row) without a full matrix. The default asks
+        ``metrics`` per pair; batch providers override it.
+        """
+        if len(origins) != len(destinations):
+            raise ValueError("origins and destinations must have the same length")
+
+        return np.array(
+            [
+                self.metrics(origin, destination)
+                for origin, destination in zip(origins, destinations)
+            ],
+            dtype=METRICS_DTYPE,
+        ).reshape(len(origins))
+
+    def solve_order(
+        self, start: Location, stops: Locations, end: Location | None = None
+    ) -> list[int] | None:
+        """Visiting order of ``stops`` (indexes) from ``start``, or None.
+
+        None means the provider has no server-side solver or could not
+        solve this instance; the caller then orders the stops itself.
+        """
+        return None
+
+    def route_legs(self, stops: Locations) -> list[tuple[float, float]]:
+        """(distance_km, travel_time_minutes) of each leg between consecutive stops.
+
+        The default asks ``pair_metrics`` for the consecutive pairs only;
+        providers with a native multi-stop route call override it.
+        """
+        if len(stops) < 2:
+            return []
+
+        if isinstance(stops, LocationTable):
+            origins, destinations = (
+                stops.take(range(len(stops) - 1)),
+                stops.take(range(1, len(stops))),
+            )
+        else:
+            origins, destinations = stops[:-1], stops[1:]
+        legs = self.pair_metrics(origins, destinations)
+        return list(
+            zip(legs["distance_km"].tolist(), legs["travel_time_minutes"].tolist())
+        )
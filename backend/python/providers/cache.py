@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+CacheKey = tuple[float, float, float, float]
+Metrics = tuple[float, float]
+
+DEFAULT_COORDINATE_PRECISION = 5
+# Rough footprint of one entry: the 4-float key tuple, the 2-float value tuple
+# and the OrderedDict link, measured on CPython 3.11.
+APPROX_ENTRY_BYTES = 400
+
+
+def dataset_version_from_file(path: str | os.PathLike[str]) -> str:
+    """Read the OSRM dataset version stamp written after osrm-extract, if any."""
+    try:
+        return Path(path).read_text(encoding="utf-8").strip()
+    except OSError:
+        return ""
+
+
+class LRUMetricsCache:
+    """Bounded in-memory metrics cache with least-recently-used eviction.
+
+    Each key maps to one combined ``(distance_km, travel_time_minutes)``
+    entry. The bound is ``max_entries`` or ``max_bytes`` (converted with
+    ``APPROX_ENTRY_BYTES``), whichever is smaller; no bound means unlimited.
+    """
+
+    def __init__(self, max_entries: int | None = None, max_bytes: int | None = None):
+        limits = []
+        if max_entries is not None:
+            limits.append(max(max_entries, 0))
+        if max_bytes is not None:
+            limits.append(max(max_bytes, 0) // APPROX_ENTRY_BYTES)
+        self.max_entries = min(limits) if limits else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[CacheKey, Metrics] = OrderedDict()
+
+    def get(self, key: CacheKey) -> Metrics | None:
+        metrics = self._entries.get(key)
+        if metrics is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return metrics
+
+    def peek(self, key: CacheKey) -> Metrics | None:
+        """Look ``key`` up without touching recency or the hit/miss counters."""
+        return self._entries.get(key)
+
+    def set(self, key: CacheKey, metrics: Metrics) -> None:
+        if self.max_entries == 0:
+            return
+
+        self._entries[key] = metrics
+        self._entries.move_to_end(key)
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, entries: dict[CacheKey, Metrics]) -> None:
+        for key, metrics in entries.items():
+            self.set(key, metrics)
+
+    def items(self) -> list[tuple[CacheKey, Metrics]]:
+        """Snapshot of every entry, least recently used first."""
+        return list(self._entries.items())
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int | None]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MetricsCache(ABC):
+    """Abstract base for persistent (distance_km, travel_time_minutes) stores."""
+
+    @abstractmethod
+    def get_many(
+        self, profile: str, keys: Iterable[CacheKey]
+    ) -> dict[CacheKey, Metrics]:
+        """Return the stored metrics for the keys that are present and fresh."""
+        pass
+
+    @abstractmethod
+    def set_many(self, profile: str, entries: dict[CacheKey, Metrics]) -> None:
+        """Store metrics for the given keys, replacing existing entries."""
+        pass
+
+    @abstractmethod
+    def invalidate(self) -> None:
+        """Drop every stored entry."""
+        pass
+
+    @abstractmethod
+    def items(self, profile: str) -> Iterator[tuple[CacheKey, Metrics]]:
+        """Yield every fresh stored entry for ``profile``."""
+        pass
+
+    def get(self, profile: str, key: CacheKey) -> Metrics | None:
+        return self.get_many(profile, [key]).get(key)
+
+    def set(self, profile: str, key: CacheKey, metrics: Metrics) -> None:
+        self.set_many(profile, {key: metrics})
+
+
+class SQLiteMetricsCache(MetricsCache):
+    """SQLite-backed metrics cache shared by every process that opens the same file.
+
+    Coordinates are rounded to ``precision`` decimal places (5 is roughly one
+    metre) so nearby geocodes share entries. Entries older than
+    ``ttl_seconds`` or written for a different ``dataset_version`` are ignored
+    and removed by ``purge``; bump the version whenever the OSM extract is
+    rebuilt.
+    """
+
+    _LOOKUP_BATCH_SIZE = 200
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        ttl_seconds: float | None = None,
+        dataset_version: str | None = None,
+        precision: int = DEFAULT_COORDINATE_PRECISION,
+        timeout: float = 30.0,
+    ):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.dataset_version = (
+            dataset_version
+            if dataset_version is not None
+            else os.getenv("OSRM_DATASET_VERSION", "")
+        )
+        self.precision = max(precision, 0)
+        self._scale = 10**self.precision
+        self.timeout = timeout
+        self._connect()
+
+    def _connect(self) -> None:
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, timeout=self.timeout, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS osrm_metrics (
+                    profile TEXT NOT NULL,
+                    origin_lat INTEGER NOT NULL,
+                    origin_lon INTEGER NOT NULL,
+                    destination_lat INTEGER NOT NULL,
+                    destination_lon INTEGER NOT NULL,
+                    distance_km REAL NOT NULL,
+                    travel_time_minutes REAL NOT NULL,
+                    dataset_version TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (
+                        profile, origin_lat, origin_lon, destination_lat, destination_lon
+                    )
+                ) WITHOUT ROWID
+                """
+            )
+
+    def __getstate__(self) -> dict[str, object]:
+        # Connections and locks cannot cross process boundaries; the copy
+        # reopens the same file (e.g. in a ProcessPoolExecutor worker).
+        state = self.__dict__.copy()
+        del state["_lock"], state["_connection"]
+        return state
+
+    def __setstate__(self, state: dict[str, object]) -> None:
+        self.__dict__.update(state)
+        self._connect()
+
+    def _row_key(self, key: CacheKey) -> tuple[int, int, int, int]:
+        scale = self._scale
+        return (
+            round(key[0] * scale),
+            round(key[1] * scale),
+            round(key[2] * scale),
+            round(key[3] * scale),
+        )
+
+    def _oldest_fresh_timestamp(self) -> float:
+        if self.ttl_seconds is None:
+            return float("-inf")
+        return time.time() - self.ttl_seconds
+
+    def get_many(
+        self, profile: str, keys: Iterable[CacheKey]
+    ) -> dict[CacheKey, Metrics]:
+        keys_by_row: dict[tuple[int, int, int, int], list[CacheKey]] = {}
+        for key in keys:
+            keys_by_row.setdefault(self._row_key(key), []).append(key)
+
+        if not keys_by_row:
+            return {}
+
+        oldest_fresh = self._oldest_fresh_timestamp()
+        row_keys = list(keys_by_row)
+        found: dict[CacheKey, Metrics] = {}
+        with self._lock:
+            for start in range(0, len(row_keys), self._LOOKUP_BATCH_SIZE):
+                batch = row_keys[start : start + self._LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("(?, ?, ?, ?)" for _ in batch)
+                parameters: list[object] = [profile, self.dataset_version, oldest_fresh]
+                for row_key in batch:
+                    parameters.extend(row_key)
+
+                rows = self._connection.execute(
+                    f"""
+                    SELECT origin_lat, origin_lon, destination_lat, destination_lon,
+                           distance_km, travel_time_minutes
+                    FROM osrm_metrics
+                    WHERE profile = ? AND dataset_version = ? AND created_at >= ?
+                      AND (origin_lat, origin_lon, destination_lat, destination_lon)
+                          IN (VALUES {placeholders})
+                    """,
+                    parameters,
+                ).fetchall()
+
+                for row in rows:
+                    metrics = (row[4], row[5])
+                    for key in keys_by_row[row[:4]]:
+                        found[key] = metrics
+
+        return found
+
+    def set_many(self, profile: str, entries: dict[CacheKey, Metrics]) -> None:
+        if not entries:
+            return
+
+        now = time.time()
+        rows = [
+            (
+                profile,
+                *self._row_key(key),
+                distance_km,
+                travel_time_minutes,
+                self.dataset_version,
+                now,
+            )
+            for key, (distance_km, travel_time_minutes) in entries.items()
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                """
+                INSERT OR REPLACE INTO osrm_metrics (
+                    profile, origin_lat, origin_lon, destination_lat, destination_lon,
+                    distance_km, travel_time_minutes, dataset_version, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+
+    def invalidate(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM osrm_metrics")
+
+    def items(self, profile: str) -> Iterator[tuple[CacheKey, Metrics]]:
+        # Keys come back at the stored precision, not as originally written.
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT origin_lat, origin_lon, destination_lat, destination_lon,
+                       distance_km, travel_time_minutes
+                FROM osrm_metrics
+                WHERE profile = ? AND dataset_version = ? AND created_at >= ?
+                """,
+                (profile, self.dataset_version, self._oldest_fresh_timestamp()),
+            ).fetchall()
+
+        scale = self._scale
+        for row in rows:
+            yield (
+                (row[0] / scale, row[1] / scale, row[2] / scale, row[3] / scale),
+                (row[4], row[5]),
+            )
+
+    def purge(self) -> int:
+        """Delete expired entries and entries from other dataset versions."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM osrm_metrics WHERE dataset_version != ? OR created_at < ?",
+                (self.dataset_version, self._oldest_fresh_timestamp()),
+            )
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM osrm_metrics"
+            ).fetchone()
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,398 @@
+import json
+import math
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from models import Location, Locations, LocationTable
+from providers.base import METRICS_DTYPE, DistanceProvider
+from providers.cache import CacheKey, Metrics
+from providers.condensed import CondensedMatrix
+from providers.haversine import (
+    DEFAULT_AVERAGE_SPEED_KMPH,
+    HaversineProvider,
+    coordinates_radians,
+    haversine_matrix_km,
+    haversine_pairs_km,
+)
+
+DEFAULT_CELL_SIZE_KM = 2.0
+DEFAULT_DETOUR_FACTOR = 1.3
+DEFAULT_PRIOR_SAMPLES = 5.0
+DEFAULT_HOLDOUT_FRACTION = 0.2
+# Pairs closer than this are dominated by snapping noise, not the road network.
+MIN_SAMPLE_DISTANCE_KM = 0.2
+KM_PER_DEGREE_LATITUDE = 111.32
+_COLUMN_OFFSET = 1 << 31
+MAX_FIT_ITERATIONS = 200
+FIT_TOLERANCE = 1e-6
+
+# Radian latitudes and longitudes with per-point detour and pace factors.
+_PointFactors = tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+@dataclass
+class CalibrationReport:
+    """Sample counts and held-out errors of one ``CalibratedProvider.fit``.
+
+    Errors are mean absolute percentage errors against the held-out OSRM
+    samples; ``baseline_*`` are those of a plain ``HaversineProvider`` on
+    the same samples.
+    """
+
+    samples: int
+    holdout_samples: int
+    cells: int
+    distance_mape: float
+    travel_time_mape: float
+    travel_time_mae_minutes: float
+    baseline_distance_mape: float
+    baseline_travel_time_mape: float
+
+
+class CalibratedProvider(DistanceProvider):
+    """Haversine-cost provider with per-grid-cell detour and speed factors.
+
+    A trip's road distance is its great-circle distance times the mean
+    detour factor of its origin and destination cells, and its travel time
+    is that distance times their mean pace (minutes per road km). Cells
+    are ``cell_size_km`` squares; cells without samples use the global
+    factors. Both factors are symmetric in origin and destination, so the
+    model is too.
+
+    ``fit`` estimates the factors from OSRM samples (see
+    ``OSRMProvider.cached_samples``); ``save`` and ``load`` persist them as
+    JSON. Unfitted, the provider is haversine times ``detour_factor`` at
+    ``average_speed_kmph``.
+    """
+
+    is_symmetric = True
+
+    def __init__(
+        self,
+        cell_size_km: float = DEFAULT_CELL_SIZE_KM,
+        detour_factor: float = DEFAULT_DETOUR_FACTOR,
+        average_speed_kmph: float = DEFAULT_AVERAGE_SPEED_KMPH,
+        reference_latitude: float = 0.0,
+    ):
+        if cell_size_km <= 0:
+            raise ValueError("cell_size_km must be positive")
+        if average_speed_kmph <= 0:
+            raise ValueError("average_speed_kmph must be positive")
+
+        self.cell_size_km = cell_size_km
+        self.reference_latitude = reference_latitude
+        self.detour_factor = detour_factor
+        self.pace_minutes_per_km = 60.0 / average_speed_kmph
+        # Sorted packed cell keys with the factors fitted for each cell.
+        self._cell_keys = np.empty(0, dtype=np.int64)
+        self._cell_detours = np.empty(0)
+        self._cell_paces = np.empty(0)
+
+    @property
+    def cells(self) -> int:
+        return len(self._cell_keys)
+
+    def _cell_key(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """Packed grid cell of each point (coordinates in degrees)."""
+        latitude_step = self.cell_size_km / KM_PER_DEGREE_LATITUDE
+        longitude_step = latitude_step / max(
+            math.cos(math.radians(self.reference_latitude)), 1e-6
+        )
+        rows = np.floor(latitudes / latitude_step).astype(np.int64)
+        columns = np.floor(longitudes / longitude_step).astype(np.int64)
+        return (rows << 32) + (columns + _COLUMN_OFFSET)
+
+    def _factors(
+        self, latitudes: np.ndarray, longitudes: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(detour, pace) per point, from its cell or the global factors."""
+        detours = np.full(len(latitudes), self.detour_factor)
+        paces = np.full(len(latitudes), self.pace_minutes_per_km)
+        if self.cells:
+            keys = self._cell_key(latitudes, longitudes)
+            positions = np.searchsorted(self._cell_keys, keys)
+            positions[positions == self.cells] = 0
+            fitted = self._cell_keys[positions] == keys
+            detours[fitted] = self._cell_detours[positions[fitted]]
+            paces[fitted] = self._cell_paces[positions[fitted]]
+        return detours, paces
+
+    def _location_factors(self, locations: Locations) -> _PointFactors:
+        """Radian coordinates plus per-point detour and pace factors."""
+        latitudes, longitudes = coordinates_radians(locations)
+        return (
+            latitudes,
+            longitudes,
+            *self._factors(np.degrees(latitudes), np.degrees(longitudes)),
+        )
+
+    def _pairs(self, origins: _PointFactors, destinations: _PointFactors) -> np.ndarray:
+        origin_lat, origin_lon, origin_detour, origin_pace = origins
+        destination_lat, destination_lon, destination_detour, destination_pace = (
+            destinations
+        )
+        distances = haversine_pairs_km(
+            origin_lat, origin_lon, destination_lat, destination_lon
+        )
+        distances *= 0.5 * (origin_detour + destination_detour)
+
+        result = np.empty(len(distances), dtype=METRICS_DTYPE)
+        result["distance_km"] = distances
+        result["travel_time_minutes"] = distances * (
+            0.5 * (origin_pace + destination_pace)
+        )
+        return result
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        cell = self.pair_metrics([origin], [destination])[0]
+        return float(cell["distance_km"]), float(cell["travel_time_minutes"])
+
+    def matrix_metrics(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        origin_lat, origin_lon, origin_detour, origin_pace = self._location_factors(
+            origins
+        )
+        destination_lat, destination_lon, destination_detour, destination_pace = (
+            self._location_factors(destinations)
+        )
+
+        distances = haversine_matrix_km(
+            origin_lat, origin_lon, destination_lat, destination_lon
+        )
+        factors = np.add.outer(origin_detour, destination_detour)
+        factors *= 0.5
+        distances *= factors
+        np.add.outer(origin_pace, destination_pace, out=factors)
+        factors *= 0.5
+        factors *= distances
+
+        result = np.empty(distances.shape, dtype=METRICS_DTYPE)
+        result["distance_km"] = distances
+        result["travel_time_minutes"] = factors
+        return result
+
+    def condensed_matrix_metrics(self, locations: Locations) -> CondensedMatrix:
+        _, _, detours, paces = self._location_factors(locations)
+        condensed = HaversineProvider().condensed_matrix_metrics(locations)
+        distances = condensed.values["distance_km"]
+        times = condensed.values["travel_time_minutes"]
+        start = 0
+        for row in range(len(locations) - 1):
+            stop = start + len(locations) - row - 1
+            cells = distances[start:stop]
+            cells *= 0.5 * (detours[row] + detours[row + 1 :])
+            np.multiply(
+                cells, 0.5 * (paces[row] + paces[row + 1 :]), out=times[start:stop]
+            )
+            start = stop
+        return condensed
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        if len(origins) != len(destinations):
+            raise ValueError("origins and destinations must have the same length")
+
+        return self._pairs(
+            self._location_factors(origins), self._location_factors(destinations)
+        )
+
+    def route_legs(self, stops: Locations) -> list[tuple[float, float]]:
+        if len(stops) < 2:
+            return []
+
+        factors = self._location_factors(stops)
+        legs = self._pairs(
+            tuple(values[:-1] for values in factors),
+            tuple(values[1:] for values in factors),
+        )
+        return list(
+            zip(legs["distance_km"].tolist(), legs["travel_time_minutes"].tolist())
+        )
+
+    def fit(
+        self,
+        samples: Mapping[CacheKey, Metrics],
+        holdout_fraction: float = DEFAULT_HOLDOUT_FRACTION,
+        prior_samples: float = DEFAULT_PRIOR_SAMPLES,
+        seed: int = 0,
+    ) -> CalibrationReport:
+        """Fit the factors to OSRM samples and report held-out accuracy.
+
+        A random ``holdout_fraction`` of the samples is kept aside, the
+        model is fitted on the rest and scored on it, then refitted on all
+        samples. Cell factors are a least-squares fit of the samples
+        starting or ending in each cell, shrunk towards the global factors
+        by ``prior_samples`` pseudo-samples so sparse cells stay stable.
+        """
+        keys = np.array(list(samples.keys()), dtype=np.float64).reshape(-1, 4)
+        values = np.array(list(samples.values()), dtype=np.float64).reshape(-1, 2)
+        crow_km = haversine_pairs_km(*np.radians(keys).T)
+        usable = (crow_km >= MIN_SAMPLE_DISTANCE_KM) & (values > 0.0).all(axis=1)
+        keys, values, crow_km = keys[usable], values[usable], crow_km[usable]
+        if not len(keys):
+            raise ValueError("no usable samples to fit")
+
+        self.reference_latitude = float(
+            np.mean(np.concatenate([keys[:, 0], keys[:, 2]]))
+        )
+        rng = np.random.default_rng(seed)
+        holdout = rng.random(len(keys)) < holdout_fraction
+        if holdout.all():
+            holdout[:] = False
+
+        if holdout.any():
+            self._fit_cells(
+                keys[~holdout], values[~holdout], crow_km[~holdout], prior_samples
+            )
+            errors = self._errors(keys[holdout], values[holdout])
+        self._fit_cells(keys, values, crow_km, prior_samples)
+        if not holdout.any():
+            # Too few samples to hold any out: report the in-sample error.
+            errors = self._errors(keys, values)
+        return CalibrationReport(
+            samples=len(keys),
+            holdout_samples=int(holdout.sum()),
+            cells=self.cells,
+            **errors,
+        )
+
+    def _fit_cells(
+        self,
+        keys: np.ndarray,
+        values: np.ndarray,
+        crow_km: np.ndarray,
+        prior_samples: float,
+    ) -> None:
+        road_km, minutes = values[:, 0], values[:, 1]
+        self.detour_factor = float(road_km.sum() / crow_km.sum())
+        self.pace_minutes_per_km = float(minutes.sum() / road_km.sum())
+
+        cell_keys, cell_indexes = np.unique(
+            np.concatenate(
+                [
+                    self._cell_key(keys[:, 0], keys[:, 1]),
+                    self._cell_key(keys[:, 2], keys[:, 3]),
+                ]
+            ),
+            return_inverse=True,
+        )
+        origin_cells, destination_cells = np.split(cell_indexes.ravel(), 2)
+        self._cell_keys = cell_keys
+        self._cell_detours = _fit_endpoint_factors(
+            origin_cells,
+            destination_cells,
+            crow_km,
+            road_km,
+            self.detour_factor,
+            prior_samples,
+        )
+        self._cell_paces = _fit_endpoint_factors(
+            origin_cells,
+            destination_cells,
+            road_km,
+            minutes,
+            self.pace_minutes_per_km,
+            prior_samples,
+        )
+
+    def _errors(self, keys: np.ndarray, values: np.ndarray) -> dict[str, float]:
+        origins = LocationTable(keys[:, 0], keys[:, 1])
+        destinations = LocationTable(keys[:, 2], keys[:, 3])
+        predicted = self.pair_metrics(origins, destinations)
+        baseline = HaversineProvider().pair_metrics(origins, destinations)
+        road_km, minutes = values[:, 0], values[:, 1]
+        return {
+            "distance_mape": _mape(predicted["distance_km"], road_km),
+            "travel_time_mape": _mape(predicted["travel_time_minutes"], minutes),
+            "travel_time_mae_minutes": float(
+                np.mean(np.abs(predicted["travel_time_minutes"] - minutes))
+            ),
+            "baseline_distance_mape": _mape(baseline["distance_km"], road_km),
+            "baseline_travel_time_mape": _mape(
+                baseline["travel_time_minutes"], minutes
+            ),
+        }
+
+    def save(self, path: str | os.PathLike[str]) -> None:
+        """Write the fitted coefficients as JSON."""
+        Path(path).write_text(
+            json.dumps(
+                {
+                    "cell_size_km": self.cell_size_km,
+                    "reference_latitude": self.reference_latitude,
+                    "detour_factor": self.detour_factor,
+                    "pace_minutes_per_km": self.pace_minutes_per_km,
+                    "cell_keys": self._cell_keys.tolist(),
+                    "cell_detours": self._cell_detours.tolist(),
+                    "cell_paces": self._cell_paces.tolist(),
+                }
+            ),
+            encoding="utf-8",
+        )
+
+    @classmethod
+    def load(cls, path: str | os.PathLike[str]) -> "CalibratedProvider":
+        """Read coefficients written by ``save``."""
+        state = json.loads(Path(path).read_text(encoding="utf-8"))
+        provider = cls(
+            cell_size_km=state["cell_size_km"],
+            detour_factor=state["detour_factor"],
+            average_speed_kmph=60.0 / state["pace_minutes_per_km"],
+            reference_latitude=state["reference_latitude"],
+        )
+        provider.pace_minutes_per_km = state["pace_minutes_per_km"]
+        provider._cell_keys = np.array(state["cell_keys"], dtype=np.int64)
+        provider._cell_detours = np.array(state["cell_detours"], dtype=np.float64)
+        provider._cell_paces = np.array(state["cell_paces"], dtype=np.float64)
+        return provider
+
+
+def _fit_endpoint_factors(
+    origin_cells: np.ndarray,
+    destination_cells: np.ndarray,
+    inputs: np.ndarray,
+    targets: np.ndarray,
+    global_factor: float,
+    prior_samples: float,
+) -> np.ndarray:
+    """Per-cell factors f minimising sum (target - input * (f_o + f_d) / 2)^2.
+
+    Ridge-regularised towards ``global_factor`` with the weight of
+    ``prior_samples`` typical samples and solved by damped Jacobi
+    iteration, which only needs per-cell sums (np.bincount).
+    """
+    cell_count = int(max(origin_cells.max(), destination_cells.max())) + 1
+    half_inputs = 0.5 * inputs
+    prior = prior_samples * float(np.mean(np.square(half_inputs)))
+    curvature = (
+        np.bincount(origin_cells, np.square(half_inputs), cell_count)
+        + np.bincount(destination_cells, np.square(half_inputs), cell_count)
+        + prior
+    )
+    factors = np.full(cell_count, global_factor)
+    for _ in range(MAX_FIT_ITERATIONS):
+        # Each endpoint's share of the target, given the other endpoint.
+        origin_share = half_inputs * (
+            targets - half_inputs * factors[destination_cells]
+        )
+        destination_share = half_inputs * (
+            targets - half_inputs * factors[origin_cells]
+        )
+        solved = (
+            np.bincount(origin_cells, origin_share, cell_count)
+            + np.bincount(destination_cells, destination_share, cell_count)
+            + prior * global_factor
+        ) / curvature
+        change = float(np.max(np.abs(solved - factors)))
+        factors += 0.5 * (solved - factors)
+        if change < FIT_TOLERANCE:
+            break
+    return factors
+
+
+def _mape(predicted: np.ndarray, actual: np.ndarray) -> float:
+    return float(np.mean(np.abs(predicted - actual) / actual))
@@ -0,0 +1,89 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def condensed_index(size: int, row: int, column: int) -> int:
+    """Position of cell (row, column), row != column, in a condensed array.
+
+    Cells are stored row by row for the upper triangle only (row < column);
+    lower-triangle cells map to their mirror image.
+    """
+    if row > column:
+        row, column = column, row
+    return size * row - row * (row + 1) // 2 + (column - row - 1)
+
+
+class CondensedMatrix:
+    """Symmetric size x size matrix with a zero diagonal, upper triangle only.
+
+    ``values`` is the 1-D condensed array (``size * (size - 1) / 2`` cells,
+    laid out as in ``condensed_index``), so it takes half the memory of the
+    square matrix. Indexing mirrors a 2-D array where routing code needs it:
+    ``matrix[i]`` is a dense row, ``matrix[i, j]`` one cell, and
+    ``matrix["field"]`` selects one field of a structured ``values`` array.
+    """
+
+    __slots__ = ("values", "size", "_row_offsets")
+
+    def __init__(self, values: np.ndarray, size: int):
+        if len(values) != size * (size - 1) // 2:
+            raise ValueError(
+                f"{len(values)} condensed values do not describe a {size}x{size} "
+                "matrix"
+            )
+        self.values = values
+        self.size = size
+        rows = np.arange(size, dtype=np.int64)
+        # condensed_index(size, j, i) == _row_offsets[j] + i for every j < i.
+        self._row_offsets = size * rows - rows * (rows + 1) // 2 - rows - 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key: int | str | tuple[int, int]) -> object:
+        if isinstance(key, str):
+            return CondensedMatrix(self.values[key], self.size)
+        if isinstance(key, tuple):
+            row, column = key
+            if row == column:
+                return self.values.dtype.type(0)
+            return self.values[condensed_index(self.size, row, column)]
+        return self.row(key)
+
+    def row(self, index: int) -> np.ndarray:
+        """Dense copy of row ``index`` (equal to column ``index``)."""
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+
+        result = np.zeros(self.size, dtype=self.values.dtype)
+        result[:index] = self.values[self._row_offsets[:index] + index]
+        start = condensed_index(self.size, index, index + 1) if index + 1 < self.size else 0
+        result[index + 1 :] = self.values[start : start + self.size - index - 1]
+        return result
+
+    def submatrix(self, nodes: Sequence[int]) -> np.ndarray:
+        """Dense len(nodes) x len(nodes) block for the given rows/columns."""
+        indexes = np.asarray(nodes, dtype=np.int64)
+        rows = indexes[:, np.newaxis]
+        columns = indexes[np.newaxis, :]
+        low = np.minimum(rows, columns)
+        high = np.maximum(rows, columns)
+        diagonal = low == high
+        positions = self._row_offsets[low] + high
+        positions[diagonal] = 0
+        result = self.values[positions] if len(self.values) else np.zeros(
+            positions.shape, dtype=self.values.dtype
+        )
+        result[diagonal] = 0
+        return result
+
+    def to_dense(self) -> np.ndarray:
+        """Full square matrix (twice the memory of the condensed form)."""
+        result = np.zeros((self.size, self.size), dtype=self.values.dtype)
+        rows, columns = np.triu_indices(self.size, k=1)
+        result[rows, columns] = self.values
+        result[columns, rows] = self.values
+        return result
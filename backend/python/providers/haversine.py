@@ -1,19 +1,87 @@
 import math
 
-from models import Location
-from providers.base import DistanceProvider
+import numpy as np
+
+from models import Location, Locations, LocationTable
+from providers.base import METRICS_DTYPE, DistanceProvider
+from providers.condensed import CondensedMatrix
 
 EARTH_RADIUS_KM = 6371.0
 DEFAULT_AVERAGE_SPEED_KMPH = 40.0
 
 
+def coordinates_radians(locations: Locations) -> tuple[np.ndarray, np.ndarray]:
+    """Convert locations to float64 latitude and longitude arrays in radians."""
+    if isinstance(locations, LocationTable):
+        return np.radians(locations.latitudes), np.radians(locations.longitudes)
+
+    count = len(locations)
+    latitudes = np.fromiter(
+        (location.latitude for location in locations), dtype=np.float64, count=count
+    )
+    longitudes = np.fromiter(
+        (location.longitude for location in locations), dtype=np.float64, count=count
+    )
+    return np.radians(latitudes), np.radians(longitudes)
+
+
+def haversine_matrix_km(
+    origin_latitudes: np.ndarray,
+    origin_longitudes: np.ndarray,
+    destination_latitudes: np.ndarray,
+    destination_longitudes: np.ndarray,
+) -> np.ndarray:
+    """Great-circle distances in km between every origin and destination (radians)."""
+    # sin((a - b) / 2) is expanded into outer products of per-point half-angle
+    # terms so only O(n + m) trig calls are made; the N x M work is in place.
+    half_origin_lat = origin_latitudes * 0.5
+    half_destination_lat = destination_latitudes * 0.5
+    half_origin_lon = origin_longitudes * 0.5
+    half_destination_lon = destination_longitudes * 0.5
+
+    sin_half_d_lat = np.outer(np.sin(half_origin_lat), np.cos(half_destination_lat))
+    sin_half_d_lat -= np.outer(np.cos(half_origin_lat), np.sin(half_destination_lat))
+    sin_half_d_lon = np.outer(np.sin(half_origin_lon), np.cos(half_destination_lon))
+    sin_half_d_lon -= np.outer(np.cos(half_origin_lon), np.sin(half_destination_lon))
+
+    a = np.square(sin_half_d_lat, out=sin_half_d_lat)
+    lon_term = np.square(sin_half_d_lon, out=sin_half_d_lon)
+    lon_term *= np.cos(origin_latitudes)[:, np.newaxis]
+    lon_term *= np.cos(destination_latitudes)[np.newaxis, :]
+    a += lon_term
+
+    np.clip(a, 0.0, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_KM
+    return a
+
+
+def haversine_pairs_km(
+    origin_latitudes: np.ndarray,
+    origin_longitudes: np.ndarray,
+    destination_latitudes: np.ndarray,
+    destination_longitudes: np.ndarray,
+) -> np.ndarray:
+    """Great-circle distances in km between matching origins and destinations (radians)."""
+    a = np.square(np.sin((destination_latitudes - origin_latitudes) * 0.5))
+    a += (
+        np.cos(origin_latitudes)
+        * np.cos(destination_latitudes)
+        * np.square(np.sin((destination_longitudes - origin_longitudes) * 0.5))
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
 class HaversineProvider(DistanceProvider):
     """Haversine formula provider for great-circle distances."""
 
+    is_symmetric = True
+
     def __init__(self, average_speed_kmph: float = DEFAULT_AVERAGE_SPEED_KMPH):
         self.average_speed_kmph = average_speed_kmph
 
-    def distance_km(self, origin: Location, destination: Location) -> float:
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
         lat1 = math.radians(origin.latitude)
         lon1 = math.radians(origin.longitude)
         lat2 = math.radians(destination.latitude)
@@ -28,29 +96,110 @@ class HaversineProvider(DistanceProvider):
         )
         c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
-        return EARTH_RADIUS_KM * c
-
-    def matrix_distances_km(
-        self, origins: list[Location], destinations: list[Location]
-    ) -> list[list[float]]:
-        return [
-            [self.distance_km(origin, destination) for destination in destinations]
-            for origin in origins
-        ]
+        distance_km = EARTH_RADIUS_KM * c
+        return distance_km, self._minutes(distance_km)
 
-    def travel_time_minutes(self, origin: Location, destination: Location) -> float:
-        distance_km = self.distance_km(origin, destination)
+    def _minutes(self, distance_km: float) -> float:
         if self.average_speed_kmph <= 0:
             return 0.0
         return (distance_km / self.average_speed_kmph) * 60.0
 
+    def matrix_metrics(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        distances = self.matrix_distances_km_array(origins, destinations)
+        result = np.empty(distances.shape, dtype=METRICS_DTYPE)
+        result["distance_km"] = distances
+        result["travel_time_minutes"] = self._travel_times_from_distances(distances)
+        return result
+
+    def condensed_matrix_metrics(self, locations: Locations) -> CondensedMatrix:
+        """Upper-triangle metrics, computing each unordered pair once."""
+        count = len(locations)
+        latitudes, longitudes = coordinates_radians(locations)
+        sin_half_lat = np.sin(latitudes * 0.5)
+        cos_half_lat = np.cos(latitudes * 0.5)
+        sin_half_lon = np.sin(longitudes * 0.5)
+        cos_half_lon = np.cos(longitudes * 0.5)
+        cos_lat = np.cos(latitudes)
+
+        distances = np.empty(count * (count - 1) // 2)
+        start = 0
+        for row in range(count - 1):
+            stop = start + count - row - 1
+            cells = distances[start:stop]
+            # Same half-angle expansion as haversine_matrix_km, one row of
+            # the upper triangle at a time.
+            others = slice(row + 1, None)
+            d_lat = sin_half_lat[row] * cos_half_lat[others]
+            d_lat -= cos_half_lat[row] * sin_half_lat[others]
+            d_lon = sin_half_lon[row] * cos_half_lon[others]
+            d_lon -= cos_half_lon[row] * sin_half_lon[others]
+            np.square(d_lat, out=cells)
+            np.square(d_lon, out=d_lon)
+            d_lon *= cos_lat[row] * cos_lat[others]
+            cells += d_lon
+            start = stop
+
+        np.clip(distances, 0.0, 1.0, out=distances)
+        np.sqrt(distances, out=distances)
+        np.arcsin(distances, out=distances)
+        distances *= 2 * EARTH_RADIUS_KM
+        result = np.empty(len(distances), dtype=METRICS_DTYPE)
+        result["distance_km"] = distances
+        result["travel_time_minutes"] = self._travel_times_from_distances(distances)
+        return CondensedMatrix(result, count)
+
+    def _travel_times_from_distances(self, distances: np.ndarray) -> np.ndarray:
+        if self.average_speed_kmph <= 0:
+            return np.zeros_like(distances)
+        return distances * (60.0 / self.average_speed_kmph)
+
+    def matrix_distances_km_array(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        """Vectorized distance matrix as a float64 (origins, destinations) array."""
+        return haversine_matrix_km(
+            *coordinates_radians(origins), *coordinates_radians(destinations)
+        )
+
+    def matrix_distances_km(
+        self, origins: Locations, destinations: Locations
+    ) -> list[list[float]]:
+        return self.matrix_distances_km_array(origins, destinations).tolist()
+
+    def matrix_travel_times_minutes_array(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        """Vectorized travel time matrix as a float64 (origins, destinations) array."""
+        return self._travel_times_from_distances(
+            self.matrix_distances_km_array(origins, destinations)
+        )
+
     def matrix_travel_times_minutes(
-        self, origins: list[Location], destinations: list[Location]
+        self, origins: Locations, destinations: Locations
     ) -> list[list[float]]:
-        return [
-            [
-                self.travel_time_minutes(origin, destination)
-                for destination in destinations
-            ]
-            for origin in origins
-        ]
+        return self.matrix_travel_times_minutes_array(origins, destinations).tolist()
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        if len(origins) != len(destinations):
+            raise ValueError("origins and destinations must have the same length")
+
+        distances = haversine_pairs_km(
+            *coordinates_radians(origins), *coordinates_radians(destinations)
+        )
+        result = np.empty(len(distances), dtype=METRICS_DTYPE)
+        result["distance_km"] = distances
+        result["travel_time_minutes"] = self._travel_times_from_distances(distances)
+        return result
+
+    def route_legs(self, stops: Locations) -> list[tuple[float, float]]:
+        if len(stops) < 2:
+            return []
+
+        latitudes, longitudes = coordinates_radians(stops)
+        distances = haversine_pairs_km(
+            latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]
+        )
+        travel_times = self._travel_times_from_distances(distances)
+        return list(zip(distances.tolist(), travel_times.tolist()))
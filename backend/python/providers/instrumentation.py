@@ -0,0 +1,276 @@
+import bisect
+import threading
+import time
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+
+from models import Location, Locations
+from providers.base import DistanceProvider
+from providers.condensed import CondensedMatrix
+
+# Upper bounds in seconds, from a warm cache lookup to a slow OSRM /table.
+DEFAULT_LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+DEFAULT_PROMETHEUS_PREFIX = "carpool_provider"
+
+
+class _Histogram:
+    """Fixed-bucket latency histogram (per-bucket counts, not cumulative)."""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(upper bound label, observations <= bound) pairs ending with +Inf."""
+        labels = [repr(float(bound)) for bound in self.bounds] + ["+Inf"]
+        running = 0
+        pairs = []
+        for label, count in zip(labels, self.counts):
+            running += count
+            pairs.append((label, running))
+        return pairs
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum_seconds": self.total,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class ProviderMetrics:
+    """Thread-safe counters and latency histograms for distance providers.
+
+    ``InstrumentedProvider`` records per-method calls and call latency;
+    ``OSRMProvider(instrumentation=...)`` records HTTP round trips per
+    service, cache hits and misses per layer, retries, the time spent
+    sleeping in the throttle and in retry backoff, and resilience events
+    (circuit breaker rejections, fallback cells). Read the numbers with
+    ``snapshot()`` or export them with ``to_prometheus()``.
+    """
+
+    def __init__(self, latency_buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls: Counter[str] = Counter()
+            self.call_latency: dict[str, _Histogram] = {}
+            self.http_latency: dict[str, _Histogram] = {}
+            self.cache_hits: Counter[str] = Counter()
+            self.cache_misses: Counter[str] = Counter()
+            self.retries = 0
+            self.sleep_seconds: Counter[str] = Counter()
+            self.events: Counter[str] = Counter()
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms: dict[str, _Histogram], key: str) -> _Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(self.latency_buckets)
+        return histogram
+
+    def record_call(self, method: str, seconds: float) -> None:
+        with self._lock:
+            self.calls[method] += 1
+            self._histogram(self.call_latency, method).observe(seconds)
+
+    def record_http(self, service: str, seconds: float) -> None:
+        with self._lock:
+            self._histogram(self.http_latency, service).observe(seconds)
+
+    def record_cache(self, layer: str, hits: int, misses: int) -> None:
+        with self._lock:
+            self.cache_hits[layer] += hits
+            self.cache_misses[layer] += misses
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_sleep(self, reason: str, seconds: float) -> None:
+        with self._lock:
+            self.sleep_seconds[reason] += seconds
+
+    def record_event(self, event: str, amount: int = 1) -> None:
+        with self._lock:
+            self.events[event] += amount
+
+    def snapshot(self) -> dict[str, Any]:
+        """Plain-dict copy of every counter, safe to serialise as JSON."""
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "call_latency": {
+                    method: histogram.snapshot()
+                    for method, histogram in self.call_latency.items()
+                },
+                "http": {
+                    service: histogram.snapshot()
+                    for service, histogram in self.http_latency.items()
+                },
+                "cache": {
+                    layer: {
+                        "hits": self.cache_hits[layer],
+                        "misses": self.cache_misses[layer],
+                    }
+                    for layer in sorted(set(self.cache_hits) | set(self.cache_misses))
+                },
+                "retries": self.retries,
+                "sleep_seconds": dict(self.sleep_seconds),
+                "events": dict(self.events),
+            }
+
+    def to_prometheus(self, prefix: str = DEFAULT_PROMETHEUS_PREFIX) -> str:
+        """Render the counters in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines: list[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def histograms(name: str, label: str, values: dict[str, dict]) -> None:
+            for key, histogram in sorted(values.items()):
+                selector = f'{label}="{key}"'
+                for bound, count in histogram["buckets"].items():
+                    lines.append(
+                        f'{prefix}_{name}_bucket{{{selector},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f"{prefix}_{name}_sum{{{selector}}} {histogram['sum_seconds']!r}"
+                )
+                lines.append(f"{prefix}_{name}_count{{{selector}}} {histogram['count']}")
+
+        family("calls_total", "counter", "Distance provider method calls.")
+        for method, count in sorted(snapshot["calls"].items()):
+            lines.append(f'{prefix}_calls_total{{method="{method}"}} {count}')
+
+        family("call_duration_seconds", "histogram", "Provider method latency.")
+        histograms("call_duration_seconds", "method", snapshot["call_latency"])
+
+        family("http_request_duration_seconds", "histogram", "HTTP round trips.")
+        histograms("http_request_duration_seconds", "service", snapshot["http"])
+
+        for outcome in ("hits", "misses"):
+            family(f"cache_{outcome}_total", "counter", f"Metrics cache {outcome}.")
+            for layer, counts in snapshot["cache"].items():
+                lines.append(
+                    f'{prefix}_cache_{outcome}_total{{layer="{layer}"}} {counts[outcome]}'
+                )
+
+        family("retries_total", "counter", "HTTP attempts that were retried.")
+        lines.append(f"{prefix}_retries_total {snapshot['retries']}")
+
+        family("sleep_seconds_total", "counter", "Time slept by throttle or backoff.")
+        for reason, seconds in sorted(snapshot["sleep_seconds"].items()):
+            lines.append(
+                f'{prefix}_sleep_seconds_total{{reason="{reason}"}} {seconds!r}'
+            )
+
+        family("events_total", "counter", "Circuit breaker and fallback events.")
+        for event, count in sorted(snapshot["events"].items()):
+            lines.append(f'{prefix}_events_total{{event="{event}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedProvider(DistanceProvider):
+    """Delegating provider that records per-method calls and latency.
+
+    If ``inner`` has an unset ``instrumentation`` hook (``OSRMProvider``), it
+    is pointed at the same ``ProviderMetrics`` so HTTP, cache, retry and
+    sleep numbers land in one snapshot. Leaving providers unwrapped and
+    hooks unset costs nothing beyond one ``is None`` check per request.
+    """
+
+    def __init__(
+        self, inner: DistanceProvider, metrics: ProviderMetrics | None = None
+    ):
+        self.inner = inner
+        self.instrumentation = metrics or ProviderMetrics()
+        self.is_symmetric = inner.is_symmetric
+        self.has_estimated_matrix = inner.has_estimated_matrix
+        if getattr(inner, "instrumentation", False) is None:
+            inner.instrumentation = self.instrumentation
+
+    def _timed(self, method: str, call: Any, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self.instrumentation.record_call(method, time.perf_counter() - started)
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        return self._timed("metrics", self.inner.metrics, origin, destination)
+
+    def matrix_metrics(
+        self,
+        origins: Locations,
+        destinations: Locations,
+        candidate_columns: Sequence[int] | None = None,
+    ) -> np.ndarray:
+        if candidate_columns is None:
+            return self._timed(
+                "matrix_metrics", self.inner.matrix_metrics, origins, destinations
+            )
+        return self._timed(
+            "matrix_metrics",
+            lambda: self.inner.matrix_metrics(
+                origins, destinations, candidate_columns=candidate_columns
+            ),
+        )
+
+    def condensed_matrix_metrics(self, locations: Locations) -> CondensedMatrix:
+        return self._timed(
+            "condensed_matrix_metrics", self.inner.condensed_matrix_metrics, locations
+        )
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        return self._timed(
+            "pair_metrics", self.inner.pair_metrics, origins, destinations
+        )
+
+    def solve_order(
+        self, start: Location, stops: Locations, end: Location | None = None
+    ) -> list[int] | None:
+        return self._timed("solve_order", self.inner.solve_order, start, stops, end)
+
+    def route_legs(self, stops: Locations) -> list[tuple[float, float]]:
+        return self._timed("route_legs", self.inner.route_legs, stops)
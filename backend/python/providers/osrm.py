@@ -1,16 +1,89 @@
 import os
+import threading
 import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future
 from typing import Any
 
+import numpy as np
 import requests
 
-from models import Location
-from providers.base import DistanceProvider
+from models import Location, Locations, LocationTable
+from providers.base import METRICS_DTYPE, DistanceProvider
+from providers.cache import CacheKey, LRUMetricsCache, Metrics, MetricsCache
+from providers.haversine import HaversineProvider
+from providers.instrumentation import ProviderMetrics
 
+Coordinate = tuple[float, float]
+CoordinatePair = tuple[Coordinate, Coordinate]
 
-class OSRMProvider(DistanceProvider):
-    """OSRM (Open Source Routing Machine) provider for real-world distances."""
+DEFAULT_CACHE_MAX_ENTRIES = 1_000_000
+# Match osrm-routed's defaults for --max-table-size and --max-viaroute-size.
+DEFAULT_MAX_TABLE_SIZE = 100
+DEFAULT_MAX_ROUTE_WAYPOINTS = 500
+# osrm-routed's default --max-trip-size.
+DEFAULT_MAX_TRIP_WAYPOINTS = 100
+DEFAULT_NEGATIVE_CACHE_TTL_SECONDS = 30.0
+DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 5
+DEFAULT_CIRCUIT_BREAKER_RESET_SECONDS = 30.0
+_UNKNOWN_METRICS: Metrics = (0.0, 0.0)
+# Response codes for which OSRM found no route between the given points;
+# osrm-routed sends them with HTTP 400.
+_UNROUTABLE_CODES = frozenset({"NoRoute", "NoSegment", "NoTable", "NoTrips"})
+
+
+def _coordinate_table(coordinates: list[Coordinate]) -> LocationTable:
+    return LocationTable(
+        [latitude for latitude, _ in coordinates],
+        [longitude for _, longitude in coordinates],
+    )
+
+
+def _z_order_key(coordinate: Coordinate) -> int:
+    """Morton code of a coordinate on a 2^16 x 2^16 grid over the globe."""
+    latitude, longitude = coordinate
+    y = int((latitude + 90.0) / 180.0 * 0xFFFF)
+    x = int((longitude + 180.0) / 360.0 * 0xFFFF)
+    code = 0
+    for bit in range(16):
+        code |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+def _has_null_metrics(entry: dict[str, Any]) -> bool:
+    """Whether an OSRM route or leg reports null distance or duration."""
+    return any(entry.get(key, 0.0) is None for key in ("distance", "duration"))
 
+
+def _hit_miss(metrics: Metrics | None) -> tuple[int, int]:
+    return (0, 1) if metrics is None else (1, 0)
+
+
+class OSRMProvider(DistanceProvider):
+    """OSRM (Open Source Routing Machine) provider for real-world distances.
+
+    Pass ``instrumentation`` (or wrap in ``InstrumentedProvider``) to record
+    HTTP latency, cache hits and misses, retries and throttle/backoff sleeps.
+
+    The provider is safe to share between threads. Concurrent misses for the
+    same pair or the same ``/table`` tile wait on one in-flight request
+    (single flight), and request starts are spaced under a lock. With
+    ``coalesce_window_seconds`` > 0, scalar misses arriving within that
+    window are batched into a single ``/table`` request instead of one
+    ``/route`` each, at the cost of up to one window of added latency.
+
+    Pairs OSRM reports as unroutable are remembered for
+    ``negative_cache_ttl_seconds`` and not requested again meanwhile. After
+    ``circuit_breaker_threshold`` consecutive failed requests (retries
+    exhausted) the circuit opens: requests fail fast for
+    ``circuit_breaker_reset_seconds``, then one trial request decides
+    whether it closes again. Unroutable and failed cells come from
+    ``fallback_provider`` (a ``HaversineProvider`` by default), never as
+    zeros that would rank a missing answer as the nearest candidate.
+
+    ``route_legs`` costs one multi-waypoint /route request and
+    ``solve_order`` one /trip request per route.
+    """
     def __init__(
         self,
         base_url: str | None = None,
@@ -18,31 +91,204 @@ class OSRMProvider(DistanceProvider):
         requests_per_second: float = 10.0,
         max_retries: int = 2,
         retry_backoff_seconds: float = 0.2,
+        profile: str = "driving",
+        persistent_cache: MetricsCache | None = None,
+        cache_max_entries: int | None = DEFAULT_CACHE_MAX_ENTRIES,
+        cache_max_bytes: int | None = None,
+        max_table_size: int = DEFAULT_MAX_TABLE_SIZE,
+        max_route_waypoints: int = DEFAULT_MAX_ROUTE_WAYPOINTS,
+        max_trip_waypoints: int = DEFAULT_MAX_TRIP_WAYPOINTS,
+        instrumentation: ProviderMetrics | None = None,
+        coalesce_window_seconds: float = 0.0,
+        fallback_provider: DistanceProvider | None = None,
+        negative_cache_ttl_seconds: float = DEFAULT_NEGATIVE_CACHE_TTL_SECONDS,
+        circuit_breaker_threshold: int = DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+        circuit_breaker_reset_seconds: float = DEFAULT_CIRCUIT_BREAKER_RESET_SECONDS,
     ):
         self.base_url = base_url or os.getenv("OSRM_URL", "http://localhost:5000")
+        self.profile = profile
+        self.persistent_cache = persistent_cache
         self.timeout = max(timeout, 0.0)
         self.requests_per_second = max(requests_per_second, 0.0)
         self.max_retries = max(max_retries, 0)
         self.retry_backoff_seconds = max(retry_backoff_seconds, 0.0)
+        self.max_table_size = max(max_table_size, 1)
+        self.max_route_waypoints = max(max_route_waypoints, 2)
+        self.max_trip_waypoints = max(max_trip_waypoints, 2)
+        self.instrumentation = instrumentation
+        self.coalesce_window_seconds = max(coalesce_window_seconds, 0.0)
+        self.fallback_provider = fallback_provider or HaversineProvider()
+        self.negative_cache_ttl_seconds = max(negative_cache_ttl_seconds, 0.0)
+        self.circuit_breaker_threshold = max(circuit_breaker_threshold, 0)
+        self.circuit_breaker_reset_seconds = max(circuit_breaker_reset_seconds, 0.0)
+        # Monotonic expiry per unroutable pair; breaker state below.
+        self._unroutable: dict[CacheKey, float] = {}
+        self._consecutive_failures = 0
+        self._circuit_open_until = 0.0
         self._min_request_interval_seconds = (
             0.0 if self.requests_per_second == 0 else 1.0 / self.requests_per_second
         )
         self._last_request_timestamp = 0.0
-        self._distance_cache: dict[tuple[Location, Location], float] = {}
-        self._travel_time_cache: dict[tuple[Location, Location], float] = {}
+        self._metrics_cache = LRUMetricsCache(
+            max_entries=cache_max_entries, max_bytes=cache_max_bytes
+        )
+        self._init_concurrency()
+
+    def _init_concurrency(self) -> None:
+        # _lock guards the in-memory cache, in-flight requests and the
+        # coalescing batch; _throttle_lock guards the shared request-start slot.
+        self._lock = threading.Lock()
+        self._throttle_lock = threading.Lock()
+        self._in_flight: dict[Any, Future] = {}
+        self._pending_pairs: dict[CacheKey, CoordinatePair] = {}
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Locks and in-flight futures are per process; copies start idle.
+        state = self.__dict__.copy()
+        for name in ("_lock", "_throttle_lock", "_in_flight", "_pending_pairs"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_concurrency()
+
+    def _mark_unroutable(self, cache_keys: list[CacheKey]) -> None:
+        if self.negative_cache_ttl_seconds <= 0.0 or not cache_keys:
+            return
+        expires = time.monotonic() + self.negative_cache_ttl_seconds
+        with self._lock:
+            for cache_key in cache_keys:
+                self._unroutable[cache_key] = expires
+
+    def _is_unroutable(self, cache_key: CacheKey) -> bool:
+        """Whether ``cache_key`` failed recently; call with ``_lock`` held."""
+        expires = self._unroutable.get(cache_key)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del self._unroutable[cache_key]
+        return False
+
+    def _circuit_allows_request(self) -> bool:
+        if self.circuit_breaker_threshold == 0:
+            return True
+        with self._lock:
+            if self._consecutive_failures < self.circuit_breaker_threshold:
+                return True
+            now = time.monotonic()
+            if now < self._circuit_open_until:
+                return False
+            # Half open: let this one request through as the trial and keep
+            # everyone else failing fast until it reports back.
+            self._circuit_open_until = now + self.circuit_breaker_reset_seconds
+            return True
+
+    def _record_request_outcome(self, succeeded: bool) -> None:
+        with self._lock:
+            if succeeded:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.circuit_breaker_threshold:
+                self._circuit_open_until = (
+                    time.monotonic() + self.circuit_breaker_reset_seconds
+                )
 
-    def _cache_key(self, origin: Location, destination: Location) -> tuple[Location, Location]:
-        return (origin, destination)
+    def _fallback_metrics(self, origin: Location, destination: Location) -> Metrics:
+        if self.instrumentation is not None:
+            self.instrumentation.record_event("fallback_cells")
+        return self.fallback_provider.metrics(origin, destination)
+
+    def _single_flight(self, key: Any, fetch: Callable[[], Any]) -> Any:
+        """Run ``fetch`` once per ``key`` at a time; concurrent callers share it."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
 
-    def _throttle_requests(self) -> None:
-        if self._min_request_interval_seconds <= 0.0:
-            return
+        try:
+            result = fetch()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _cache_key(self, origin: Location, destination: Location) -> CacheKey:
+        return (
+            origin.latitude,
+            origin.longitude,
+            destination.latitude,
+            destination.longitude,
+        )
 
-        now = time.monotonic()
-        elapsed = now - self._last_request_timestamp
-        remaining = self._min_request_interval_seconds - elapsed
+    def cache_stats(self) -> dict[str, int | None]:
+        """Hit, miss and eviction counters of the in-memory cache."""
+        return self._metrics_cache.stats()
+
+    def cached_samples(self) -> dict[CacheKey, Metrics]:
+        """Every pair held in the persistent and in-memory caches.
+
+        Unroutable pairs are never cached, so every sample is a real route
+        (e.g. for fitting ``CalibratedProvider``).
+        """
+        samples: dict[CacheKey, Metrics] = {}
+        if self.persistent_cache is not None:
+            samples.update(self.persistent_cache.items(self.profile))
+        with self._lock:
+            samples.update(self._metrics_cache.items())
+        return samples
+
+    def _cached_metrics(self, cache_key: CacheKey) -> Metrics | None:
+        with self._lock:
+            metrics = self._metrics_cache.get(cache_key)
+        if self.instrumentation is not None:
+            self.instrumentation.record_cache("memory", *_hit_miss(metrics))
+        if metrics is None and self.persistent_cache is not None:
+            metrics = self.persistent_cache.get(self.profile, cache_key)
+            if self.instrumentation is not None:
+                self.instrumentation.record_cache("persistent", *_hit_miss(metrics))
+            if metrics is not None:
+                with self._lock:
+                    self._metrics_cache.set(cache_key, metrics)
+        return metrics
+
+    def _coordinates(self, locations: Locations) -> list[Coordinate]:
+        if isinstance(locations, LocationTable):
+            return locations.coordinates()
+        return [(location.latitude, location.longitude) for location in locations]
+
+    def _reserve_request_slot(self) -> float:
+        """Claim the next request start; return the seconds to wait for it.
+
+        Slots are handed out under ``_throttle_lock`` from one shared
+        timestamp, so threads and the async variants of a subclass draw
+        from the same ``requests_per_second`` budget.
+        """
+        with self._throttle_lock:
+            elapsed = time.monotonic() - self._last_request_timestamp
+            remaining = max(self._min_request_interval_seconds - elapsed, 0.0)
+            self._last_request_timestamp = time.monotonic() + remaining
+        return remaining
+
+    def _throttle_requests(self) -> None:
+        remaining = self._reserve_request_slot()
         if remaining > 0:
             time.sleep(remaining)
+            if self.instrumentation is not None:
+                self.instrumentation.record_sleep("throttle", remaining)
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        return self.retry_backoff_seconds * (2**attempt)
 
     def _safe_positive_float(self, value: Any) -> float:
         if value is None:
@@ -55,152 +301,599 @@ class OSRMProvider(DistanceProvider):
 
         return parsed if parsed > 0.0 else 0.0
 
-    def _request_json(self, url: str) -> dict[str, Any] | None:
-        for attempt in range(self.max_retries + 1):
-            self._throttle_requests()
-            self._last_request_timestamp = time.monotonic()
-
-            try:
-                response = requests.get(url, timeout=self.timeout)
-                status_code_raw = getattr(response, "status_code", 200)
-                status_code = (
-                    status_code_raw
-                    if isinstance(status_code_raw, int)
-                    else 200
-                )
+    def _service(self, url: str) -> str:
+        """OSRM service name (``route``, ``table``, ...) of a request URL."""
+        return url[len(self.base_url) :].lstrip("/").split("/", 1)[0]
 
-                if status_code == 429 or status_code >= 500:
-                    if attempt < self.max_retries:
-                        backoff = self.retry_backoff_seconds * (2**attempt)
-                        if backoff > 0.0:
-                            time.sleep(backoff)
-                        continue
-
-                    return None
-
-                response.raise_for_status()
-                payload = response.json()
-                if isinstance(payload, dict):
-                    return payload
-                return None
-            except (requests.Timeout, requests.ConnectionError):
-                if attempt < self.max_retries:
-                    backoff = self.retry_backoff_seconds * (2**attempt)
-                    if backoff > 0.0:
-                        time.sleep(backoff)
-                    continue
-                return None
-            except requests.RequestException:
-                return None
-            except ValueError:
-                return None
+    def _http_get(self, url: str) -> Any:
+        return requests.get(url, timeout=self.timeout)
 
-        return None
+    def _attempt_request(
+        self, send: Callable[[], Any]
+    ) -> tuple[dict[str, Any] | None, bool]:
+        """Run one HTTP attempt; return the JSON payload and whether to retry."""
+        try:
+            response = send()
+            status_code_raw = getattr(response, "status_code", 200)
+            status_code = (
+                status_code_raw
+                if isinstance(status_code_raw, int)
+                else 200
+            )
 
-    def distance_km(self, origin: Location, destination: Location) -> float:
-        """Get distance between two locations via OSRM."""
-        cache_key = self._cache_key(origin, destination)
-        cached_distance = self._distance_cache.get(cache_key)
-        if cached_distance is not None:
-            return cached_distance
+            if status_code == 429 or status_code >= 500:
+                return None, True
+            if 400 <= status_code < 500:
+                return self._client_error_payload(response), False
+
+            response.raise_for_status()
+            payload = response.json()
+            if isinstance(payload, dict):
+                return payload, False
+            return None, False
+        except (requests.Timeout, requests.ConnectionError):
+            return None, True
+        except requests.RequestException:
+            return None, False
+        except ValueError:
+            return None, False
+
+    def _client_error_payload(self, response: Any) -> dict[str, Any] | None:
+        """The JSON body of a 4xx answer when it reports an unroutable query.
+
+        osrm-routed answers NoRoute/NoSegment with HTTP 400; the body still
+        tells the caller which pairs to remember as unroutable. Other client
+        errors (bad URL, invalid options) yield None.
+        """
+        try:
+            payload = response.json()
+        except ValueError:
+            return None
+        if isinstance(payload, dict) and payload.get("code") in _UNROUTABLE_CODES:
+            return payload
+        return None
 
-        self._fetch_route_metrics(origin, destination)
-        return self._distance_cache.get(cache_key, 0.0)
+    def _request_json(self, url: str) -> dict[str, Any] | None:
+        if not self._circuit_allows_request():
+            if self.instrumentation is not None:
+                self.instrumentation.record_event("circuit_open")
+            return None
 
-    def travel_time_minutes(self, origin: Location, destination: Location) -> float:
-        """Get travel time between two locations via OSRM."""
-        cache_key = self._cache_key(origin, destination)
-        cached_travel_time = self._travel_time_cache.get(cache_key)
-        if cached_travel_time is not None:
-            return cached_travel_time
+        for attempt in range(self.max_retries + 1):
+            self._throttle_requests()
 
-        self._fetch_route_metrics(origin, destination)
-        return self._travel_time_cache.get(cache_key, 0.0)
+            if self.instrumentation is None:
+                payload, retryable = self._attempt_request(lambda: self._http_get(url))
+            else:
+                started = time.perf_counter()
+                payload, retryable = self._attempt_request(lambda: self._http_get(url))
+                self.instrumentation.record_http(
+                    self._service(url), time.perf_counter() - started
+                )
+            if not retryable:
+                # Unusable answers (other 4xx, bad JSON) count as failures so a
+                # half-open probe that gets one still settles the breaker.
+                self._record_request_outcome(payload is not None)
+                return payload
+
+            if attempt < self.max_retries:
+                if self.instrumentation is not None:
+                    self.instrumentation.record_retry()
+                backoff = self._backoff_seconds(attempt)
+                if backoff > 0.0:
+                    time.sleep(backoff)
+                    if self.instrumentation is not None:
+                        self.instrumentation.record_sleep("backoff", backoff)
+
+        self._record_request_outcome(False)
+        return None
 
-    def _fetch_route_metrics(self, origin: Location, destination: Location) -> None:
+    def metrics(self, origin: Location, destination: Location) -> Metrics:
+        """Get (distance_km, travel_time_minutes) between two locations via OSRM."""
         cache_key = self._cache_key(origin, destination)
+        metrics = self._cached_metrics(cache_key)
+        if metrics is None:
+            with self._lock:
+                unroutable = self._is_unroutable(cache_key)
+            if unroutable:
+                if self.instrumentation is not None:
+                    self.instrumentation.record_cache("negative", 1, 0)
+            elif self.coalesce_window_seconds > 0.0:
+                metrics = self._coalesced_metrics(
+                    cache_key[:2], cache_key[2:], cache_key
+                )
+            else:
+                metrics = self._single_flight(
+                    cache_key, lambda: self._fetch_route_once(origin, destination)
+                )
+        return (
+            metrics
+            if metrics is not None
+            else self._fallback_metrics(origin, destination)
+        )
 
-        url = (
-            f"{self.base_url}/route/v1/driving/"
+    def _fetch_route_once(
+        self, origin: Location, destination: Location
+    ) -> Metrics | None:
+        # A request that finished between our cache miss and taking the
+        # flight has already stored the answer.
+        with self._lock:
+            metrics = self._metrics_cache.peek(self._cache_key(origin, destination))
+        if metrics is not None:
+            return metrics
+        return self._fetch_route_metrics(origin, destination)
+
+    def _coalesced_metrics(
+        self, origin: Coordinate, destination: Coordinate, cache_key: CacheKey
+    ) -> Metrics | None:
+        """Wait for ``cache_key`` in the next batched /table request.
+
+        The first miss of a batch leads it: it waits for the window, takes
+        every pair queued meanwhile and resolves them all with one table
+        fetch. Later misses for a queued pair just wait on its future.
+        """
+        with self._lock:
+            metrics = self._metrics_cache.peek(cache_key)
+            if metrics is not None:
+                return metrics
+            future = self._in_flight.get(cache_key)
+            if future is not None:
+                leader = False
+            else:
+                future = self._in_flight[cache_key] = Future()
+                leader = not self._pending_pairs
+                self._pending_pairs[cache_key] = (origin, destination)
+        if not leader:
+            return future.result()
+
+        time.sleep(self.coalesce_window_seconds)
+        with self._lock:
+            batch = self._pending_pairs
+            self._pending_pairs = {}
+        try:
+            fetched = self._fetch_table_metrics(list(batch.values()))
+        except BaseException as error:
+            self._resolve_in_flight(batch, error=error)
+            raise
+        self._resolve_in_flight(batch, fetched)
+        return future.result()
+
+    def _resolve_in_flight(
+        self,
+        keys: dict[CacheKey, CoordinatePair],
+        fetched: dict[CacheKey, Metrics] | None = None,
+        error: BaseException | None = None,
+    ) -> None:
+        with self._lock:
+            futures = [self._in_flight.pop(key) for key in keys]
+        for key, future in zip(keys, futures):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(fetched.get(key))
+
+    def _route_url(self, origin: Location, destination: Location) -> str:
+        return (
+            f"{self.base_url}/route/v1/{self.profile}/"
             f"{origin.longitude},{origin.latitude};"
             f"{destination.longitude},{destination.latitude}"
         )
-        data = self._request_json(url)
+
+    def _fetch_route_metrics(
+        self, origin: Location, destination: Location
+    ) -> Metrics | None:
+        data = self._request_json(self._route_url(origin, destination))
+        return self._store_route_response(origin, destination, data)
+
+    def _store_route_response(
+        self, origin: Location, destination: Location, data: dict[str, Any] | None
+    ) -> Metrics | None:
         if not data:
-            return
+            return None
 
+        cache_key = self._cache_key(origin, destination)
+        routes = data.get("routes")
         if data.get("code") != "Ok":
-            return
+            if data.get("code") in _UNROUTABLE_CODES:
+                self._mark_unroutable([cache_key])
+            return None
+        first_route = (
+            routes[0] if isinstance(routes, list) and routes else None
+        )
+        if not isinstance(first_route, dict) or _has_null_metrics(first_route):
+            # OSRM answered Ok without a usable route; treat it like NoRoute.
+            self._mark_unroutable([cache_key])
+            return None
+
+        metrics = (
+            self._safe_positive_float(first_route.get("distance")) / 1000.0,
+            self._safe_positive_float(first_route.get("duration")) / 60.0,
+        )
+        with self._lock:
+            self._metrics_cache.set(cache_key, metrics)
+        if (
+            self.persistent_cache is not None
+            and "distance" in first_route
+            and "duration" in first_route
+        ):
+            self.persistent_cache.set(self.profile, cache_key, metrics)
+        return metrics
+
+    def route_legs(self, stops: Locations) -> list[Metrics]:
+        """Per-leg (distance_km, travel_time_minutes) via multi-waypoint /route.
+
+        Cached legs are reused; each run of up to ``max_route_waypoints``
+        stops with an uncached leg costs one request that returns every
+        leg's distance and duration together.
+        """
+        coordinates = self._coordinates(stops)
+        legs = [
+            self._cached_metrics(origin + destination)
+            for origin, destination in zip(coordinates, coordinates[1:])
+        ]
 
-        routes = data.get("routes")
-        if not isinstance(routes, list) or not routes:
-            return
+        with self._lock:
+            unroutable = [
+                leg is None and self._is_unroutable(origin + destination)
+                for leg, origin, destination in zip(
+                    legs, coordinates, coordinates[1:]
+                )
+            ]
 
-        first_route = routes[0]
-        if not isinstance(first_route, dict):
-            return
+        legs_per_request = self.max_route_waypoints - 1
+        for start in range(0, len(legs), legs_per_request):
+            window = legs[start : start + legs_per_request]
+            skipped = unroutable[start : start + legs_per_request]
+            if all(leg is not None or skip for leg, skip in zip(window, skipped)):
+                continue
+            waypoints = coordinates[start : start + len(window) + 1]
+            data = self._request_json(self._route_legs_url(waypoints))
+            for offset, metrics in enumerate(
+                self._store_route_legs_response(data, waypoints)
+            ):
+                if metrics is not None:
+                    legs[start + offset] = metrics
+
+        return [
+            leg
+            if leg is not None
+            else self._fallback_metrics(Location(*origin), Location(*destination))
+            for leg, origin, destination in zip(legs, coordinates, coordinates[1:])
+        ]
 
-        distance_km = self._safe_positive_float(first_route.get("distance")) / 1000.0
-        travel_time_minutes = (
-            self._safe_positive_float(first_route.get("duration")) / 60.0
+    def solve_order(
+        self, start: Location, stops: Locations, end: Location | None = None
+    ) -> list[int] | None:
+        """Stop order from one OSRM /trip request (fixed start and end).
+
+        The trip's legs go into the pair cache, so ``route_legs`` over the
+        ordered stops needs no further request. /trip only solves open
+        routes with both ends fixed, so without ``end`` (or above
+        ``max_trip_waypoints``, or when the request fails) this returns None
+        and the caller orders the stops itself.
+        """
+        if len(stops) <= 1:
+            return list(range(len(stops)))
+        if end is None or len(stops) + 2 > self.max_trip_waypoints:
+            return None
+
+        waypoints = self._coordinates([start, *stops, end])
+        coordinates = ";".join(f"{lon},{lat}" for lat, lon in waypoints)
+        data = self._request_json(
+            f"{self.base_url}/trip/v1/{self.profile}/{coordinates}"
+            "?roundtrip=false&source=first&destination=last"
+            "&overview=false&continue_straight=false"
+        )
+        if not data or data.get("code") != "Ok":
+            return None
+
+        returned = data.get("waypoints")
+        if not isinstance(returned, list) or len(returned) != len(waypoints):
+            return None
+        positions = [
+            waypoint.get("waypoint_index") if isinstance(waypoint, dict) else None
+            for waypoint in returned
+        ]
+        if not all(isinstance(position, int) for position in positions) or sorted(
+            positions
+        ) != list(range(len(waypoints))):
+            return None
+        order = sorted(range(len(stops)), key=lambda index: positions[index + 1])
+        self._store_legs(
+            data.get("trips"),
+            [waypoints[0], *(waypoints[index + 1] for index in order), waypoints[-1]],
+        )
+        return order
+
+    def _route_legs_url(self, waypoints: list[Coordinate]) -> str:
+        # continue_straight=false keeps each leg equal to the standalone
+        # origin -> destination route, so legs can share the pair cache.
+        coordinates = ";".join(f"{lon},{lat}" for lat, lon in waypoints)
+        return (
+            f"{self.base_url}/route/v1/{self.profile}/{coordinates}"
+            "?overview=false&continue_straight=false"
         )
-        self._distance_cache[cache_key] = distance_km
-        self._travel_time_cache[cache_key] = travel_time_minutes
 
-    def matrix_distances_km(
-        self, origins: list[Location], destinations: list[Location]
-    ) -> list[list[float]]:
-        """Get distance matrix via OSRM."""
-        self._fetch_missing_matrix_metrics(origins, destinations)
+    def _store_route_legs_response(
+        self, data: dict[str, Any] | None, waypoints: list[Coordinate]
+    ) -> list[Metrics | None]:
+        if not data or data.get("code") != "Ok":
+            return []
 
-        return [
-            [
-                self._distance_cache.get(self._cache_key(origin, destination), 0.0)
-                for destination in destinations
-            ]
-            for origin in origins
-        ]
+        return self._store_legs(data.get("routes"), waypoints)
 
-    def matrix_travel_times_minutes(
-        self, origins: list[Location], destinations: list[Location]
-    ) -> list[list[float]]:
-        """Get travel time matrix via OSRM."""
-        self._fetch_missing_matrix_metrics(origins, destinations)
+    def _store_legs(
+        self, routes: Any, waypoints: list[Coordinate]
+    ) -> list[Metrics | None]:
+        """Cache the legs of ``routes[0]`` (a /route or /trip result) as pairs."""
+        if not isinstance(routes, list) or not routes:
+            return []
+
+        legs = routes[0].get("legs") if isinstance(routes[0], dict) else None
+        if not isinstance(legs, list) or len(legs) != len(waypoints) - 1:
+            return []
+
+        parsed: list[Metrics | None] = []
+        fetched: dict[CacheKey, Metrics] = {}
+        persisted: dict[CacheKey, Metrics] = {}
+        unroutable: list[CacheKey] = []
+        for origin, destination, leg in zip(waypoints, waypoints[1:], legs):
+            cache_key = origin + destination
+            if not isinstance(leg, dict) or _has_null_metrics(leg):
+                # Same as a null /table cell: not cached, fallback fills it.
+                unroutable.append(cache_key)
+                parsed.append(None)
+                continue
+
+            metrics = (
+                self._safe_positive_float(leg.get("distance")) / 1000.0,
+                self._safe_positive_float(leg.get("duration")) / 60.0,
+            )
+            fetched[cache_key] = metrics
+            if "distance" in leg and "duration" in leg:
+                persisted[cache_key] = metrics
+            parsed.append(metrics)
+
+        with self._lock:
+            self._metrics_cache.update(fetched)
+        self._mark_unroutable(unroutable)
+        if self.persistent_cache is not None:
+            self.persistent_cache.set_many(self.profile, persisted)
+        return parsed
+
+    def matrix_metrics(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        """Get the distance and travel time matrix via OSRM /table."""
+        origin_coordinates = self._coordinates(origins)
+        destination_coordinates = self._coordinates(destinations)
+        resolved, missing_pairs = self._lookup_matrix_metrics(
+            origin_coordinates, destination_coordinates
+        )
+        if missing_pairs:
+            resolved.update(self._fetch_table_metrics(missing_pairs))
 
-        return [
+        return self._metrics_array(
+            resolved, origin_coordinates, destination_coordinates
+        )
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        """Metrics of ``origins[i] -> destinations[i]`` via tiled /table requests."""
+        if len(origins) != len(destinations):
+            raise ValueError("origins and destinations must have the same length")
+
+        pairs = list(zip(self._coordinates(origins), self._coordinates(destinations)))
+        resolved, missing_pairs = self._lookup_pairs(pairs)
+        if missing_pairs:
+            resolved.update(self._fetch_tiles(self._pair_tiles(missing_pairs)))
+
+        result = np.array(
             [
-                self._travel_time_cache.get(self._cache_key(origin, destination), 0.0)
+                resolved.get(origin + destination, _UNKNOWN_METRICS)
+                for origin, destination in pairs
+            ],
+            dtype=METRICS_DTYPE,
+        ).reshape(len(pairs))
+        unresolved = [
+            index
+            for index, (origin, destination) in enumerate(pairs)
+            if origin + destination not in resolved
+        ]
+        if unresolved:
+            result[unresolved] = self.fallback_provider.pair_metrics(
+                _coordinate_table([pairs[index][0] for index in unresolved]),
+                _coordinate_table([pairs[index][1] for index in unresolved]),
+            )
+            if self.instrumentation is not None:
+                self.instrumentation.record_event("fallback_cells", len(unresolved))
+        return result
+
+    def _metrics_array(
+        self,
+        resolved: dict[CacheKey, Metrics],
+        origins: list[Coordinate],
+        destinations: list[Coordinate],
+    ) -> np.ndarray:
+        result = np.empty((len(origins), len(destinations)), dtype=METRICS_DTYPE)
+        for row, origin in enumerate(origins):
+            result[row] = [
+                resolved.get(origin + destination, _UNKNOWN_METRICS)
                 for destination in destinations
             ]
-            for origin in origins
-        ]
+        self._fill_from_fallback(result, resolved, origins, destinations)
+        return result
 
-    def _fetch_missing_matrix_metrics(
-        self, origins: list[Location], destinations: list[Location]
+    def _fill_from_fallback(
+        self,
+        result: np.ndarray,
+        resolved: dict[CacheKey, Metrics],
+        origins: list[Coordinate],
+        destinations: list[Coordinate],
     ) -> None:
-        if not origins:
+        """Replace unresolved cells with one fallback matrix over their rows/columns."""
+        unresolved = np.array(
+            [
+                [origin + destination not in resolved for destination in destinations]
+                for origin in origins
+            ],
+            dtype=bool,
+        ).reshape(len(origins), len(destinations))
+        if not unresolved.any():
             return
 
-        if not destinations:
-            return
+        rows = np.flatnonzero(unresolved.any(axis=1))
+        columns = np.flatnonzero(unresolved.any(axis=0))
+        block = np.ix_(rows, columns)
+        fallback = self.fallback_provider.matrix_metrics(
+            _coordinate_table([origins[i] for i in rows]),
+            _coordinate_table([destinations[j] for j in columns]),
+        )
+        cells = result[block]
+        mask = unresolved[block]
+        cells[mask] = fallback[mask]
+        result[block] = cells
+        if self.instrumentation is not None:
+            self.instrumentation.record_event("fallback_cells", int(mask.sum()))
+
+    def _lookup_matrix_metrics(
+        self, origins: list[Coordinate], destinations: list[Coordinate]
+    ) -> tuple[dict[CacheKey, Metrics], list[CoordinatePair]]:
+        """Split a matrix into cached metrics and the pairs that still need OSRM.
+
+        Results are collected here rather than re-read from the bounded cache
+        later, so a matrix larger than the cache never loses cells to eviction.
+        """
+        return self._lookup_pairs(
+            (origin, destination) for origin in origins for destination in destinations
+        )
 
-        missing_pairs: list[tuple[Location, Location]] = []
-        for origin in origins:
-            for destination in destinations:
-                cache_key = self._cache_key(origin, destination)
-                if (
-                    cache_key not in self._distance_cache
-                    or cache_key not in self._travel_time_cache
-                ):
-                    missing_pairs.append((origin, destination))
-
-        if not missing_pairs:
-            return
+    def _lookup_pairs(
+        self, pairs: Iterable[CoordinatePair]
+    ) -> tuple[dict[CacheKey, Metrics], list[CoordinatePair]]:
+        resolved: dict[CacheKey, Metrics] = {}
+        missing_keys: dict[CacheKey, CoordinatePair] = {}
+        unroutable = 0
+        with self._lock:
+            for origin, destination in pairs:
+                cache_key = origin + destination
+                if cache_key in resolved or cache_key in missing_keys:
+                    continue
+                metrics = self._metrics_cache.get(cache_key)
+                if metrics is not None:
+                    resolved[cache_key] = metrics
+                elif self._unroutable and self._is_unroutable(cache_key):
+                    unroutable += 1
+                else:
+                    missing_keys[cache_key] = (origin, destination)
+
+        if self.instrumentation is not None:
+            self.instrumentation.record_cache(
+                "memory", len(resolved), len(missing_keys) + unroutable
+            )
+            if unroutable:
+                self.instrumentation.record_cache("negative", unroutable, 0)
+        if missing_keys and self.persistent_cache is not None:
+            persisted = self.persistent_cache.get_many(self.profile, missing_keys)
+            if self.instrumentation is not None:
+                self.instrumentation.record_cache(
+                    "persistent", len(persisted), len(missing_keys) - len(persisted)
+                )
+            with self._lock:
+                self._metrics_cache.update(persisted)
+            resolved.update(persisted)
+            for cache_key in persisted:
+                del missing_keys[cache_key]
+
+        return resolved, list(missing_keys.values())
+
+    def _table_tiles(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> list[list[CoordinatePair]]:
+        """Group missing pairs into source x destination tiles of max_table_size.
+
+        Tiles without a missing pair are never produced, so partially cached
+        matrices only request the blocks that still have gaps.
+        """
+        size = self.max_table_size
+        source_blocks: dict[Coordinate, int] = {}
+        destination_blocks: dict[Coordinate, int] = {}
+        tiles: dict[tuple[int, int], list[CoordinatePair]] = {}
+        for origin, destination in missing_pairs:
+            source_block = source_blocks.get(origin)
+            if source_block is None:
+                source_block = len(source_blocks) // size
+                source_blocks[origin] = source_block
+            destination_block = destination_blocks.get(destination)
+            if destination_block is None:
+                destination_block = len(destination_blocks) // size
+                destination_blocks[destination] = destination_block
+            tiles.setdefault((source_block, destination_block), []).append(
+                (origin, destination)
+            )
 
-        source_locs: list[Location] = []
-        destination_locs: list[Location] = []
-        source_seen: set[Location] = set()
-        destination_seen: set[Location] = set()
+        return list(tiles.values())
+
+    def _pair_tiles(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> list[list[CoordinatePair]]:
+        """Group sparse pairs into tiles that each cover few unrequested cells.
+
+        Sources are visited in Z-order so that each block of
+        ``max_table_size`` sources is spatially compact and its pairs (e.g.
+        nearest candidates) share destinations; each block's own
+        destinations are then split into tiles of ``max_table_size``.
+        """
+        size = self.max_table_size
+        pairs_by_source: dict[Coordinate, list[CoordinatePair]] = {}
+        for pair in missing_pairs:
+            pairs_by_source.setdefault(pair[0], []).append(pair)
+        sources = sorted(pairs_by_source, key=_z_order_key)
+
+        tiles: list[list[CoordinatePair]] = []
+        for start in range(0, len(sources), size):
+            destination_blocks: dict[Coordinate, int] = {}
+            block_tiles: dict[int, list[CoordinatePair]] = {}
+            for source in sources[start : start + size]:
+                for pair in pairs_by_source[source]:
+                    destination_block = destination_blocks.setdefault(
+                        pair[1], len(destination_blocks) // size
+                    )
+                    block_tiles.setdefault(destination_block, []).append(pair)
+            tiles.extend(block_tiles.values())
+        return tiles
+
+    def _fetch_table_metrics(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> dict[CacheKey, Metrics]:
+        return self._fetch_tiles(self._table_tiles(missing_pairs))
+
+    def _fetch_tiles(
+        self, tiles: list[list[CoordinatePair]]
+    ) -> dict[CacheKey, Metrics]:
+        fetched: dict[CacheKey, Metrics] = {}
+        for tile in tiles:
+            fetched.update(
+                self._single_flight(
+                    ("table", tuple(tile)),
+                    lambda tile=tile: self._fetch_table_tile(tile),
+                )
+            )
+        return fetched
+
+    def _fetch_table_tile(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> dict[CacheKey, Metrics]:
+        url, source_locs, destination_locs = self._table_request(missing_pairs)
+        data = self._request_json(url)
+        return self._store_table_response(data, source_locs, destination_locs)
+
+    def _table_request(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> tuple[str, list[Coordinate], list[Coordinate]]:
+        source_locs: list[Coordinate] = []
+        destination_locs: list[Coordinate] = []
+        source_seen: set[Coordinate] = set()
+        destination_seen: set[Coordinate] = set()
 
         for origin, destination in missing_pairs:
             if origin not in source_seen:
@@ -210,14 +903,16 @@ class OSRMProvider(DistanceProvider):
                 destination_seen.add(destination)
                 destination_locs.append(destination)
 
-        coordinate_locs: list[Location] = []
-        coordinate_indexes: dict[Location, int] = {}
+        coordinate_locs: list[Coordinate] = []
+        coordinate_indexes: dict[Coordinate, int] = {}
         for location in [*source_locs, *destination_locs]:
             if location not in coordinate_indexes:
                 coordinate_indexes[location] = len(coordinate_locs)
                 coordinate_locs.append(location)
 
-        coords = ";".join(f"{loc.longitude},{loc.latitude}" for loc in coordinate_locs)
+        coords = ";".join(
+            f"{longitude},{latitude}" for latitude, longitude in coordinate_locs
+        )
         source_indexes = ",".join(
             str(coordinate_indexes[location]) for location in source_locs
         )
@@ -225,22 +920,38 @@ class OSRMProvider(DistanceProvider):
             str(coordinate_indexes[location]) for location in destination_locs
         )
         url = (
-            f"{self.base_url}/table/v1/driving/{coords}?"
+            f"{self.base_url}/table/v1/{self.profile}/{coords}?"
             f"sources={source_indexes}&"
             f"destinations={destination_indexes}&"
             "annotations=distance,duration"
         )
+        return url, source_locs, destination_locs
 
-        data = self._request_json(url)
+    def _store_table_response(
+        self,
+        data: dict[str, Any] | None,
+        source_locs: list[Coordinate],
+        destination_locs: list[Coordinate],
+    ) -> dict[CacheKey, Metrics]:
         if not data:
-            return
+            return {}
 
         if data.get("code") != "Ok":
-            return
+            if data.get("code") in _UNROUTABLE_CODES:
+                self._mark_unroutable(
+                    [
+                        source + destination
+                        for source in source_locs
+                        for destination in destination_locs
+                    ]
+                )
+            return {}
 
         distance_matrix = data.get("distances")
         duration_matrix = data.get("durations")
 
+        fetched: dict[CacheKey, Metrics] = {}
+        unroutable: list[CacheKey] = []
         for row_index, source in enumerate(source_locs):
             distance_row = (
                 distance_matrix[row_index]
@@ -258,7 +969,7 @@ class OSRMProvider(DistanceProvider):
             )
 
             for column_index, destination in enumerate(destination_locs):
-                cache_key = self._cache_key(source, destination)
+                cache_key = source + destination
 
                 distance_meters = (
                     distance_row[column_index]
@@ -271,9 +982,17 @@ class OSRMProvider(DistanceProvider):
                     else None
                 )
 
-                self._distance_cache[cache_key] = (
-                    self._safe_positive_float(distance_meters) / 1000.0
-                )
-                self._travel_time_cache[cache_key] = (
-                    self._safe_positive_float(duration_seconds) / 60.0
+                if distance_meters is None or duration_seconds is None:
+                    unroutable.append(cache_key)
+                    continue
+                fetched[cache_key] = (
+                    self._safe_positive_float(distance_meters) / 1000.0,
+                    self._safe_positive_float(duration_seconds) / 60.0,
                 )
+
+        with self._lock:
+            self._metrics_cache.update(fetched)
+        self._mark_unroutable(unroutable)
+        if self.persistent_cache is not None:
+            self.persistent_cache.set_many(self.profile, fetched)
+        return fetched
@@ -0,0 +1,270 @@
+import asyncio
+import time
+import weakref
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from models import Location, Locations
+from providers.cache import CacheKey, Metrics
+from providers.osrm import Coordinate, CoordinatePair, OSRMProvider
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class AsyncOSRMProvider(OSRMProvider):
+    """OSRM provider with a pooled keep-alive session and concurrent async requests.
+
+    The synchronous DistanceProvider methods keep working over the pooled
+    session. The ``*_async`` variants run up to ``max_in_flight`` HTTP
+    requests at once (including the tiles of one large matrix) while request
+    starts are still spaced by ``requests_per_second`` and failures follow
+    the same retry/backoff rules. The rate limit is shared with the
+    synchronous methods, so mixing both stays within ``requests_per_second``.
+    As in the synchronous provider, coroutines asking for the same uncached
+    pair share one in-flight request.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        session: requests.Session | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(base_url=base_url, **kwargs)
+        self.max_in_flight = max(max_in_flight, 1)
+        self.session = session or self._create_session()
+        self._reset_loop_state()
+
+    def _reset_loop_state(self) -> None:
+        self._loop_state: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop,
+            tuple[asyncio.Semaphore, dict[Any, asyncio.Future]],
+        ] = weakref.WeakKeyDictionary()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Sessions and event-loop primitives are per process; copies (e.g. in
+        # a ProcessPoolExecutor worker) open their own pool.
+        state = super().__getstate__()
+        del state["session"], state["_loop_state"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        super().__setstate__(state)
+        self.session = self._create_session()
+        self._reset_loop_state()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _http_get(self, url: str) -> Any:
+        return self.session.get(url, timeout=self.timeout)
+
+    def _loop_primitives(
+        self,
+    ) -> tuple[asyncio.Semaphore, dict[Any, asyncio.Future]]:
+        """This loop's request semaphore and in-flight futures by key."""
+        loop = asyncio.get_running_loop()
+        primitives = self._loop_state.get(loop)
+        if primitives is None:
+            primitives = (asyncio.Semaphore(self.max_in_flight), {})
+            self._loop_state[loop] = primitives
+        return primitives
+
+    async def _single_flight_async(
+        self, key: Any, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Await ``fetch`` once per ``key`` at a time; concurrent callers share it."""
+        _, in_flight = self._loop_primitives()
+        future = in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Waiters re-raise it; nobody waiting must not warn.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del in_flight[key]
+
+    async def _throttle_requests_async(self) -> None:
+        remaining = self._reserve_request_slot()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+            if self.instrumentation is not None:
+                self.instrumentation.record_sleep("throttle", remaining)
+
+    async def _request_json_async(self, url: str) -> dict[str, Any] | None:
+        if not self._circuit_allows_request():
+            if self.instrumentation is not None:
+                self.instrumentation.record_event("circuit_open")
+            return None
+
+        in_flight, _ = self._loop_primitives()
+        async with in_flight:
+            for attempt in range(self.max_retries + 1):
+                await self._throttle_requests_async()
+                started = time.perf_counter()
+                payload, retryable = await asyncio.to_thread(
+                    self._attempt_request, lambda: self._http_get(url)
+                )
+                if self.instrumentation is not None:
+                    self.instrumentation.record_http(
+                        self._service(url), time.perf_counter() - started
+                    )
+                if not retryable:
+                    # Unusable answers (other 4xx, bad JSON) count as failures so a
+                    # half-open probe that gets one still settles the breaker.
+                    self._record_request_outcome(payload is not None)
+                    return payload
+
+                if attempt < self.max_retries:
+                    if self.instrumentation is not None:
+                        self.instrumentation.record_retry()
+                    backoff = self._backoff_seconds(attempt)
+                    if backoff > 0.0:
+                        await asyncio.sleep(backoff)
+                        if self.instrumentation is not None:
+                            self.instrumentation.record_sleep("backoff", backoff)
+
+        self._record_request_outcome(False)
+        return None
+
+    async def distance_km_async(self, origin: Location, destination: Location) -> float:
+        """Get distance between two locations via OSRM without blocking the loop."""
+        return (await self._route_metrics_async(origin, destination))[0]
+
+    async def travel_time_minutes_async(
+        self, origin: Location, destination: Location
+    ) -> float:
+        """Get travel time between two locations via OSRM without blocking the loop."""
+        return (await self._route_metrics_async(origin, destination))[1]
+
+    async def route_metrics_many_async(
+        self, pairs: list[tuple[Location, Location]]
+    ) -> list[Metrics]:
+        """Fetch (distance_km, travel_time_minutes) for many pairs concurrently.
+
+        Repeated pairs are requested once.
+        """
+        unique = {
+            self._cache_key(origin, destination): (origin, destination)
+            for origin, destination in pairs
+        }
+        fetched = await asyncio.gather(
+            *(
+                self._route_metrics_async(origin, destination)
+                for origin, destination in unique.values()
+            )
+        )
+        by_key = dict(zip(unique, fetched))
+        return [
+            by_key[self._cache_key(origin, destination)]
+            for origin, destination in pairs
+        ]
+
+    async def _route_metrics_async(
+        self, origin: Location, destination: Location
+    ) -> Metrics:
+        cache_key = self._cache_key(origin, destination)
+        metrics = self._cached_metrics(cache_key)
+        if metrics is None:
+            with self._lock:
+                unroutable = self._is_unroutable(cache_key)
+            if not unroutable:
+                metrics = await self._single_flight_async(
+                    cache_key, lambda: self._fetch_route_once_async(origin, destination)
+                )
+        return (
+            metrics
+            if metrics is not None
+            else self._fallback_metrics(origin, destination)
+        )
+
+    async def _fetch_route_once_async(
+        self, origin: Location, destination: Location
+    ) -> Metrics | None:
+        # A request that finished between our cache miss and taking the
+        # flight has already stored the answer.
+        with self._lock:
+            metrics = self._metrics_cache.peek(self._cache_key(origin, destination))
+        if metrics is not None:
+            return metrics
+        data = await self._request_json_async(self._route_url(origin, destination))
+        return self._store_route_response(origin, destination, data)
+
+    async def matrix_metrics_async(
+        self, origins: Locations, destinations: Locations
+    ) -> np.ndarray:
+        """Get the metrics matrix via OSRM without blocking the loop."""
+        origin_coordinates = self._coordinates(origins)
+        destination_coordinates = self._coordinates(destinations)
+        resolved = await self._resolve_matrix_metrics_async(
+            origin_coordinates, destination_coordinates
+        )
+        return self._metrics_array(
+            resolved, origin_coordinates, destination_coordinates
+        )
+
+    async def matrix_distances_km_async(
+        self, origins: Locations, destinations: Locations
+    ) -> list[list[float]]:
+        """Get distance matrix via OSRM without blocking the loop."""
+        metrics = await self.matrix_metrics_async(origins, destinations)
+        return metrics["distance_km"].tolist()
+
+    async def matrix_travel_times_minutes_async(
+        self, origins: Locations, destinations: Locations
+    ) -> list[list[float]]:
+        """Get travel time matrix via OSRM without blocking the loop."""
+        metrics = await self.matrix_metrics_async(origins, destinations)
+        return metrics["travel_time_minutes"].tolist()
+
+    async def _resolve_matrix_metrics_async(
+        self, origins: list[Coordinate], destinations: list[Coordinate]
+    ) -> dict[CacheKey, Metrics]:
+        resolved, missing_pairs = self._lookup_matrix_metrics(origins, destinations)
+        if missing_pairs:
+            resolved.update(await self._fetch_table_metrics_async(missing_pairs))
+        return resolved
+
+    async def _fetch_table_metrics_async(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> dict[CacheKey, Metrics]:
+        fetched: dict[CacheKey, Metrics] = {}
+        for tile_metrics in await asyncio.gather(
+            *(
+                self._fetch_table_tile_async(tile)
+                for tile in self._table_tiles(missing_pairs)
+            )
+        ):
+            fetched.update(tile_metrics)
+        return fetched
+
+    async def _fetch_table_tile_async(
+        self, missing_pairs: list[CoordinatePair]
+    ) -> dict[CacheKey, Metrics]:
+        url, source_locs, destination_locs = self._table_request(missing_pairs)
+        data = await self._request_json_async(url)
+        return self._store_table_response(data, source_locs, destination_locs)
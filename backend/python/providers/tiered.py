@@ -0,0 +1,214 @@
+import threading
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+
+from models import Location, Locations, LocationTable
+from providers.base import DistanceProvider
+from providers.haversine import HaversineProvider
+from providers.instrumentation import ProviderMetrics
+
+DEFAULT_TOP_K = 4
+
+
+def _take(locations: Locations, indexes: np.ndarray) -> Locations:
+    if isinstance(locations, LocationTable):
+        return locations.take(indexes)
+    return [locations[index] for index in indexes.tolist()]
+
+
+class TieredProvider(DistanceProvider):
+    """Ranks candidates on a cheap provider and refines only the best on an exact one.
+
+    ``matrix_metrics`` builds the coarse matrix (haversine by default),
+    scaled by the detour factors, then replaces the ``top_k`` fastest cells
+    of each row with ``fine.pair_metrics`` values. Unrefined cells are
+    raised to at least the slowest refined cell of their row, so a coarse
+    estimate never outranks a refined candidate. The other cells are
+    therefore estimates, so the provider sets ``has_estimated_matrix``.
+    ``candidate_columns`` limits ranking and refinement to the destination
+    columns a caller will actually choose from (e.g. the passengers); the
+    other columns stay scaled coarse estimates.
+    ``metrics``, ``pair_metrics``, ``route_legs`` and ``solve_order``
+    always use ``fine``, so legs measured through them are exact.
+
+    With ``learn_detour`` the distance and time factors are refitted after
+    every matrix as the ratio of summed fine to summed coarse values over
+    all refined cells so far. ``ranking_stats()`` reports how often the
+    coarse best candidate of a row differed from the refined best, and an
+    ``instrumentation`` hook also receives them as ``tiered_*`` events
+    (and is passed on to ``fine`` if its own hook is unset).
+    """
+
+    has_estimated_matrix = True
+
+    def __init__(
+        self,
+        fine: DistanceProvider,
+        coarse: DistanceProvider | None = None,
+        top_k: int = DEFAULT_TOP_K,
+        detour_factor: float = 1.0,
+        learn_detour: bool = True,
+        instrumentation: ProviderMetrics | None = None,
+    ):
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+
+        self.fine = fine
+        self.coarse = coarse or HaversineProvider()
+        self.top_k = top_k
+        self.distance_factor = detour_factor
+        self.time_factor = detour_factor
+        self.learn_detour = learn_detour
+        self.instrumentation = instrumentation
+        self._lock = threading.Lock()
+        self._stats: Counter[str] = Counter()
+        # Running sums of refined cells: fine and coarse distance, time.
+        self._samples = np.zeros(4)
+
+    @property
+    def instrumentation(self) -> ProviderMetrics | None:
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, metrics: ProviderMetrics | None) -> None:
+        self._instrumentation = metrics
+        if metrics is not None and getattr(self.fine, "instrumentation", False) is None:
+            self.fine.instrumentation = metrics
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def ranking_stats(self) -> dict[str, float]:
+        """Refined and coarse cell counts and coarse/refined disagreements."""
+        with self._lock:
+            stats: dict[str, float] = dict(self._stats)
+        ranked = stats.get("rows_ranked", 0)
+        stats["disagreement_rate"] = (
+            stats.get("disagreements", 0) / ranked if ranked else 0.0
+        )
+        return stats
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        return self.fine.metrics(origin, destination)
+
+    def pair_metrics(self, origins: Locations, destinations: Locations) -> np.ndarray:
+        return self.fine.pair_metrics(origins, destinations)
+
+    def solve_order(
+        self, start: Location, stops: Locations, end: Location | None = None
+    ) -> list[int] | None:
+        return self.fine.solve_order(start, stops, end)
+
+    def route_legs(self, stops: Locations) -> list[tuple[float, float]]:
+        return self.fine.route_legs(stops)
+
+    def matrix_metrics(
+        self,
+        origins: Locations,
+        destinations: Locations,
+        candidate_columns: Sequence[int] | None = None,
+    ) -> np.ndarray:
+        result = self.coarse.matrix_metrics(origins, destinations)
+        if result.size == 0:
+            return result
+
+        ranked_columns = (
+            np.arange(result.shape[1])
+            if candidate_columns is None
+            else np.asarray(candidate_columns, dtype=np.intp)
+        )
+        if ranked_columns.size == 0:
+            result["distance_km"] *= self.distance_factor
+            result["travel_time_minutes"] *= self.time_factor
+            return result
+
+        coarse_times = result["travel_time_minutes"]
+        # Identical points are exact zeros; they never take a candidate slot.
+        ranked_times = coarse_times[:, ranked_columns]
+        ranking = np.where(ranked_times > 0.0, ranked_times, np.inf)
+        k = min(self.top_k, ranking.shape[1])
+        if k < ranking.shape[1]:
+            candidates = np.argpartition(ranking, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), ranking.shape)
+        candidate_ranking = np.take_along_axis(ranking, candidates, axis=1)
+        valid = np.isfinite(candidate_ranking)
+
+        rows = np.broadcast_to(np.arange(len(candidates))[:, np.newaxis], valid.shape)
+        rows, columns = rows[valid], ranked_columns[candidates[valid]]
+        refined = self.fine.pair_metrics(
+            _take(origins, rows), _take(destinations, columns)
+        )
+
+        refined_times = np.full(valid.shape, np.inf)
+        refined_times[valid] = refined["travel_time_minutes"]
+        compared = valid.sum(axis=1) >= 2
+        disagreements = int(
+            np.count_nonzero(
+                compared
+                & (
+                    np.argmin(candidate_ranking, axis=1)
+                    != np.argmin(refined_times, axis=1)
+                )
+            )
+        )
+
+        coarse_cells = result[rows, columns]
+        distance_factor, time_factor = self._update_factors(coarse_cells, refined)
+        result["distance_km"] *= distance_factor
+        result["travel_time_minutes"] *= time_factor
+
+        slowest = np.zeros((len(result), 1), dtype=result.dtype)
+        for field in ("distance_km", "travel_time_minutes"):
+            np.maximum.at(slowest[field][:, 0], rows, refined[field])
+        unrefined = np.zeros(coarse_times.shape, dtype=bool)
+        unrefined[:, ranked_columns] = ranked_times > 0.0
+        unrefined[rows, columns] = False
+        for field in ("distance_km", "travel_time_minutes"):
+            values = result[field]
+            values[unrefined] = np.maximum(values, slowest[field])[unrefined]
+        result[rows, columns] = refined
+
+        self._record(
+            rows_ranked=int(np.count_nonzero(compared)),
+            disagreements=disagreements,
+            refined_cells=len(rows),
+            coarse_cells=int(np.count_nonzero(unrefined)),
+        )
+        return result
+
+    def _update_factors(
+        self, coarse: np.ndarray, refined: np.ndarray
+    ) -> tuple[float, float]:
+        with self._lock:
+            if self.learn_detour:
+                # Cells the fine provider could not resolve report zeros.
+                known = refined["travel_time_minutes"] > 0.0
+                self._samples += (
+                    refined["distance_km"][known].sum(),
+                    coarse["distance_km"][known].sum(),
+                    refined["travel_time_minutes"][known].sum(),
+                    coarse["travel_time_minutes"][known].sum(),
+                )
+                fine_km, coarse_km, fine_minutes, coarse_minutes = self._samples
+                if coarse_km > 0.0:
+                    self.distance_factor = float(fine_km / coarse_km)
+                if coarse_minutes > 0.0:
+                    self.time_factor = float(fine_minutes / coarse_minutes)
+            return self.distance_factor, self.time_factor
+
+    def _record(self, **counts: int) -> None:
+        with self._lock:
+            self._stats.update(counts)
+        if self.instrumentation is not None:
+            for event, count in counts.items():
+                self.instrumentation.record_event(f"tiered_{event}", count)
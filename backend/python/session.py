@@ -0,0 +1,288 @@
+import dataclasses
+import math
+
+import numpy as np
+
+from models import Driver, Location, Passenger, Route
+from providers.base import DistanceProvider
+from providers.haversine import (
+    HaversineProvider,
+    coordinates_radians,
+    haversine_pairs_km,
+)
+from tsp import solve_pickup_order
+
+# Matrix nodes are ("driver", user_id), ("passenger", user_id) or
+# ("destination", ""), so metrics survive pickup reordering and are dropped
+# when the node leaves, moves or ends up on a different route.
+NodeKey = tuple[str, str]
+
+DESTINATION_KEY: NodeKey = ("destination", "")
+DEFAULT_CANDIDATE_ROUTES = 8
+
+
+class AssignmentSession:
+    """Live assignment state updated one event at a time.
+
+    New passengers are placed by cheapest insertion into the current pickup
+    orders of drivers with enough free seats; passengers nobody can take
+    wait in ``unassigned`` and are retried whenever seats free up or a
+    driver joins. Only the ``candidate_routes`` routes with a stop nearest
+    the passenger (by haversine) are scored with the provider, so an event
+    costs at most two small provider calls whatever the fleet size;
+    ``None`` scores every route with free seats.
+
+    Travel times and distances are cached per node pair and kept only
+    between nodes on the same route (the destination is on all of them),
+    so the cache grows with the routes, not with the events seen.
+    """
+
+    def __init__(
+        self,
+        drivers: list[Driver] | None = None,
+        destination: Location | None = None,
+        provider: DistanceProvider | None = None,
+        candidate_routes: int | None = DEFAULT_CANDIDATE_ROUTES,
+    ):
+        if candidate_routes is not None and candidate_routes < 1:
+            raise ValueError("candidate_routes must be at least 1")
+
+        self.destination = destination
+        self.provider = provider or HaversineProvider()
+        self.candidate_routes = candidate_routes
+        self._routes: dict[str, Route] = {}
+        self._unassigned: dict[str, Passenger] = {}
+        self._route_of: dict[str, str] = {}
+        self._locations: dict[NodeKey, Location] = {}
+        # _metrics[origin][destination] = (distance_km, travel_time_minutes);
+        # _incoming[destination] lists the origins that have a cell for it.
+        self._metrics: dict[NodeKey, dict[NodeKey, tuple[float, float]]] = {}
+        self._incoming: dict[NodeKey, set[NodeKey]] = {}
+        # Radian (latitudes, longitudes) of each route's driver and pickups,
+        # for ranking routes without touching the provider.
+        self._stop_radians: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        if destination is not None:
+            self._locations[DESTINATION_KEY] = destination
+        for driver in drivers or []:
+            self.add_driver(driver)
+
+    @property
+    def routes(self) -> list[Route]:
+        return list(self._routes.values())
+
+    @property
+    def unassigned(self) -> list[Passenger]:
+        return list(self._unassigned.values())
+
+    def route_for(self, passenger_id: str) -> Route | None:
+        driver_id = self._route_of.get(passenger_id)
+        return self._routes[driver_id] if driver_id is not None else None
+
+    def add_driver(self, driver: Driver) -> Route:
+        """Add an empty route for ``driver`` and seat any waiting passengers."""
+        if driver.user_id in self._routes:
+            raise ValueError(f"Driver {driver.user_id!r} is already in the session")
+
+        self._locations[("driver", driver.user_id)] = driver.location
+        route = Route(driver=driver, unfilled_seats=driver.capacity)
+        self._routes[driver.user_id] = route
+        self._refresh_totals(route)
+        self._seat_waiting([route])
+        return route
+
+    def add_passenger(self, passenger: Passenger) -> Route | None:
+        """Insert ``passenger`` where it adds the least travel time.
+
+        Returns the route that picked the passenger up, or ``None`` if no
+        driver has enough free seats (the passenger then waits).
+        """
+        if passenger.user_id in self._route_of or passenger.user_id in self._unassigned:
+            raise ValueError(
+                f"Passenger {passenger.user_id!r} is already in the session"
+            )
+
+        self._locations[("passenger", passenger.user_id)] = passenger.location
+        route = self._insert(passenger, list(self._routes.values()))
+        if route is None:
+            self._unassigned[passenger.user_id] = passenger
+        return route
+
+    def remove_passenger(self, passenger_id: str) -> None:
+        """Drop a passenger (e.g. a cancelled request) and reuse the seats."""
+        key: NodeKey = ("passenger", passenger_id)
+        if self._unassigned.pop(passenger_id, None) is not None:
+            self._forget(key)
+            return
+
+        route = self._routes[self._route_of.pop(passenger_id)]
+        route.passengers = [p for p in route.passengers if p.user_id != passenger_id]
+        route.pickup_order = [
+            p for p in route.pickup_order if p.user_id != passenger_id
+        ]
+        self._forget(key)
+        self._refresh_totals(route)
+        self._seat_waiting([route])
+
+    def driver_moved(self, driver_id: str, location: Location) -> Route:
+        """Update a driver's position and re-plan that driver's pickups."""
+        route = self._routes[driver_id]
+        key: NodeKey = ("driver", driver_id)
+        self._forget(key)
+        self._locations[key] = location
+        route.driver = dataclasses.replace(route.driver, location=location)
+
+        if len(route.pickup_order) > 1:
+            nodes = self._route_nodes(route)
+            self._ensure_metrics(nodes, nodes)
+            cost = [[self._metrics[a][b][1] for b in nodes] for a in nodes]
+            end = len(nodes) - 1 if self.destination is not None else None
+            order = solve_pickup_order(
+                cost, 0, list(range(1, len(route.pickup_order) + 1)), end=end
+            )
+            route.pickup_order = [route.pickup_order[i - 1] for i in order]
+        self._refresh_totals(route)
+        return route
+
+    def _route_nodes(self, route: Route) -> list[NodeKey]:
+        nodes: list[NodeKey] = [("driver", route.driver.user_id)]
+        nodes.extend(("passenger", p.user_id) for p in route.pickup_order)
+        if self.destination is not None:
+            nodes.append(DESTINATION_KEY)
+        return nodes
+
+    def _ensure_metrics(
+        self, origins: list[NodeKey], destinations: list[NodeKey]
+    ) -> None:
+        """Fetch the missing (origin, destination) pairs with one matrix call."""
+        missing_origins: dict[NodeKey, None] = {}
+        missing_destinations: dict[NodeKey, None] = {}
+        for origin in origins:
+            row = self._metrics.get(origin, {})
+            for destination in destinations:
+                if destination not in row:
+                    missing_origins[origin] = None
+                    missing_destinations[destination] = None
+        if not missing_origins:
+            return
+
+        origin_keys = list(missing_origins)
+        destination_keys = list(missing_destinations)
+        origin_locations = [self._locations[key] for key in origin_keys]
+        destination_locations = [self._locations[key] for key in destination_keys]
+        metrics = self.provider.matrix_metrics(origin_locations, destination_locations)
+        distances = metrics["distance_km"].tolist()
+        travel_times = metrics["travel_time_minutes"].tolist()
+        for row, origin in enumerate(origin_keys):
+            cells = self._metrics.setdefault(origin, {})
+            for column, destination in enumerate(destination_keys):
+                cells[destination] = (distances[row][column], travel_times[row][column])
+                self._incoming.setdefault(destination, set()).add(origin)
+
+    def _forget(self, key: NodeKey) -> None:
+        self._locations.pop(key, None)
+        self._prune(key, set())
+
+    def _prune(self, key: NodeKey, keep: set[NodeKey]) -> None:
+        """Drop cached cells between ``key`` and every node not in ``keep``."""
+        row = self._metrics.get(key, {})
+        for destination in [node for node in row if node not in keep]:
+            del row[destination]
+            self._incoming[destination].discard(key)
+        if not row:
+            self._metrics.pop(key, None)
+        incoming = self._incoming.get(key, set())
+        for origin in [node for node in incoming if node not in keep]:
+            incoming.discard(origin)
+            cells = self._metrics[origin]
+            del cells[key]
+            if not cells:
+                del self._metrics[origin]
+        if not incoming:
+            self._incoming.pop(key, None)
+
+    def _nearest_routes(self, location: Location, routes: list[Route]) -> list[Route]:
+        """The ``candidate_routes`` routes with a stop closest to ``location``."""
+        if self.candidate_routes is None or len(routes) <= self.candidate_routes:
+            return routes
+
+        stops = [self._stop_radians[route.driver.user_id] for route in routes]
+        starts = np.cumsum([0] + [len(latitudes) for latitudes, _ in stops[:-1]])
+        latitude, longitude = math.radians(location.latitude), math.radians(
+            location.longitude
+        )
+        distances = haversine_pairs_km(
+            latitude,
+            longitude,
+            np.concatenate([latitudes for latitudes, _ in stops]),
+            np.concatenate([longitudes for _, longitudes in stops]),
+        )
+        nearest = np.minimum.reduceat(distances, starts)
+        chosen = np.argpartition(nearest, self.candidate_routes - 1)[
+            : self.candidate_routes
+        ]
+        return [routes[index] for index in sorted(chosen.tolist())]
+
+    def _insert(self, passenger: Passenger, candidates: list[Route]) -> Route | None:
+        candidates = [
+            route
+            for route in candidates
+            if route.unfilled_seats >= passenger.seats_required
+        ]
+        if not candidates:
+            return None
+
+        key: NodeKey = ("passenger", passenger.user_id)
+        candidates = self._nearest_routes(passenger.location, candidates)
+        stops = [node for route in candidates for node in self._route_nodes(route)]
+        self._ensure_metrics([key], stops)
+        self._ensure_metrics(stops, [key])
+
+        best_delta = math.inf
+        best: tuple[Route, int] | None = None
+        for route in candidates:
+            nodes = self._route_nodes(route)
+            gaps = len(route.pickup_order) + 1
+            for position in range(gaps):
+                before = nodes[position]
+                after = nodes[position + 1] if position + 1 < len(nodes) else None
+                delta = self._metrics[before][key][1]
+                if after is not None:
+                    delta += (
+                        self._metrics[key][after][1] - self._metrics[before][after][1]
+                    )
+                if delta < best_delta:
+                    best_delta = delta
+                    best = (route, position)
+
+        route, position = best
+        # Cells to the other candidates' stops are not needed again.
+        self._prune(key, set(self._route_nodes(route)))
+        route.passengers.append(passenger)
+        route.pickup_order.insert(position, passenger)
+        self._route_of[passenger.user_id] = route.driver.user_id
+        self._refresh_totals(route)
+        return route
+
+    def _seat_waiting(self, routes: list[Route]) -> None:
+        for passenger_id, passenger in list(self._unassigned.items()):
+            if self._insert(passenger, routes) is not None:
+                del self._unassigned[passenger_id]
+
+    def _refresh_totals(self, route: Route) -> None:
+        self._stop_radians[route.driver.user_id] = coordinates_radians(
+            [route.driver.location, *(p.location for p in route.pickup_order)]
+        )
+        nodes = self._route_nodes(route)
+        legs = list(zip(nodes, nodes[1:]))
+        for origin, destination in legs:
+            if destination not in self._metrics.get(origin, {}):
+                self._ensure_metrics(nodes, nodes)
+                break
+
+        route.leg_distances_km = [self._metrics[a][b][0] for a, b in legs]
+        route.leg_travel_times_minutes = [self._metrics[a][b][1] for a, b in legs]
+        route.total_distance_km = sum(route.leg_distances_km)
+        route.total_travel_time_minutes = sum(route.leg_travel_times_minutes)
+        route.unfilled_seats = route.driver.capacity - sum(
+            p.seats_required for p in route.passengers
+        )
@@ -0,0 +1,194 @@
+import heapq
+import math
+
+import numpy as np
+
+from models import Location, LocationRef, Locations
+from providers.haversine import EARTH_RADIUS_KM, coordinates_radians
+
+# Grid cells are sized so an average occupied cell holds about this many points.
+DEFAULT_POINTS_PER_CELL = 4.0
+
+Point = Location | LocationRef
+
+
+class SpatialIndex:
+    """Uniform grid over locations for k-nearest and radius queries with deletion.
+
+    Coordinates are projected once to an equirectangular plane in km around
+    the mean latitude, so distances match haversine closely at city scale
+    (well under 1% across a metro area). Indexes refer to positions in the
+    ``locations`` the index was built from; ``remove`` drops a point from all
+    later queries in O(1).
+    """
+
+    def __init__(self, locations: Locations, cell_size_km: float | None = None):
+        latitudes, longitudes = coordinates_radians(locations)
+        self._reference_cos = (
+            math.cos(float(np.mean(latitudes))) if len(latitudes) else 1.0
+        )
+        self._x = longitudes * (EARTH_RADIUS_KM * self._reference_cos)
+        self._y = latitudes * EARTH_RADIUS_KM
+        self.cell_size_km = (
+            cell_size_km
+            if cell_size_km is not None and cell_size_km > 0
+            else self._default_cell_size()
+        )
+
+        self._cells: dict[tuple[int, int], set[int]] = {}
+        self._alive = np.ones(len(latitudes), dtype=bool)
+        self._size = len(latitudes)
+        cell_x = np.floor(self._x / self.cell_size_km).astype(np.int64)
+        cell_y = np.floor(self._y / self.cell_size_km).astype(np.int64)
+        self._cell_of = list(zip(cell_x.tolist(), cell_y.tolist()))
+        self._bounds = (
+            (
+                int(cell_x.min()),
+                int(cell_y.min()),
+                int(cell_x.max()),
+                int(cell_y.max()),
+            )
+            if len(cell_x)
+            else (0, 0, 0, 0)
+        )
+        for index, cell in enumerate(self._cell_of):
+            self._cells.setdefault(cell, set()).add(index)
+
+    def _default_cell_size(self) -> float:
+        count = len(self._x)
+        if count < 2:
+            return 1.0
+        width = float(np.ptp(self._x))
+        height = float(np.ptp(self._y))
+        area = max(width, 1e-3) * max(height, 1e-3)
+        return max(math.sqrt(area * DEFAULT_POINTS_PER_CELL / count), 1e-3)
+
+    def _project(self, point: Point) -> tuple[float, float]:
+        return (
+            math.radians(point.longitude) * EARTH_RADIUS_KM * self._reference_cos,
+            math.radians(point.latitude) * EARTH_RADIUS_KM,
+        )
+
+    def _ring(self, center: tuple[int, int], radius: int) -> list[int]:
+        """Live point indexes in the square ring of cells ``radius`` steps out."""
+        cx, cy = center
+        if radius == 0:
+            return list(self._cells.get(center, ()))
+
+        found: list[int] = []
+        for dx in range(-radius, radius + 1):
+            for dy in (-radius, radius):
+                found.extend(self._cells.get((cx + dx, cy + dy), ()))
+        for dy in range(-radius + 1, radius):
+            for dx in (-radius, radius):
+                found.extend(self._cells.get((cx + dx, cy + dy), ()))
+        return found
+
+    def _max_ring(self, center: tuple[int, int]) -> int:
+        """Ring radius that covers every cell the index was built with."""
+        cx, cy = center
+        low_x, low_y, high_x, high_y = self._bounds
+        return max(cx - low_x, high_x - cx, cy - low_y, high_y - cy, 0)
+
+    def _distances(self, candidates: list[int], x: float, y: float) -> list[float]:
+        indexes = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        return np.hypot(self._x[indexes] - x, self._y[indexes] - y).tolist()
+
+    def _push_nearest(
+        self,
+        best: list[tuple[float, int]],
+        k: int,
+        x: float,
+        y: float,
+        candidates: list[int],
+    ) -> None:
+        if not candidates:
+            return
+        for distance, index in zip(self._distances(candidates, x, y), candidates):
+            if len(best) < k:
+                heapq.heappush(best, (-distance, index))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, index))
+
+    def nearest(self, point: Point, k: int) -> list[tuple[float, int]]:
+        """Up to ``k`` live points closest to ``point`` as (distance_km, index)."""
+        if k <= 0 or self._size == 0:
+            return []
+
+        x, y = self._project(point)
+        center = (
+            math.floor(x / self.cell_size_km),
+            math.floor(y / self.cell_size_km),
+        )
+        max_ring = self._max_ring(center)
+        best: list[tuple[float, int]] = []  # max-heap via negated distances
+        for radius in range(max_ring + 1):
+            if 8 * radius > len(self._cells):
+                # Mostly empty rings (a sparse, depleted index): scanning the
+                # occupied cells directly is cheaper than walking the grid.
+                candidates = [
+                    index
+                    for cell, members in self._cells.items()
+                    if max(abs(cell[0] - center[0]), abs(cell[1] - center[1]))
+                    >= radius
+                    for index in members
+                ]
+                self._push_nearest(best, k, x, y, candidates)
+                break
+
+            self._push_nearest(best, k, x, y, self._ring(center, radius))
+            # Every unvisited cell is at least ``radius`` cells away.
+            if len(best) == k and -best[0][0] <= radius * self.cell_size_km:
+                break
+
+        return sorted((-distance, index) for distance, index in best)
+
+    def within(self, point: Point, radius_km: float) -> list[tuple[float, int]]:
+        """Live points within ``radius_km`` of ``point`` as (distance_km, index)."""
+        if radius_km < 0 or self._size == 0:
+            return []
+
+        x, y = self._project(point)
+        size = self.cell_size_km
+        low_x = math.floor((x - radius_km) / size)
+        high_x = math.floor((x + radius_km) / size)
+        low_y = math.floor((y - radius_km) / size)
+        high_y = math.floor((y + radius_km) / size)
+
+        candidates: list[int] = []
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > len(self._cells):
+            for (cell_x, cell_y), members in self._cells.items():
+                if low_x <= cell_x <= high_x and low_y <= cell_y <= high_y:
+                    candidates.extend(members)
+        else:
+            for cell_x in range(low_x, high_x + 1):
+                for cell_y in range(low_y, high_y + 1):
+                    candidates.extend(self._cells.get((cell_x, cell_y), ()))
+        if not candidates:
+            return []
+
+        return sorted(
+            (distance, index)
+            for distance, index in zip(self._distances(candidates, x, y), candidates)
+            if distance <= radius_km
+        )
+
+    def remove(self, index: int) -> None:
+        """Drop ``index`` from later queries; removing twice is a no-op."""
+        if not self._alive[index]:
+            return
+        self._alive[index] = False
+        self._size -= 1
+        cell = self._cell_of[index]
+        members = self._cells[cell]
+        members.discard(index)
+        if not members:
+            del self._cells[cell]
+
+    def __contains__(self, index: object) -> bool:
+        return isinstance(index, int) and 0 <= index < len(self._alive) and bool(
+            self._alive[index]
+        )
+
+    def __len__(self) -> int:
+        return self._size
@@ -0,0 +1,130 @@
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class Span:
+    """One timed phase: name, parent, duration and free-form counters."""
+
+    name: str
+    parent: int | None
+    started: float
+    seconds: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    counters: Counter[str] = field(default_factory=Counter)
+
+    def count(self, key: str, amount: int = 1) -> None:
+        self.counters[key] += amount
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class _NullSpan:
+    """Span stand-in that ignores everything, shared by every NullTracer span."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        return None
+
+    def count(self, key: str, amount: int = 1) -> None:
+        pass
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Hook for phase timings; the base class records nothing.
+
+    Instrumented code calls ``with tracer.span(name, **attributes) as span``
+    around each phase and ``span.count(...)`` for counters such as
+    candidates scanned or provider calls. The default tracer returns one
+    shared no-op span, so untraced calls pay a method call per phase.
+    """
+
+    def span(self, name: str, **attributes: Any) -> Any:
+        return NULL_SPAN
+
+
+NULL_TRACER = Tracer()
+
+
+class _RecordingSpan:
+    __slots__ = ("tracer", "span", "index")
+
+    def __init__(self, tracer: "RecordingTracer", span: Span, index: int):
+        self.tracer = tracer
+        self.span = span
+        self.index = index
+
+    def __enter__(self) -> Span:
+        self.tracer._stack.append(self.index)
+        self.span.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.span.seconds = time.perf_counter() - self.span.started
+        self.tracer._stack.pop()
+
+
+class RecordingTracer(Tracer):
+    """Tracer keeping every span, nested by the order they were opened.
+
+    ``summary()`` aggregates spans by their name path; ``folded()`` renders
+    self time in the folded-stack format read by flamegraph.pl and
+    speedscope. Not thread-safe: use one tracer per thread.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self._stack: list[int] = []
+
+    def span(self, name: str, **attributes: Any) -> _RecordingSpan:
+        parent = self._stack[-1] if self._stack else None
+        span = Span(name, parent, 0.0, attributes=attributes)
+        self.spans.append(span)
+        return _RecordingSpan(self, span, len(self.spans) - 1)
+
+    def path(self, index: int) -> tuple[str, ...]:
+        names = []
+        current: int | None = index
+        while current is not None:
+            names.append(self.spans[current].name)
+            current = self.spans[current].parent
+        return tuple(reversed(names))
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """Per name path ("assign;greedy"): span count, seconds and counters."""
+        totals: dict[str, dict[str, Any]] = {}
+        for index, span in enumerate(self.spans):
+            entry = totals.setdefault(
+                ";".join(self.path(index)),
+                {"count": 0, "seconds": 0.0, "counters": Counter()},
+            )
+            entry["count"] += 1
+            entry["seconds"] += span.seconds
+            entry["counters"].update(span.counters)
+        return totals
+
+    def folded(self) -> str:
+        """Folded stacks ("a;b;c <self microseconds>"), one line per path."""
+        child_seconds = [0.0] * len(self.spans)
+        for span in self.spans:
+            if span.parent is not None:
+                child_seconds[span.parent] += span.seconds
+
+        self_micros: Counter[str] = Counter()
+        for index, span in enumerate(self.spans):
+            own = max(span.seconds - child_seconds[index], 0.0)
+            self_micros[";".join(self.path(index))] += round(own * 1e6)
+        return "".join(f"{stack} {micros}\n" for stack, micros in self_micros.items())
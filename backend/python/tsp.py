@@ -1,12 +1,380 @@
-from models import Location
+import math
+import time
+from collections import deque
+from collections.abc import Sequence
+
+import numpy as np
+
+from models import Location, LocationTable
 from providers.base import DistanceProvider
+from providers.condensed import CondensedMatrix
 from providers.haversine import HaversineProvider
+from tracing import NULL_TRACER, Tracer
+
+DEFAULT_NEIGHBOR_COUNT = 8
+# Held-Karp is O(2^n * n^2); at 8 stops that is ~16k transitions per route.
+DEFAULT_EXACT_STOP_LIMIT = 8
+
+
+def nearest_neighbor_order(
+    travel_times: Sequence[Sequence[float]],
+    start: int,
+    stops: list[int],
+) -> list[int]:
+    unvisited = stops.copy()
+    ordered: list[int] = []
+    current = start
+
+    while unvisited:
+        row = travel_times[current]
+        next_stop = min(unvisited, key=lambda stop: row[stop])
+        ordered.append(next_stop)
+        unvisited.remove(next_stop)
+        current = next_stop
+
+    return ordered
+
+
+def cost_submatrix(
+    travel_times: Sequence[Sequence[float]] | np.ndarray | CondensedMatrix,
+    nodes: list[int],
+) -> list[list[float]]:
+    """Dense list-of-lists of travel_times restricted to ``nodes`` (in order)."""
+    if isinstance(travel_times, CondensedMatrix):
+        return travel_times.submatrix(nodes).tolist()
+    if isinstance(travel_times, np.ndarray):
+        return travel_times[np.ix_(nodes, nodes)].tolist()
+    return [
+        [float(travel_times[origin][target]) for target in nodes] for origin in nodes
+    ]
+
+
+def _neighbor_lists(
+    cost: list[list[float]], neighbor_count: int
+) -> tuple[list[list[int]], list[list[int]]]:
+    # Node 0 is the fixed start (never a successor) and the last node is the
+    # fixed end (never a predecessor).
+    last = len(cost) - 1
+    outgoing: list[list[int]] = []
+    incoming: list[list[int]] = []
+    for node in range(len(cost)):
+        successors = [other for other in range(1, last + 1) if other != node]
+        predecessors = [other for other in range(last) if other != node]
+        outgoing.append(
+            sorted(successors, key=lambda other: cost[node][other])[:neighbor_count]
+        )
+        incoming.append(
+            sorted(predecessors, key=lambda other: cost[other][node])[:neighbor_count]
+        )
+    return outgoing, incoming
+
+
+def _improve_path(
+    cost: list[list[float]],
+    tour: list[int],
+    neighbor_count: int,
+    deadline: float | None,
+) -> list[int]:
+    """2-opt and Or-opt local search on a path with fixed first and last nodes.
+
+    Candidate moves come from per-node neighbor lists and nodes whose
+    surroundings did not change are skipped via don't-look bits. Costs may
+    be asymmetric, so 2-opt accounts for the reversed segment's cost.
+    """
+    last = len(tour) - 1
+    if last < 3:
+        return tour
+
+    outgoing, incoming = _neighbor_lists(cost, neighbor_count)
+    position = [0] * len(tour)
+    forward = [0.0] * len(tour)
+    backward = [0.0] * len(tour)
+
+    def reindex() -> None:
+        for index, node in enumerate(tour):
+            position[node] = index
+        for index in range(last):
+            forward[index + 1] = forward[index] + cost[tour[index]][tour[index + 1]]
+            backward[index + 1] = backward[index] + cost[tour[index + 1]][tour[index]]
+
+    def reversal_delta(first: int, second: int) -> float:
+        # Reverse tour[first..second] (inclusive), 1 <= first < second < last.
+        before = tour[first - 1]
+        after = tour[second + 1]
+        return (
+            cost[before][tour[second]]
+            + cost[tour[first]][after]
+            - cost[before][tour[first]]
+            - cost[tour[second]][after]
+            + (backward[second] - backward[first])
+            - (forward[second] - forward[first])
+        )
+
+    def try_two_opt(node: int) -> list[int] | None:
+        index = position[node]
+        if index < last:
+            current = cost[node][tour[index + 1]]
+            for neighbor in outgoing[node]:
+                if cost[node][neighbor] >= current:
+                    break
+                other = position[neighbor]
+                if (
+                    index + 1 < other < last
+                    and reversal_delta(index + 1, other) < -1e-9
+                ):
+                    tour[index + 1 : other + 1] = tour[index + 1 : other + 1][::-1]
+                    return [node, neighbor, tour[index + 1], tour[other + 1]]
+        if index > 0:
+            current = cost[tour[index - 1]][node]
+            for neighbor in incoming[node]:
+                if cost[neighbor][node] >= current:
+                    break
+                other = position[neighbor]
+                if 1 <= other < index - 1 and reversal_delta(other, index - 1) < -1e-9:
+                    tour[other:index] = tour[other:index][::-1]
+                    return [node, neighbor, tour[other - 1], tour[other]]
+        return None
+
+    def try_or_opt(node: int) -> list[int] | None:
+        first = position[node]
+        if first == 0 or first == last:
+            return None
+        for length in (1, 2, 3):
+            end = first + length - 1
+            if end >= last:
+                break
+            head = tour[first]
+            tail = tour[end]
+            before = tour[first - 1]
+            after = tour[end + 1]
+            removal_gain = (
+                cost[before][head] + cost[tail][after] - cost[before][after]
+            )
+            # Insert between (predecessor, successor): either right after a
+            # node that reaches the segment head cheaply, or right before a
+            # node the segment tail reaches cheaply.
+            gaps = [position[neighbor] for neighbor in incoming[head]]
+            gaps.extend(position[neighbor] - 1 for neighbor in outgoing[tail])
+            for insert_after in gaps:
+                if first - 1 <= insert_after <= end:
+                    continue
+                predecessor = tour[insert_after]
+                successor = tour[insert_after + 1]
+                insertion_cost = (
+                    cost[predecessor][head]
+                    + cost[tail][successor]
+                    - cost[predecessor][successor]
+                )
+                if insertion_cost - removal_gain < -1e-9:
+                    segment = tour[first : end + 1]
+                    del tour[first : end + 1]
+                    target = tour.index(predecessor) + 1
+                    tour[target:target] = segment
+                    return [head, tail, before, after, predecessor, successor]
+        return None
+
+    reindex()
+    active = deque(tour[1:last])
+    queued = set(active)
+    while active:
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        node = active.popleft()
+        queued.discard(node)
+
+        touched = try_two_opt(node) or try_or_opt(node)
+        if touched is None:
+            continue
+
+        reindex()
+        for changed in touched:
+            if 0 < position[changed] < last and changed not in queued:
+                active.append(changed)
+                queued.add(changed)
+        if node not in queued:
+            active.append(node)
+            queued.add(node)
+
+    return tour
+
+
+def solve_open_tsp(
+    travel_times: Sequence[Sequence[float]] | np.ndarray | CondensedMatrix,
+    start: int,
+    stops: list[int],
+    end: int | None = None,
+    time_budget_seconds: float | None = None,
+    neighbor_count: int = DEFAULT_NEIGHBOR_COUNT,
+) -> list[int]:
+    """Order ``stops`` on a path from ``start``, optionally ending at ``end``.
+
+    Indexes refer to rows/columns of ``travel_times``. The tour is built by
+    nearest neighbor and then improved with 2-opt and Or-opt until no
+    improving move remains or ``time_budget_seconds`` runs out.
+    """
+    if len(stops) < 2:
+        return stops.copy()
+
+    deadline = (
+        None
+        if time_budget_seconds is None
+        else time.perf_counter() + max(time_budget_seconds, 0.0)
+    )
+    nodes = [start, *stops]
+    if end is not None:
+        nodes.append(end)
+    cost = cost_submatrix(travel_times, nodes)
+    if end is None:
+        # A free end is modelled as a dummy node reachable from anywhere at no cost.
+        for row in cost:
+            row.append(0.0)
+        cost.append([0.0] * (len(nodes) + 1))
+
+    end_node = len(cost) - 1
+    tour = [0, *nearest_neighbor_order(cost, 0, list(range(1, end_node))), end_node]
+    tour = _improve_path(cost, tour, max(neighbor_count, 1), deadline)
+
+    return [nodes[node] for node in tour[1:-1]]
+
+
+def held_karp_order(
+    travel_times: Sequence[Sequence[float]] | np.ndarray | CondensedMatrix,
+    start: int,
+    stops: list[int],
+    end: int | None = None,
+) -> list[int]:
+    """Exact minimum-cost ordering of ``stops`` from ``start`` (to ``end``).
+
+    Bitmask dynamic program over subsets of stops; only use it for small
+    stop counts.
+    """
+    count = len(stops)
+    if count < 2:
+        return stops.copy()
+
+    nodes = [start, *stops]
+    if end is not None:
+        nodes.append(end)
+    cost = cost_submatrix(travel_times, nodes)
+
+    full = (1 << count) - 1
+    best = [[math.inf] * count for _ in range(full + 1)]
+    parent = [[-1] * count for _ in range(full + 1)]
+    for stop in range(count):
+        best[1 << stop][stop] = cost[0][stop + 1]
+
+    for mask in range(1, full + 1):
+        row = best[mask]
+        for last in range(count):
+            path_cost = row[last]
+            if path_cost == math.inf:
+                continue
+            last_costs = cost[last + 1]
+            for stop in range(count):
+                bit = 1 << stop
+                if mask & bit:
+                    continue
+                candidate = path_cost + last_costs[stop + 1]
+                extended = mask | bit
+                if candidate < best[extended][stop]:
+                    best[extended][stop] = candidate
+                    parent[extended][stop] = last
+
+    end_node = count + 1
+    final = best[full]
+    if end is not None:
+        final = [final[stop] + cost[stop + 1][end_node] for stop in range(count)]
+    last = min(range(count), key=final.__getitem__)
+
+    ordered: list[int] = []
+    mask = full
+    while last != -1:
+        ordered.append(stops[last])
+        previous = parent[mask][last]
+        mask &= ~(1 << last)
+        last = previous
+
+    ordered.reverse()
+    return ordered
+
+
+def solve_pickup_order(
+    travel_times: Sequence[Sequence[float]] | np.ndarray | CondensedMatrix,
+    start: int,
+    stops: list[int],
+    end: int | None = None,
+    exact_stop_limit: int = DEFAULT_EXACT_STOP_LIMIT,
+    time_budget_seconds: float | None = None,
+) -> list[int]:
+    """Exact Held-Karp ordering for small routes, local search otherwise."""
+    if len(stops) <= exact_stop_limit:
+        return held_karp_order(travel_times, start, stops, end=end)
+    return solve_open_tsp(
+        travel_times, start, stops, end=end, time_budget_seconds=time_budget_seconds
+    )
+
+
+def _self_travel_times(
+    provider: DistanceProvider, table: LocationTable
+) -> np.ndarray | CondensedMatrix:
+    """Travel times among ``table``, condensed when the provider is symmetric."""
+    if provider.is_symmetric:
+        return provider.condensed_matrix_metrics(table)["travel_time_minutes"]
+    return provider.matrix_metrics(table, table)["travel_time_minutes"]
+
+
+def nearest_neighbor_table_tsp(
+    table: LocationTable,
+    start: int,
+    stops: list[int],
+    provider: DistanceProvider | None = None,
+    tracer: Tracer = NULL_TRACER,
+) -> list[int]:
+    if not stops:
+        return []
+
+    if provider is None:
+        provider = HaversineProvider()
+
+    rows = [start, *stops]
+    with tracer.span("matrix", symmetric=provider.is_symmetric) as span:
+        span.count("provider_calls")
+        travel_times = _self_travel_times(provider, table.take(rows))
+    with tracer.span("order") as span:
+        # Each step scans every stop still unvisited.
+        span.count("candidates_scanned", len(stops) * (len(stops) + 1) // 2)
+        ordered = nearest_neighbor_order(travel_times, 0, list(range(1, len(rows))))
+
+    return [rows[index] for index in ordered]
 
 
 def nearest_neighbor_tsp(
     start: Location,
     stops: list[Location],
     provider: DistanceProvider | None = None,
+    tracer: Tracer | None = None,
+) -> list[Location]:
+    """Greedy stop order from ``start``; ``tracer`` gets matrix/order spans."""
+    if not stops:
+        return []
+
+    if tracer is None:
+        tracer = NULL_TRACER
+    table = LocationTable.from_locations([start, *stops])
+    with tracer.span("nearest_neighbor_tsp", stops=len(stops)):
+        ordered = nearest_neighbor_table_tsp(
+            table, 0, list(range(1, len(table))), provider=provider, tracer=tracer
+        )
+
+    return [stops[index - 1] for index in ordered]
+
+
+def local_search_tsp(
+    start: Location,
+    stops: list[Location],
+    provider: DistanceProvider | None = None,
+    end: Location | None = None,
+    time_budget_seconds: float | None = None,
 ) -> list[Location]:
     if not stops:
         return []
@@ -14,16 +382,17 @@ def nearest_neighbor_tsp(
     if provider is None:
         provider = HaversineProvider()
 
-    unvisited = stops.copy()
-    ordered: list[Location] = []
-    current = start
-
-    while unvisited:
-        next_stop = min(
-            unvisited, key=lambda stop: provider.travel_time_minutes(current, stop)
-        )
-        ordered.append(next_stop)
-        unvisited.remove(next_stop)
-        current = next_stop
+    locations = [start, *stops]
+    if end is not None:
+        locations.append(end)
+    table = LocationTable.from_locations(locations)
+    travel_times = _self_travel_times(provider, table)
+    ordered = solve_open_tsp(
+        travel_times,
+        0,
+        list(range(1, len(stops) + 1)),
+        end=len(stops) + 1 if end is not None else None,
+        time_budget_seconds=time_budget_seconds,
+    )
 
-    return ordered
+    return [stops[index - 1] for index in ordered]
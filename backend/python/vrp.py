@@ -0,0 +1,383 @@
+import heapq
+import math
+import time
+from collections.abc import Callable, Sequence
+
+import numpy as np
+
+from providers.condensed import CondensedMatrix, condensed_index
+
+DEFAULT_TIME_LIMIT_SECONDS = 5.0
+DEFAULT_CANDIDATE_DRIVER_COUNT = 8
+
+Matrix = Sequence[Sequence[float]] | np.ndarray | CondensedMatrix
+
+
+def _cell_lookup(travel_times: Matrix) -> Callable[[int, int], float]:
+    """Scalar ``travel_times[origin][target]`` without densifying the matrix.
+
+    The solver does many single-cell lookups; ``ndarray.item`` and reads of
+    the condensed values return Python floats without building row copies.
+    """
+    if isinstance(travel_times, CondensedMatrix):
+        values, size = travel_times.values, travel_times.size
+
+        def condensed_cell(origin: int, target: int) -> float:
+            if origin == target:
+                return 0.0
+            return values.item(condensed_index(size, origin, target))
+
+        return condensed_cell
+    if isinstance(travel_times, np.ndarray):
+        return travel_times.item
+    return lambda origin, target: travel_times[origin][target]
+
+
+class _Routes:
+    """Pickup sequences per driver with incremental insertion/removal costs."""
+
+    def __init__(
+        self,
+        travel_times: Matrix,
+        driver_nodes: list[int],
+        capacities: list[int],
+        destination: int | None,
+    ):
+        self.travel_time = _cell_lookup(travel_times)
+        self.driver_nodes = driver_nodes
+        self.capacities = capacities
+        self.destination = destination
+        self.sequences: list[list[int]] = [[] for _ in driver_nodes]
+        self.load = [0] * len(driver_nodes)
+
+    def _cost(self, origin: int, target: int | None) -> float:
+        if target is None:
+            return 0.0
+        return self.travel_time(origin, target)
+
+    def _neighbors(self, route: int, position: int) -> tuple[int, int | None]:
+        """Nodes before and after the gap at ``position`` in ``route``."""
+        sequence = self.sequences[route]
+        before = sequence[position - 1] if position > 0 else self.driver_nodes[route]
+        after = sequence[position] if position < len(sequence) else self.destination
+        return before, after
+
+    def best_insertion(self, route: int, node: int) -> tuple[float, int]:
+        best_delta = math.inf
+        best_position = 0
+        for position in range(len(self.sequences[route]) + 1):
+            before, after = self._neighbors(route, position)
+            delta = (
+                self.travel_time(before, node)
+                + self._cost(node, after)
+                - self._cost(before, after)
+            )
+            if delta < best_delta:
+                best_delta = delta
+                best_position = position
+        return best_delta, best_position
+
+    def removal_delta(self, route: int, position: int) -> float:
+        node = self.sequences[route][position]
+        before, _ = self._neighbors(route, position)
+        after = (
+            self.sequences[route][position + 1]
+            if position + 1 < len(self.sequences[route])
+            else self.destination
+        )
+        return (
+            self._cost(before, after)
+            - self.travel_time(before, node)
+            - self._cost(node, after)
+        )
+
+    def insert(self, route: int, position: int, node: int, demand: int) -> None:
+        self.sequences[route].insert(position, node)
+        self.load[route] += demand
+
+    def remove(self, route: int, position: int, demand: int) -> int:
+        self.load[route] -= demand
+        return self.sequences[route].pop(position)
+
+    def fits(self, route: int, demand: int) -> bool:
+        return self.load[route] + demand <= self.capacities[route]
+
+
+def _candidate_routes(
+    travel_time: Callable[[int, int], float],
+    driver_nodes: list[int],
+    passenger_nodes: list[int],
+    candidate_count: int,
+) -> list[list[int]]:
+    if len(driver_nodes) <= candidate_count:
+        everyone = list(range(len(driver_nodes)))
+        return [everyone for _ in passenger_nodes]
+
+    return [
+        heapq.nsmallest(
+            candidate_count,
+            range(len(driver_nodes)),
+            key=lambda route: travel_time(driver_nodes[route], node),
+        )
+        for node in passenger_nodes
+    ]
+
+
+def solve_capacitated_vrp(
+    travel_times: Matrix,
+    driver_nodes: list[int],
+    capacities: list[int],
+    passenger_nodes: list[int],
+    demands: list[int],
+    destination: int | None = None,
+    time_limit_seconds: float = DEFAULT_TIME_LIMIT_SECONDS,
+    candidate_driver_count: int = DEFAULT_CANDIDATE_DRIVER_COUNT,
+) -> tuple[list[list[int]], list[int]]:
+    """Assign passengers to drivers minimising total fleet travel time.
+
+    Each route runs driver -> pickups -> ``destination`` (if given). Routes are
+    built by parallel cheapest insertion restricted to each passenger's
+    ``candidate_driver_count`` nearest drivers (all drivers as a fallback),
+    then improved by inter-route relocate and swap moves until no move
+    helps or ``time_limit_seconds`` runs out.
+
+    Returns, per driver, the passenger positions (indexes into
+    ``passenger_nodes``) in pickup order, and the unassigned positions.
+    """
+    deadline = time.perf_counter() + max(time_limit_seconds, 0.0)
+    routes = _Routes(travel_times, driver_nodes, capacities, destination)
+    candidates = _candidate_routes(
+        routes.travel_time, driver_nodes, passenger_nodes, max(candidate_driver_count, 1)
+    )
+    all_routes = list(range(len(driver_nodes)))
+    passenger_of_node = {node: index for index, node in enumerate(passenger_nodes)}
+    assigned_route: list[int | None] = [None] * len(passenger_nodes)
+    watchers: list[list[int]] = [[] for _ in driver_nodes]
+    for passenger, routes_for_passenger in enumerate(candidates):
+        for route in routes_for_passenger:
+            watchers[route].append(passenger)
+
+    def best_for(passenger: int, pool: list[int]) -> tuple[float, int, int] | None:
+        best: tuple[float, int, int] | None = None
+        for route in pool:
+            if not routes.fits(route, demands[passenger]):
+                continue
+            delta, position = routes.best_insertion(route, passenger_nodes[passenger])
+            if best is None or delta < best[0]:
+                best = (delta, route, position)
+        return best
+
+    # Heap entries are (delta, passenger, passenger version, route, route
+    # version, position); an entry is stale once either version moved on.
+    passenger_version = [0] * len(passenger_nodes)
+    route_version = [0] * len(driver_nodes)
+    heap: list[tuple[float, int, int, int, int, int]] = []
+
+    def push(passenger: int) -> None:
+        passenger_version[passenger] += 1
+        option = best_for(passenger, candidates[passenger])
+        if option is None:
+            option = best_for(passenger, all_routes)
+        if option is not None:
+            delta, route, position = option
+            heapq.heappush(
+                heap,
+                (
+                    delta,
+                    passenger,
+                    passenger_version[passenger],
+                    route,
+                    route_version[route],
+                    position,
+                ),
+            )
+
+    for passenger in range(len(passenger_nodes)):
+        push(passenger)
+
+    while heap:
+        _, passenger, entry_version, route, entry_route_version, position = (
+            heapq.heappop(heap)
+        )
+        if (
+            assigned_route[passenger] is not None
+            or entry_version != passenger_version[passenger]
+        ):
+            continue
+        if entry_route_version != route_version[route]:
+            push(passenger)
+            continue
+
+        routes.insert(route, position, passenger_nodes[passenger], demands[passenger])
+        assigned_route[passenger] = route
+        route_version[route] += 1
+        for watcher in watchers[route]:
+            if assigned_route[watcher] is None:
+                push(watcher)
+
+    _make_room(routes, candidates, demands, passenger_nodes, assigned_route)
+    _improve(routes, candidates, demands, passenger_of_node, deadline)
+
+    ordered = [
+        [passenger_of_node[node] for node in sequence] for sequence in routes.sequences
+    ]
+    unassigned = [
+        passenger for passenger, route in enumerate(assigned_route) if route is None
+    ]
+    return ordered, unassigned
+
+
+def _make_room(
+    routes: _Routes,
+    candidates: list[list[int]],
+    demands: list[int],
+    passenger_nodes: list[int],
+    assigned_route: list[int | None],
+) -> None:
+    """Seat leftover passengers by moving one rider out of a nearby route.
+
+    Insertion fills routes in cost order, which can strand riders who need
+    more seats than any route has left. For each such passenger, look for a
+    candidate route where relocating one assigned rider elsewhere frees
+    enough seats, and apply the cheapest such pair of moves.
+    """
+    passenger_of_node = {node: index for index, node in enumerate(passenger_nodes)}
+    all_routes = list(range(len(routes.sequences)))
+    for passenger, assigned in enumerate(assigned_route):
+        if assigned is not None:
+            continue
+        node = passenger_nodes[passenger]
+        demand = demands[passenger]
+        best: tuple[float, int, int, int, int] | None = None
+        for route in candidates[passenger]:
+            for position, moved_node in enumerate(routes.sequences[route]):
+                moved = passenger_of_node[moved_node]
+                if (
+                    routes.load[route] - demands[moved] + demand
+                    > routes.capacities[route]
+                ):
+                    continue
+                removal = routes.removal_delta(route, position)
+                for target in candidates[moved] or all_routes:
+                    if target == route or not routes.fits(target, demands[moved]):
+                        continue
+                    insertion, _ = routes.best_insertion(target, moved_node)
+                    if best is None or removal + insertion < best[0]:
+                        best = (removal + insertion, route, position, moved, target)
+        if best is None:
+            continue
+
+        _, route, position, moved, target = best
+        moved_node = routes.remove(route, position, demands[moved])
+        _, insert_at = routes.best_insertion(target, moved_node)
+        routes.insert(target, insert_at, moved_node, demands[moved])
+        assigned_route[moved] = target
+        _, insert_at = routes.best_insertion(route, node)
+        routes.insert(route, insert_at, node, demand)
+        assigned_route[passenger] = route
+
+
+def _improve(
+    routes: _Routes,
+    candidates: list[list[int]],
+    demands: list[int],
+    passenger_of_node: dict[int, int],
+    deadline: float,
+) -> None:
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for source in range(len(routes.sequences)):
+            position = 0
+            while position < len(routes.sequences[source]):
+                if time.perf_counter() >= deadline:
+                    return
+                node = routes.sequences[source][position]
+                passenger = passenger_of_node[node]
+                if _try_relocate(
+                    routes, candidates, demands, source, position, passenger
+                ):
+                    improved = True
+                    continue
+                if _try_swap(
+                    routes,
+                    candidates,
+                    demands,
+                    passenger_of_node,
+                    source,
+                    position,
+                    passenger,
+                ):
+                    improved = True
+                position += 1
+
+
+def _try_relocate(
+    routes: _Routes,
+    candidates: list[list[int]],
+    demands: list[int],
+    source: int,
+    position: int,
+    passenger: int,
+) -> bool:
+    node = routes.sequences[source][position]
+    demand = demands[passenger]
+    removal = routes.removal_delta(source, position)
+    for target in candidates[passenger]:
+        if target == source or not routes.fits(target, demand):
+            continue
+        insertion, insert_at = routes.best_insertion(target, node)
+        if removal + insertion < -1e-9:
+            routes.remove(source, position, demand)
+            routes.insert(target, insert_at, node, demand)
+            return True
+    return False
+
+
+def _try_swap(
+    routes: _Routes,
+    candidates: list[list[int]],
+    demands: list[int],
+    passenger_of_node: dict[int, int],
+    source: int,
+    position: int,
+    passenger: int,
+) -> bool:
+    node = routes.sequences[source][position]
+    demand = demands[passenger]
+    for target in candidates[passenger]:
+        if target == source:
+            continue
+        for other_position, other_node in enumerate(routes.sequences[target]):
+            other = passenger_of_node[other_node]
+            other_demand = demands[other]
+            if (
+                routes.load[source] - demand + other_demand > routes.capacities[source]
+                or routes.load[target] - other_demand + demand
+                > routes.capacities[target]
+            ):
+                continue
+
+            before = _sequence_cost(routes, source) + _sequence_cost(routes, target)
+            routes.sequences[source][position] = other_node
+            routes.sequences[target][other_position] = node
+            after = _sequence_cost(routes, source) + _sequence_cost(routes, target)
+            if after < before - 1e-9:
+                routes.load[source] += other_demand - demand
+                routes.load[target] += demand - other_demand
+                return True
+            routes.sequences[source][position] = node
+            routes.sequences[target][other_position] = other_node
+    return False
+
+
+def _sequence_cost(routes: _Routes, route: int) -> float:
+    travel_time = routes.travel_time
+    previous = routes.driver_nodes[route]
+    total = 0.0
+    for node in routes.sequences[route]:
+        total += travel_time(previous, node)
+        previous = node
+    if routes.destination is not None:
+        total += travel_time(previous, routes.destination)
+    return total
@@ -1,13 +1,274 @@
+import asyncio
+import itertools
+import json
+import math
+import pickle
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlsplit
 
+import numpy as np
 import pytest
 import requests
 
-from assignment import assign_passengers_to_drivers
-from models import Driver, Location, Passenger
+from assignment import assign_passengers_to_drivers, route_metrics
+from models import Driver, Location, LocationTable, Passenger
+from partition import assign_passengers_partitioned, partition_batch
+from providers.base import METRICS_DTYPE, DistanceProvider
+from providers.calibrated import CalibratedProvider
+from providers.cache import (
+    APPROX_ENTRY_BYTES,
+    LRUMetricsCache,
+    SQLiteMetricsCache,
+    dataset_version_from_file,
+)
 from providers.haversine import HaversineProvider
+from providers.instrumentation import InstrumentedProvider, ProviderMetrics
+from providers.condensed import CondensedMatrix, condensed_index
 from providers.osrm import OSRMProvider
-from tsp import nearest_neighbor_tsp
+from providers.osrm_async import AsyncOSRMProvider
+from providers.tiered import TieredProvider
+from session import AssignmentSession
+from spatial import SpatialIndex
+from tracing import RecordingTracer
+from tsp import (
+    held_karp_order,
+    local_search_tsp,
+    nearest_neighbor_order,
+    nearest_neighbor_table_tsp,
+    nearest_neighbor_tsp,
+    solve_open_tsp,
+    solve_pickup_order,
+)
+from vrp import solve_capacitated_vrp
+
+
+def _stub_metrics(origin: list[float], destination: list[float]) -> tuple[float, float]:
+    distance_meters = (
+        abs(origin[0] - destination[0]) + abs(origin[1] - destination[1])
+    ) * 100000
+    return distance_meters, distance_meters / 10
+
+
+class _StubOSRMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubOSRMServer"
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.paths.append(self.path)
+            server.clients.add(self.client_address)
+            failing = server.failures_remaining > 0
+            if failing:
+                server.failures_remaining -= 1
+
+        try:
+            time.sleep(server.delay_seconds)
+            status, payload = (500, {}) if failing else self._respond()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond(self) -> tuple[int, dict]:
+        if self.server.client_error_status is not None:
+            return self.server.client_error_status, {
+                "code": "InvalidQuery",
+                "message": "Query string malformed",
+            }
+
+        parsed = urlsplit(self.path)
+        service, _, _, coords = parsed.path.strip("/").split("/", 3)
+        points = [
+            [float(value) for value in pair.split(",")] for pair in coords.split(";")
+        ]
+
+        blocked = {
+            index
+            for index, point in enumerate(points)
+            if tuple(point) in self.server.unroutable
+        }
+        if self.server.no_route or (blocked and service == "route"):
+            if service == "route":
+                return self.server.no_route_status, {"code": "NoRoute", "routes": []}
+            query = parse_qs(parsed.query)
+            shape = (
+                len(query["sources"][0].split(",")),
+                len(query["destinations"][0].split(",")),
+            )
+            nulls = [[None] * shape[1] for _ in range(shape[0])]
+            return 200, {"code": "Ok", "distances": nulls, "durations": nulls}
+
+        if service == "trip":
+            # Brute force with both ends fixed, like osrm-routed on few stops.
+            middle = min(
+                itertools.permutations(range(1, len(points) - 1)),
+                key=lambda order: sum(
+                    _stub_metrics(points[a], points[b])[1]
+                    for a, b in zip((0, *order), (*order, len(points) - 1))
+                ),
+            )
+            visits = [0, *middle, len(points) - 1]
+            legs = [
+                _stub_metrics(points[a], points[b]) for a, b in zip(visits, visits[1:])
+            ]
+            return 200, {
+                "code": "Ok",
+                "waypoints": [
+                    {"waypoint_index": visits.index(index), "trips_index": 0}
+                    for index in range(len(points))
+                ],
+                "trips": [
+                    {
+                        "legs": [
+                            {"distance": distance, "duration": duration}
+                            for distance, duration in legs
+                        ]
+                    }
+                ],
+            }
+
+        if service == "route":
+            legs = [
+                _stub_metrics(origin, destination)
+                for origin, destination in zip(points, points[1:])
+            ]
+            if self.server.null_leg is not None:
+                legs[self.server.null_leg] = (None, None)
+            return 200, {
+                "code": "Ok",
+                "routes": [
+                    {
+                        "distance": sum(leg[0] or 0 for leg in legs),
+                        "duration": sum(leg[1] or 0 for leg in legs),
+                        "legs": [
+                            {"distance": distance, "duration": duration}
+                            for distance, duration in legs
+                        ],
+                    }
+                ],
+            }
+
+        query = parse_qs(parsed.query)
+        sources = [int(index) for index in query["sources"][0].split(",")]
+        destinations = [int(index) for index in query["destinations"][0].split(",")]
+        cells = [
+            [
+                (None, None)
+                if {source, target} & blocked
+                else _stub_metrics(points[source], points[target])
+                for target in destinations
+            ]
+            for source in sources
+        ]
+        return 200, {
+            "code": "Ok",
+            "distances": [[cell[0] for cell in row] for row in cells],
+            "durations": [[cell[1] for cell in row] for row in cells],
+        }
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class StubOSRMServer(ThreadingHTTPServer):
+    """Local OSRM stand-in answering /route and /table from coordinate deltas."""
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _StubOSRMHandler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.paths: list[str] = []
+        self.clients: set[tuple[str, int]] = set()
+        self.failures_remaining = 0
+        self.delay_seconds = 0.0
+        self.no_route = False
+        # osrm-routed answers NoRoute with 400; older stubs used 200.
+        self.no_route_status = 200
+        self.null_leg: int | None = None
+        # (longitude, latitude) points with no road: /table cells to or from
+        # them are null and /route through them is NoRoute.
+        self.unroutable: set[tuple[float, float]] = set()
+        # Status for answering every request with a non-NoRoute client error.
+        self.client_error_status: int | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def stub_osrm() -> Iterator[StubOSRMServer]:
+    server = StubOSRMServer()
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class TestLocationTable:
+    """Test the array-backed location table."""
+
+    def test_from_locations_round_trips(self) -> None:
+        locations = [Location(0.0, 1.0), Location(-37.8, 144.9)]
+        table = LocationTable.from_locations(locations)
+
+        assert len(table) == 2
+        assert table.latitudes.dtype == np.float64
+        assert table.location(1) == Location(-37.8, 144.9)
+        assert table.coordinates() == [(0.0, 1.0), (-37.8, 144.9)]
+        assert [ref.index for ref in table] == [0, 1]
+
+    def test_handles_expose_coordinates(self) -> None:
+        table = LocationTable([1.5, 2.5], [3.5, 4.5])
+        handle = table[-1]
+
+        assert handle.index == 1
+        assert handle.latitude == 2.5
+        assert handle.longitude == 4.5
+        assert handle.to_location() == Location(2.5, 4.5)
+        with pytest.raises(AttributeError):
+            handle.extra = 1  # type: ignore[attr-defined]
+
+    def test_take_keeps_ids(self) -> None:
+        table = LocationTable([0.0, 1.0, 2.0], [0.0, 1.0, 2.0], ids=[10, 11, 12])
+        subset = table.take([2, 0])
+
+        assert subset.ids.tolist() == [12, 10]
+        assert subset.latitudes.tolist() == [2.0, 0.0]
+
+    def test_mismatched_lengths_raise(self) -> None:
+        with pytest.raises(ValueError):
+            LocationTable([0.0, 1.0], [0.0])
+
+    def test_empty_table(self) -> None:
+        table = LocationTable.from_locations([])
+
+        assert len(table) == 0
+        assert HaversineProvider().matrix_distances_km(table, table) == []
 
 
 class TestHaversineProvider:
@@ -88,6 +349,44 @@ class TestHaversineProvider:
         assert all(isinstance(t, float) for row in matrix for t in row)
         assert all(t >= 0.0 for row in matrix for t in row)
 
+    def test_matrix_distances_array_matches_scalar_distance(self) -> None:
+        origins = [Location(51.5074, -0.1278), Location(-37.8136, 144.9631)]
+        destinations = [
+            Location(48.8566, 2.3522),
+            Location(40.7128, -74.0060),
+            Location(51.5074, -0.1278),
+        ]
+
+        provider = HaversineProvider()
+        matrix = provider.matrix_distances_km_array(origins, destinations)
+
+        assert isinstance(matrix, np.ndarray)
+        assert matrix.shape == (2, 3)
+        assert matrix.dtype == np.float64
+        for row, origin in enumerate(origins):
+            for column, destination in enumerate(destinations):
+                assert matrix[row, column] == pytest.approx(
+                    provider.distance_km(origin, destination), abs=1e-9
+                )
+
+    def test_matrix_travel_times_array_uses_average_speed(self) -> None:
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(0.0, 1.0)]
+
+        provider = HaversineProvider(average_speed_kmph=60.0)
+        distances = provider.matrix_distances_km_array(origins, destinations)
+        travel_times = provider.matrix_travel_times_minutes_array(origins, destinations)
+
+        assert travel_times[0, 0] == pytest.approx(distances[0, 0])
+
+    def test_matrix_travel_times_array_zero_speed_is_zero(self) -> None:
+        provider = HaversineProvider(average_speed_kmph=0.0)
+        travel_times = provider.matrix_travel_times_minutes_array(
+            [Location(0.0, 0.0)], [Location(1.0, 1.0)]
+        )
+
+        assert travel_times.tolist() == [[0.0]]
+
 
 class TestOSRMProvider:
     """Test OSRM distance provider with mocked responses."""
@@ -179,10 +478,13 @@ class TestOSRMProvider:
             Location(0.0, 0.0), Location(90.0, 180.0)
         )
 
-        assert distance == 0.0
+        # Never 0.0, which would rank an unroutable pair as the nearest.
+        assert distance == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.0), Location(90.0, 180.0))
+        )
 
     @patch("providers.osrm.requests.get")
-    def test_distance_connection_error_returns_zero(self, mock_get: MagicMock) -> None:
+    def test_distance_connection_error_falls_back_to_haversine(self, mock_get: MagicMock) -> None:
         mock_get.side_effect = requests.ConnectionError("Connection refused")
 
         provider = OSRMProvider()
@@ -190,10 +492,12 @@ class TestOSRMProvider:
             Location(0.0, 0.0), Location(1.0, 1.0)
         )
 
-        assert distance == 0.0
+        assert distance == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        )
 
     @patch("providers.osrm.requests.get")
-    def test_distance_timeout_returns_zero(self, mock_get: MagicMock) -> None:
+    def test_distance_timeout_falls_back_to_haversine(self, mock_get: MagicMock) -> None:
         mock_get.side_effect = requests.Timeout("Request timed out")
 
         provider = OSRMProvider()
@@ -201,10 +505,12 @@ class TestOSRMProvider:
             Location(0.0, 0.0), Location(1.0, 1.0)
         )
 
-        assert distance == 0.0
+        assert distance == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        )
 
     @patch("providers.osrm.requests.get")
-    def test_distance_http_error_returns_zero(self, mock_get: MagicMock) -> None:
+    def test_distance_http_error_falls_back_to_haversine(self, mock_get: MagicMock) -> None:
         mock_get.return_value.raise_for_status.side_effect = requests.HTTPError("500")
 
         provider = OSRMProvider()
@@ -212,10 +518,12 @@ class TestOSRMProvider:
             Location(0.0, 0.0), Location(1.0, 1.0)
         )
 
-        assert distance == 0.0
+        assert distance == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        )
 
     @patch("providers.osrm.requests.get")
-    def test_distance_malformed_json_returns_zero(self, mock_get: MagicMock) -> None:
+    def test_distance_malformed_json_falls_back_to_haversine(self, mock_get: MagicMock) -> None:
         mock_get.return_value.json.side_effect = ValueError("Invalid JSON")
 
         provider = OSRMProvider()
@@ -223,7 +531,9 @@ class TestOSRMProvider:
             Location(0.0, 0.0), Location(1.0, 1.0)
         )
 
-        assert distance == 0.0
+        assert distance == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        )
 
     @patch("providers.osrm.time.sleep")
     @patch("providers.osrm.time.monotonic")
@@ -310,7 +620,9 @@ class TestOSRMProvider:
         assert travel_time == 0.0
 
     @patch("providers.osrm.requests.get")
-    def test_matrix_malformed_shape_falls_back_to_zero(self, mock_get: MagicMock) -> None:
+    def test_matrix_malformed_shape_falls_back_to_haversine(
+        self, mock_get: MagicMock
+    ) -> None:
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.raise_for_status.return_value = None
@@ -328,8 +640,13 @@ class TestOSRMProvider:
         distances = provider.matrix_distances_km(origins, destinations)
         durations = provider.matrix_travel_times_minutes(origins, destinations)
 
-        assert distances == [[1.0, 0.0]]
-        assert durations == [[1.0, 0.0]]
+        haversine = HaversineProvider()
+        assert distances[0] == pytest.approx(
+            [1.0, haversine.distance_km(origins[0], destinations[1])]
+        )
+        assert durations[0] == pytest.approx(
+            [1.0, haversine.travel_time_minutes(origins[0], destinations[1])]
+        )
 
     @patch("providers.osrm.requests.get")
     def test_matrix_distances_connection_error(self, mock_get: MagicMock) -> None:
@@ -340,7 +657,9 @@ class TestOSRMProvider:
         destinations = [Location(1.0, 1.0)]
         matrix = provider.matrix_distances_km(origins, destinations)
 
-        assert matrix == [[0.0]]
+        assert matrix[0] == pytest.approx(
+            [HaversineProvider().distance_km(origins[0], destinations[0])]
+        )
 
     @patch("providers.osrm.requests.get")
     def test_matrix_distances_uses_cache_for_repeated_call(
@@ -462,6 +781,26 @@ class TestOSRMProvider:
         assert matrix == [[]]
         assert not mock_get.called
 
+    @patch("providers.osrm.requests.get")
+    def test_matrix_accepts_location_table(self, mock_get: MagicMock) -> None:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "distances": [[0, 1000], [2000, 0]],
+            "durations": [[0, 60], [120, 0]],
+        }
+        mock_get.return_value = mock_response
+
+        provider = OSRMProvider()
+        table = LocationTable([0.0, 1.0], [0.0, 1.0])
+        matrix = provider.matrix_travel_times_minutes(table, table)
+
+        assert matrix == [[0.0, 1.0], [2.0, 0.0]]
+        assert provider.travel_time_minutes(table[1], Location(0.0, 0.0)) == 2.0
+        assert mock_get.call_count == 1
+
     def test_osrm_custom_base_url(self) -> None:
         provider = OSRMProvider(base_url="http://custom-osrm:5000")
         assert provider.base_url == "http://custom-osrm:5000"
@@ -471,6 +810,482 @@ class TestOSRMProvider:
         assert provider.timeout == 30.0
 
 
+class TestLRUMetricsCache:
+    """Test the bounded in-memory metrics cache."""
+
+    def test_evicts_least_recently_used_entry(self) -> None:
+        cache = LRUMetricsCache(max_entries=2)
+        cache.set((0.0, 0.0, 0.0, 1.0), (1.0, 1.0))
+        cache.set((0.0, 0.0, 0.0, 2.0), (2.0, 2.0))
+        cache.get((0.0, 0.0, 0.0, 1.0))
+        cache.set((0.0, 0.0, 0.0, 3.0), (3.0, 3.0))
+
+        assert (0.0, 0.0, 0.0, 1.0) in cache
+        assert (0.0, 0.0, 0.0, 2.0) not in cache
+        assert len(cache) == 2
+
+    def test_stats_count_hits_misses_and_evictions(self) -> None:
+        cache = LRUMetricsCache(max_entries=1)
+        cache.set((0.0, 0.0, 0.0, 1.0), (1.0, 1.0))
+        cache.get((0.0, 0.0, 0.0, 1.0))
+        cache.get((0.0, 0.0, 0.0, 2.0))
+        cache.set((0.0, 0.0, 0.0, 2.0), (2.0, 2.0))
+
+        assert cache.stats() == {
+            "hits": 1,
+            "misses": 1,
+            "evictions": 1,
+            "size": 1,
+            "max_entries": 1,
+        }
+
+    def test_max_bytes_limits_entries(self) -> None:
+        cache = LRUMetricsCache(max_entries=100, max_bytes=APPROX_ENTRY_BYTES * 3)
+
+        assert cache.max_entries == 3
+
+    def test_unbounded_and_disabled(self) -> None:
+        assert LRUMetricsCache().max_entries is None
+
+        disabled = LRUMetricsCache(max_entries=0)
+        disabled.set((0.0, 0.0, 0.0, 1.0), (1.0, 1.0))
+        assert len(disabled) == 0
+
+    @patch("providers.osrm.requests.get")
+    def test_osrm_matrix_larger_than_cache_keeps_all_cells(
+        self, mock_get: MagicMock
+    ) -> None:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "distances": [[1000, 2000, 3000]],
+            "durations": [[60, 120, 180]],
+        }
+        mock_get.return_value = mock_response
+
+        provider = OSRMProvider(cache_max_entries=2)
+        matrix = provider.matrix_travel_times_minutes(
+            [Location(0.0, 0.0)],
+            [Location(1.0, 1.0), Location(2.0, 2.0), Location(3.0, 3.0)],
+        )
+
+        assert matrix == [[1.0, 2.0, 3.0]]
+        assert provider.cache_stats()["size"] == 2
+        assert provider.cache_stats()["evictions"] == 1
+
+    @patch("providers.osrm.requests.get")
+    def test_osrm_distance_and_time_share_one_entry(self, mock_get: MagicMock) -> None:
+        mock_response = MagicMock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "routes": [{"distance": 1000, "duration": 60}],
+        }
+        mock_get.return_value = mock_response
+
+        provider = OSRMProvider()
+        provider.distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        provider.travel_time_minutes(Location(0.0, 0.0), Location(1.0, 1.0))
+
+        stats = provider.cache_stats()
+        assert stats["size"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+
+class TestSQLiteMetricsCache:
+    """Test the persistent SQLite metrics cache."""
+
+    def test_round_trip_uses_rounded_coordinates(self, tmp_path: Path) -> None:
+        cache = SQLiteMetricsCache(tmp_path / "osrm.sqlite", dataset_version="v1")
+        cache.set("driving", (1.0, 2.0, 3.0, 4.0), (5.0, 6.0))
+
+        assert cache.get("driving", (1.000001, 2.0, 3.0, 4.0)) == (5.0, 6.0)
+        assert cache.get("driving", (1.1, 2.0, 3.0, 4.0)) is None
+        assert cache.get("cycling", (1.0, 2.0, 3.0, 4.0)) is None
+
+    def test_entries_are_shared_between_instances(self, tmp_path: Path) -> None:
+        path = tmp_path / "osrm.sqlite"
+        writer = SQLiteMetricsCache(path, dataset_version="v1")
+        reader = SQLiteMetricsCache(path, dataset_version="v1")
+
+        writer.set_many("driving", {(0.0, 0.0, 1.0, 1.0): (10.0, 20.0)})
+
+        assert reader.get_many("driving", [(0.0, 0.0, 1.0, 1.0)]) == {
+            (0.0, 0.0, 1.0, 1.0): (10.0, 20.0)
+        }
+
+    def test_items_lists_fresh_entries_of_one_profile(self, tmp_path: Path) -> None:
+        path = tmp_path / "osrm.sqlite"
+        SQLiteMetricsCache(path, dataset_version="old").set(
+            "driving", (0.0, 0.0, 1.0, 1.0), (1.0, 1.0)
+        )
+        cache = SQLiteMetricsCache(path, dataset_version="new")
+        cache.set("driving", (0.5, 0.5, 1.0, 1.0), (2.0, 3.0))
+        cache.set("cycling", (0.5, 0.5, 1.0, 1.0), (4.0, 5.0))
+
+        assert list(cache.items("driving")) == [((0.5, 0.5, 1.0, 1.0), (2.0, 3.0))]
+
+    def test_other_dataset_version_is_ignored_and_purged(self, tmp_path: Path) -> None:
+        path = tmp_path / "osrm.sqlite"
+        SQLiteMetricsCache(path, dataset_version="old").set(
+            "driving", (0.0, 0.0, 1.0, 1.0), (1.0, 1.0)
+        )
+        cache = SQLiteMetricsCache(path, dataset_version="new")
+
+        assert cache.get("driving", (0.0, 0.0, 1.0, 1.0)) is None
+        assert cache.purge() == 1
+        assert len(cache) == 0
+
+    @patch("providers.cache.time.time")
+    def test_expired_entries_are_ignored(
+        self, mock_time: MagicMock, tmp_path: Path
+    ) -> None:
+        cache = SQLiteMetricsCache(tmp_path / "osrm.sqlite", ttl_seconds=60.0)
+        mock_time.return_value = 1000.0
+        cache.set("driving", (0.0, 0.0, 1.0, 1.0), (1.0, 1.0))
+
+        mock_time.return_value = 1030.0
+        assert cache.get("driving", (0.0, 0.0, 1.0, 1.0)) == (1.0, 1.0)
+
+        mock_time.return_value = 1061.0
+        assert cache.get("driving", (0.0, 0.0, 1.0, 1.0)) is None
+
+    def test_invalidate_drops_everything(self, tmp_path: Path) -> None:
+        cache = SQLiteMetricsCache(tmp_path / "osrm.sqlite")
+        cache.set("driving", (0.0, 0.0, 1.0, 1.0), (1.0, 1.0))
+        cache.invalidate()
+
+        assert len(cache) == 0
+
+    def test_dataset_version_from_file(self, tmp_path: Path) -> None:
+        stamp = tmp_path / "map.osrm.version"
+        stamp.write_text("1712345678\n", encoding="utf-8")
+
+        assert dataset_version_from_file(stamp) == "1712345678"
+        assert dataset_version_from_file(tmp_path / "missing") == ""
+
+    @patch("providers.osrm.requests.get")
+    def test_osrm_provider_persists_and_reuses_metrics(
+        self, mock_get: MagicMock, tmp_path: Path
+    ) -> None:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "distances": [[1000, 2000]],
+            "durations": [[60, 120]],
+        }
+        mock_get.return_value = mock_response
+
+        path = tmp_path / "osrm.sqlite"
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(1.0, 1.0), Location(2.0, 2.0)]
+        warm = OSRMProvider(persistent_cache=SQLiteMetricsCache(path))
+        warm.matrix_travel_times_minutes(origins, destinations)
+
+        cold = OSRMProvider(persistent_cache=SQLiteMetricsCache(path))
+        matrix = cold.matrix_distances_km(origins, destinations)
+        travel_time = cold.travel_time_minutes(Location(0.0, 0.0), Location(2.0, 2.0))
+
+        assert matrix == [[1.0, 2.0]]
+        assert travel_time == 2.0
+        assert mock_get.call_count == 1
+
+    @patch("providers.osrm.requests.get")
+    def test_osrm_provider_does_not_persist_unroutable_cells(
+        self, mock_get: MagicMock, tmp_path: Path
+    ) -> None:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "distances": [[1000, None]],
+            "durations": [[60, None]],
+        }
+        mock_get.return_value = mock_response
+
+        cache = SQLiteMetricsCache(tmp_path / "osrm.sqlite")
+        provider = OSRMProvider(persistent_cache=cache)
+        provider.matrix_distances_km(
+            [Location(0.0, 0.0)], [Location(1.0, 1.0), Location(2.0, 2.0)]
+        )
+
+        assert len(cache) == 1
+
+
+class TestAsyncOSRMProvider:
+    """Test the async OSRM provider against a local stub server."""
+
+    def test_async_matrix_matches_stub(self, stub_osrm: StubOSRMServer) -> None:
+        provider = AsyncOSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(0.01, 0.0), Location(0.0, 0.02)]
+
+        distances = asyncio.run(
+            provider.matrix_distances_km_async(origins, destinations)
+        )
+        travel_times = asyncio.run(
+            provider.matrix_travel_times_minutes_async(origins, destinations)
+        )
+
+        assert distances[0] == pytest.approx([1.0, 2.0])
+        assert travel_times[0] == pytest.approx([100 / 60, 200 / 60])
+        assert len(stub_osrm.paths) == 1
+        provider.close()
+
+    def test_concurrent_requests_respect_in_flight_limit(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.delay_seconds = 0.05
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url, max_in_flight=3, requests_per_second=0.0
+        )
+        origin = Location(0.0, 0.0)
+        pairs = [(origin, Location(0.01 * index, 0.0)) for index in range(1, 10)]
+
+        metrics = asyncio.run(provider.route_metrics_many_async(pairs))
+
+        assert [distance for distance, _ in metrics] == pytest.approx(
+            [float(index) for index in range(1, 10)]
+        )
+        assert 2 <= stub_osrm.max_active <= 3
+        assert len(stub_osrm.clients) <= 3
+        provider.close()
+
+    def test_duplicate_pairs_share_one_request(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.delay_seconds = 0.05
+        provider = AsyncOSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        origin = Location(0.0, 0.0)
+        pairs = [(origin, Location(0.01 * (index % 3 + 1), 0.0)) for index in range(9)]
+
+        async def overlapping() -> list[list[tuple[float, float]]]:
+            return list(
+                await asyncio.gather(
+                    provider.route_metrics_many_async(pairs),
+                    provider.route_metrics_many_async(pairs[:3]),
+                    provider.distance_km_async(origin, Location(0.01, 0.0)),
+                )
+            )
+
+        many, few, single = asyncio.run(overlapping())
+
+        assert [distance for distance, _ in many] == pytest.approx(
+            [1.0, 2.0, 3.0] * 3
+        )
+        assert [distance for distance, _ in few] == pytest.approx([1.0, 2.0, 3.0])
+        assert single == pytest.approx(1.0)
+        assert len(stub_osrm.paths) == 3
+        provider.close()
+
+    def test_client_errors_count_as_circuit_failures(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.client_error_status = 404
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url,
+            requests_per_second=0.0,
+            circuit_breaker_threshold=2,
+            circuit_breaker_reset_seconds=60.0,
+        )
+        pairs = [
+            (Location(0.0, 0.0), Location(0.0, 0.01 * index)) for index in range(1, 4)
+        ]
+
+        async def one_at_a_time() -> None:
+            for pair in pairs:
+                await provider.route_metrics_many_async([pair])
+
+        asyncio.run(one_at_a_time())
+
+        assert len(stub_osrm.paths) == 2
+        assert provider._consecutive_failures == 2
+        provider.close()
+
+    def test_concurrent_table_requests(self, stub_osrm: StubOSRMServer) -> None:
+        stub_osrm.delay_seconds = 0.05
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url, max_in_flight=4, requests_per_second=0.0
+        )
+
+        async def fetch_all() -> list[list[list[float]]]:
+            return list(
+                await asyncio.gather(
+                    *(
+                        provider.matrix_distances_km_async(
+                            [Location(float(index), 0.0)], [Location(0.0, 0.0)]
+                        )
+                        for index in range(4)
+                    )
+                )
+            )
+
+        matrices = asyncio.run(fetch_all())
+
+        assert [matrix[0][0] for matrix in matrices] == pytest.approx(
+            [0.0, 100.0, 200.0, 300.0]
+        )
+        assert stub_osrm.max_active >= 2
+        provider.close()
+
+    def test_sync_and_async_requests_share_rate_limit(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = AsyncOSRMProvider(stub_osrm.base_url, requests_per_second=20.0)
+        origin = Location(0.0, 0.0)
+
+        async def fetch_both() -> None:
+            sync_calls = asyncio.to_thread(
+                lambda: [
+                    provider.distance_km(origin, Location(0.0, 0.01 * index))
+                    for index in range(1, 4)
+                ]
+            )
+            await asyncio.gather(
+                sync_calls,
+                *(
+                    provider.distance_km_async(origin, Location(0.01 * index, 0.0))
+                    for index in range(1, 4)
+                ),
+            )
+
+        started = time.monotonic()
+        asyncio.run(fetch_both())
+
+        assert len(stub_osrm.paths) == 6
+        assert time.monotonic() - started >= 5 * 0.05 - 0.01
+        provider.close()
+
+    def test_retries_server_errors(self, stub_osrm: StubOSRMServer) -> None:
+        stub_osrm.failures_remaining = 1
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_retries=1,
+            retry_backoff_seconds=0.0,
+        )
+
+        distance = asyncio.run(
+            provider.distance_km_async(Location(0.0, 0.0), Location(0.05, 0.0))
+        )
+
+        assert distance == pytest.approx(5.0)
+        assert len(stub_osrm.paths) == 2
+        provider.close()
+
+    def test_gives_up_after_max_retries(self, stub_osrm: StubOSRMServer) -> None:
+        stub_osrm.failures_remaining = 5
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_retries=2,
+            retry_backoff_seconds=0.0,
+        )
+
+        travel_time = asyncio.run(
+            provider.travel_time_minutes_async(Location(0.0, 0.0), Location(0.05, 0.0))
+        )
+
+        assert travel_time == pytest.approx(
+            HaversineProvider().travel_time_minutes(
+                Location(0.0, 0.0), Location(0.05, 0.0)
+            )
+        )
+        assert len(stub_osrm.paths) == 3
+        provider.close()
+
+    def test_requests_per_second_spaces_request_starts(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url, max_in_flight=4, requests_per_second=20.0
+        )
+        origin = Location(0.0, 0.0)
+        pairs = [(origin, Location(0.01 * index, 0.0)) for index in range(1, 5)]
+
+        started = time.monotonic()
+        asyncio.run(provider.route_metrics_many_async(pairs))
+        elapsed = time.monotonic() - started
+
+        assert elapsed >= 0.15
+        provider.close()
+
+    def test_sync_methods_use_pooled_session(self, stub_osrm: StubOSRMServer) -> None:
+        provider = AsyncOSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+
+        first = provider.distance_km(Location(0.0, 0.0), Location(0.01, 0.0))
+        second = provider.distance_km(Location(0.0, 0.0), Location(0.02, 0.0))
+
+        assert (first, second) == pytest.approx((1.0, 2.0))
+        assert len(stub_osrm.clients) == 1
+        provider.close()
+
+
+class TestOSRMTableChunking:
+    """Test splitting large /table requests into tiles."""
+
+    def test_large_matrix_is_split_into_tiles(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(
+            stub_osrm.base_url, requests_per_second=0.0, max_table_size=25
+        )
+        points = [Location(0.0, 0.001 * index) for index in range(60)]
+
+        matrix = provider.matrix_distances_km(points, points)
+
+        assert len(stub_osrm.paths) == 9
+        assert all(path.startswith("/table/") for path in stub_osrm.paths)
+        assert all(
+            len(parse_qs(urlsplit(path).query)["sources"][0].split(",")) <= 25
+            for path in stub_osrm.paths
+        )
+        assert matrix[0][59] == pytest.approx(5.9)
+        assert matrix[59][0] == pytest.approx(5.9)
+        assert matrix[30][31] == pytest.approx(0.1)
+
+    def test_only_missing_tiles_are_requested(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(
+            stub_osrm.base_url, requests_per_second=0.0, max_table_size=2
+        )
+        origins = [Location(0.0, 0.0), Location(0.0, 0.01)]
+        cached_destinations = [Location(0.01, 0.0), Location(0.02, 0.0)]
+        new_destinations = [Location(0.03, 0.0), Location(0.04, 0.0)]
+
+        provider.matrix_distances_km(origins, cached_destinations)
+        assert len(stub_osrm.paths) == 1
+
+        matrix = provider.matrix_distances_km(
+            origins, [*cached_destinations, *new_destinations]
+        )
+
+        assert len(stub_osrm.paths) == 2
+        assert matrix[0] == pytest.approx([1.0, 2.0, 3.0, 4.0])
+
+    def test_async_tiles_are_fetched_concurrently(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.delay_seconds = 0.05
+        provider = AsyncOSRMProvider(
+            stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_table_size=5,
+            max_in_flight=4,
+        )
+        points = [Location(0.0, 0.001 * index) for index in range(10)]
+
+        matrix = asyncio.run(provider.matrix_travel_times_minutes_async(points, points))
+
+        assert len(stub_osrm.paths) == 4
+        assert stub_osrm.max_active >= 2
+        assert matrix[9][0] == pytest.approx(90 / 60)
+        provider.close()
+
+
 class TestTSPWithProviders:
     """Test TSP solver with different providers."""
 
@@ -491,6 +1306,15 @@ class TestTSPWithProviders:
             Location(0.0, 3.0),
         ]
 
+    def test_nearest_neighbor_table_tsp_returns_table_indexes(self) -> None:
+        table = LocationTable([0.0, 0.0, 0.0, 0.0], [0.0, 2.0, 1.0, 3.0])
+
+        ordered = nearest_neighbor_table_tsp(
+            table, 0, [1, 2, 3], provider=HaversineProvider()
+        )
+
+        assert ordered == [2, 1, 3]
+
     def test_nearest_neighbor_tsp_empty_stops(self) -> None:
         start = Location(0.0, 0.0)
         stops: list[Location] = []
@@ -526,6 +1350,115 @@ class TestTSPWithProviders:
         assert len(ordered) == 2
 
 
+def _path_cost(
+    travel_times: list[list[float]], start: int, order: list[int], end: int | None
+) -> float:
+    sequence = [start, *order, *([end] if end is not None else [])]
+    return sum(travel_times[a][b] for a, b in zip(sequence, sequence[1:]))
+
+
+class TestLocalSearchTSP:
+    """Test the matrix-based 2-opt/Or-opt pickup ordering solver."""
+
+    def test_improves_on_nearest_neighbor(self) -> None:
+        # Nearest neighbor walks right first and must double back for the far
+        # left stop; the improved path visits the left stop first.
+        positions = [0.0, 1.0, 2.0, 3.0, -1.5]
+        travel_times = [[abs(a - b) for b in positions] for a in positions]
+        stops = [1, 2, 3, 4]
+
+        greedy = nearest_neighbor_order(travel_times, 0, stops)
+        improved = solve_open_tsp(travel_times, 0, stops)
+
+        assert greedy == [1, 2, 3, 4]
+        assert improved == [4, 1, 2, 3]
+        assert _path_cost(travel_times, 0, improved, None) < _path_cost(
+            travel_times, 0, greedy, None
+        )
+
+    def test_fixed_end_node_is_respected(self) -> None:
+        positions = [0.0, 2.0, 1.0, 3.0, 10.0]
+        travel_times = [[abs(a - b) for b in positions] for a in positions]
+
+        ordered = solve_open_tsp(travel_times, 0, [1, 2, 3], end=4)
+
+        assert ordered == [2, 1, 3]
+
+    def test_asymmetric_costs_keep_a_valid_permutation(self) -> None:
+        travel_times = np.array(
+            [
+                [0.0, 1.0, 9.0, 9.0, 9.0],
+                [9.0, 0.0, 1.0, 9.0, 9.0],
+                [9.0, 9.0, 0.0, 1.0, 9.0],
+                [9.0, 9.0, 9.0, 0.0, 1.0],
+                [1.0, 9.0, 9.0, 9.0, 0.0],
+            ]
+        )
+
+        ordered = solve_open_tsp(travel_times, 0, [4, 3, 2, 1])
+
+        assert ordered == [1, 2, 3, 4]
+
+    def test_zero_time_budget_returns_construction(self) -> None:
+        positions = [0.0, 1.0, 2.0, 3.0, -1.5]
+        travel_times = [[abs(a - b) for b in positions] for a in positions]
+
+        ordered = solve_open_tsp(travel_times, 0, [1, 2, 3, 4], time_budget_seconds=0.0)
+
+        assert sorted(ordered) == [1, 2, 3, 4]
+
+    def test_local_search_tsp_with_locations(self) -> None:
+        start = Location(0.0, 0.0)
+        stops = [Location(0.0, 1.0), Location(0.0, 2.0), Location(0.0, -1.5)]
+
+        ordered = local_search_tsp(start, stops, provider=HaversineProvider())
+
+        assert ordered == [Location(0.0, -1.5), Location(0.0, 1.0), Location(0.0, 2.0)]
+
+
+class TestExactTSP:
+    """Test the Held-Karp exact solver and automatic solver selection."""
+
+    def test_held_karp_matches_brute_force(self) -> None:
+        rng = random.Random(11)
+        for stop_count in range(1, 7):
+            size = stop_count + 2
+            travel_times = [
+                [rng.uniform(1.0, 10.0) for _ in range(size)] for _ in range(size)
+            ]
+            stops = list(range(1, stop_count + 1))
+            for end in (None, size - 1):
+                ordered = held_karp_order(travel_times, 0, stops, end=end)
+                best = min(
+                    _path_cost(travel_times, 0, list(order), end)
+                    for order in itertools.permutations(stops)
+                )
+
+                assert sorted(ordered) == stops
+                assert _path_cost(travel_times, 0, ordered, end) == pytest.approx(best)
+
+    def test_held_karp_small_inputs(self) -> None:
+        travel_times = [[0.0, 1.0], [1.0, 0.0]]
+
+        assert held_karp_order(travel_times, 0, []) == []
+        assert held_karp_order(travel_times, 0, [1]) == [1]
+
+    @patch("tsp.solve_open_tsp")
+    @patch("tsp.held_karp_order")
+    def test_solver_selected_by_stop_count(
+        self, mock_exact: MagicMock, mock_local: MagicMock
+    ) -> None:
+        travel_times = [[0.0] * 6 for _ in range(6)]
+
+        solve_pickup_order(travel_times, 0, [1, 2, 3], exact_stop_limit=3)
+        solve_pickup_order(travel_times, 0, [1, 2, 3, 4], end=5, exact_stop_limit=3)
+
+        mock_exact.assert_called_once_with(travel_times, 0, [1, 2, 3], end=None)
+        mock_local.assert_called_once_with(
+            travel_times, 0, [1, 2, 3, 4], end=5, time_budget_seconds=None
+        )
+
+
 class TestAssignmentWithProviders:
     """Test passenger assignment with different providers."""
 
@@ -622,3 +1555,1892 @@ class TestAssignmentWithProviders:
 
         assert len(routes) == 1
         assert routes[0].unfilled_seats == 3
+
+    def test_greedy_assignment_passengers_sharing_a_location(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=4)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.1)),
+            Passenger("p2", "P2", Location(0.0, 0.1)),
+            Passenger("p3", "P3", Location(0.0, 0.1), seats_required=2),
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(drivers, passengers)
+
+        assert unassigned == []
+        assert sorted(p.user_id for p in routes[0].pickup_order) == ["p1", "p2", "p3"]
+        assert routes[0].unfilled_seats == 0
+
+    def test_greedy_assignment_skips_passengers_that_do_not_fit(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.1)),
+            Passenger("p2", "P2", Location(0.0, 0.2), seats_required=2),
+            Passenger("p3", "P3", Location(0.0, 0.3)),
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(drivers, passengers)
+
+        assert [p.user_id for p in routes[0].passengers] == ["p1", "p3"]
+        assert [p.user_id for p in unassigned] == ["p2"]
+
+    @patch("providers.osrm.requests.get")
+    def test_assignment_with_osrm_uses_single_table_request(
+        self, mock_get: MagicMock
+    ) -> None:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "code": "Ok",
+            "distances": [
+                [0, 5000, 1000, 9000],
+                [5000, 0, 4000, 4000],
+                [1000, 4000, 0, 8000],
+                [9000, 4000, 8000, 0],
+            ],
+            "durations": [
+                [0, 300, 60, 540],
+                [300, 0, 240, 240],
+                [60, 240, 0, 480],
+                [540, 240, 480, 0],
+            ],
+        }
+        mock_get.return_value = mock_response
+
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.5)),
+            Passenger("p2", "P2", Location(0.0, 0.1)),
+        ]
+        destination = Location(0.0, 0.9)
+
+        provider = OSRMProvider(requests_per_second=0.0)
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, destination=destination, provider=provider
+        )
+
+        assert mock_get.call_count == 1
+        assert "/table/v1/driving/" in mock_get.call_args[0][0]
+        assert [p.user_id for p in routes[0].pickup_order] == ["p2", "p1"]
+        assert routes[0].total_distance_km == pytest.approx(9.0)
+        assert routes[0].total_travel_time_minutes == pytest.approx(9.0)
+        assert unassigned == []
+
+
+class TestVRPAssignment:
+    """Test the fleet-wide (capacitated VRP) assignment engine."""
+
+    def test_vrp_beats_capacity_sorted_greedy(self) -> None:
+        drivers = [
+            Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2),
+            Driver("d2", "Driver B", Location(0.0, 1.0), capacity=1),
+        ]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.05)),
+            Passenger("p2", "P2", Location(0.0, 0.95)),
+        ]
+
+        greedy_routes, _ = assign_passengers_to_drivers(drivers, passengers)
+        vrp_routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, engine="vrp"
+        )
+
+        assert [route.driver.user_id for route in vrp_routes] == ["d1", "d2"]
+        assert [[p.user_id for p in route.passengers] for route in vrp_routes] == [
+            ["p1"],
+            ["p2"],
+        ]
+        assert unassigned == []
+        assert sum(route.total_travel_time_minutes for route in vrp_routes) < sum(
+            route.total_travel_time_minutes for route in greedy_routes
+        )
+
+    def test_vrp_respects_capacity_and_covers_everyone(self) -> None:
+        rng = random.Random(3)
+        drivers = [
+            Driver(
+                f"d{i}",
+                f"Driver {i}",
+                Location(rng.uniform(0.0, 1.0), rng.uniform(0.0, 1.0)),
+                capacity=rng.choice([1, 2, 3]),
+            )
+            for i in range(10)
+        ]
+        passengers = [
+            Passenger(
+                f"p{i}",
+                f"P{i}",
+                Location(rng.uniform(0.0, 1.0), rng.uniform(0.0, 1.0)),
+                seats_required=rng.choice([1, 1, 2]),
+            )
+            for i in range(30)
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, destination=Location(0.5, 0.5), engine="vrp"
+        )
+
+        assert len(routes) == len(drivers)
+        seated = [p.user_id for route in routes for p in route.passengers]
+        assert sorted(seated + [p.user_id for p in unassigned]) == sorted(
+            p.user_id for p in passengers
+        )
+        for route in routes:
+            seats = sum(p.seats_required for p in route.passengers)
+            assert seats <= route.driver.capacity
+            assert route.unfilled_seats == route.driver.capacity - seats
+            assert sorted(p.user_id for p in route.pickup_order) == sorted(
+                p.user_id for p in route.passengers
+            )
+
+    def test_vrp_seats_multi_seat_passenger_by_moving_a_rider(self) -> None:
+        drivers = [
+            Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2),
+            Driver("d2", "Driver B", Location(0.0, 1.0), capacity=1),
+        ]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.1)),
+            Passenger("p2", "P2", Location(0.0, 0.2), seats_required=2),
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, engine="vrp"
+        )
+
+        assert unassigned == []
+        assert [[p.user_id for p in route.passengers] for route in routes] == [
+            ["p2"],
+            ["p1"],
+        ]
+
+    def test_vrp_solves_condensed_matrix_in_place(self) -> None:
+        locations = LocationTable.from_locations(_random_locations(40, seed=9))
+        condensed = HaversineProvider().condensed_matrix_metrics(locations)[
+            "travel_time_minutes"
+        ]
+        arguments = dict(
+            driver_nodes=list(range(6)),
+            capacities=[3, 2, 4, 1, 3, 2],
+            passenger_nodes=list(range(6, 40)),
+            demands=[1 + index % 2 for index in range(34)],
+            destination=None,
+            time_limit_seconds=1.0,
+        )
+
+        with patch.object(CondensedMatrix, "to_dense") as to_dense:
+            condensed_result = solve_capacitated_vrp(condensed, **arguments)
+        dense_result = solve_capacitated_vrp(condensed.to_dense(), **arguments)
+
+        to_dense.assert_not_called()
+        assert condensed_result == dense_result
+
+    def test_vrp_no_drivers(self) -> None:
+        passengers = [Passenger("p1", "P1", Location(0.0, 0.1))]
+
+        routes, unassigned = assign_passengers_to_drivers([], passengers, engine="vrp")
+
+        assert routes == []
+        assert unassigned == passengers
+
+    def test_unknown_engine_is_rejected(self) -> None:
+        with pytest.raises(ValueError):
+            assign_passengers_to_drivers([], [], engine="annealing")
+
+
+def _random_locations(count: int, seed: int) -> list[Location]:
+    rng = random.Random(seed)
+    return [
+        Location(rng.uniform(40.6, 40.9), rng.uniform(-74.1, -73.8))
+        for _ in range(count)
+    ]
+
+
+class TestSpatialIndex:
+    """Test grid-based nearest and radius queries."""
+
+    def test_nearest_matches_brute_force(self) -> None:
+        locations = _random_locations(500, seed=1)
+        index = SpatialIndex(LocationTable.from_locations(locations))
+        provider = HaversineProvider()
+
+        for query in _random_locations(20, seed=2):
+            expected = sorted(provider.distance_km(query, other) for other in locations)
+            found = index.nearest(query, 5)
+
+            assert [distance for distance, _ in found] == pytest.approx(
+                expected[:5], rel=5e-3
+            )
+
+    def test_within_returns_points_inside_radius(self) -> None:
+        locations = _random_locations(500, seed=3)
+        index = SpatialIndex(locations)
+        provider = HaversineProvider()
+        query = Location(40.75, -73.95)
+
+        found = {i for _, i in index.within(query, 3.0)}
+        expected = {
+            i
+            for i, other in enumerate(locations)
+            if provider.distance_km(query, other) <= 3.0 * 0.995
+        }
+
+        assert expected <= found
+        assert all(provider.distance_km(query, locations[i]) <= 3.05 for i in found)
+
+    def test_removed_points_are_not_returned(self) -> None:
+        locations = [Location(0.0, 0.0), Location(0.0, 0.001), Location(0.0, 0.01)]
+        index = SpatialIndex(locations)
+
+        index.remove(0)
+        index.remove(0)
+
+        assert len(index) == 2
+        assert 0 not in index
+        assert [i for _, i in index.nearest(Location(0.0, 0.0), 2)] == [1, 2]
+        assert [i for _, i in index.within(Location(0.0, 0.0), 100.0)] == [1, 2]
+
+    def test_nearest_after_most_points_removed(self) -> None:
+        locations = _random_locations(1000, seed=4)
+        index = SpatialIndex(locations)
+        for i in range(999):
+            index.remove(i)
+
+        assert [i for _, i in index.nearest(Location(40.6, -74.1), 3)] == [999]
+
+    def test_empty_index(self) -> None:
+        index = SpatialIndex([])
+
+        assert index.nearest(Location(0.0, 0.0), 3) == []
+        assert index.within(Location(0.0, 0.0), 1.0) == []
+
+
+class TestCandidatePruning:
+    """Test greedy assignment restricted to the nearest candidates."""
+
+    def test_matches_full_matrix_greedy(self) -> None:
+        rng = random.Random(5)
+        drivers = [
+            Driver(f"d{i}", f"Driver {i}", location, capacity=rng.choice([2, 3, 4]))
+            for i, location in enumerate(_random_locations(20, seed=6))
+        ]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", location, seats_required=rng.choice([1, 1, 2]))
+            for i, location in enumerate(_random_locations(60, seed=7))
+        ]
+        destination = Location(40.75, -73.95)
+
+        full_routes, full_unassigned = assign_passengers_to_drivers(
+            drivers, passengers, destination=destination
+        )
+        pruned_routes, pruned_unassigned = assign_passengers_to_drivers(
+            drivers, passengers, destination=destination, candidate_count=8
+        )
+
+        assert [route.passengers for route in pruned_routes] == [
+            route.passengers for route in full_routes
+        ]
+        assert [route.pickup_order for route in pruned_routes] == [
+            route.pickup_order for route in full_routes
+        ]
+        assert sum(r.total_travel_time_minutes for r in pruned_routes) == pytest.approx(
+            sum(r.total_travel_time_minutes for r in full_routes)
+        )
+        assert pruned_unassigned == full_unassigned
+
+    def test_provider_only_scores_candidates(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(40.7, -74.0), capacity=2)]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", location)
+            for i, location in enumerate(_random_locations(50, seed=8))
+        ]
+        provider = HaversineProvider()
+
+        with patch.object(
+            provider, "matrix_metrics", wraps=provider.matrix_metrics
+        ) as matrix_metrics:
+            routes, unassigned = assign_passengers_to_drivers(
+                drivers, passengers, provider=provider, candidate_count=4
+            )
+
+        assert len(routes[0].passengers) == 2
+        assert len(unassigned) == 48
+        sizes = [
+            (len(call.args[0]), len(call.args[1]))
+            for call in matrix_metrics.call_args_list
+        ]
+        assert sizes == [(1, 4), (1, 4), (3, 3)]
+
+    def test_widens_search_when_nearest_do_not_fit(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=1)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.001), seats_required=2),
+            Passenger("p2", "P2", Location(0.0, 0.002), seats_required=2),
+            Passenger("p3", "P3", Location(0.0, 0.5)),
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, candidate_count=1
+        )
+
+        assert [p.user_id for p in routes[0].passengers] == ["p3"]
+        assert [p.user_id for p in unassigned] == ["p1", "p2"]
+
+    def test_invalid_candidate_count(self) -> None:
+        with pytest.raises(ValueError):
+            assign_passengers_to_drivers([], [], candidate_count=0)
+        with pytest.raises(ValueError):
+            assign_passengers_to_drivers([], [], engine="vrp", candidate_count=4)
+
+
+class TestPartitionedAssignment:
+    """Test clustered, cell-by-cell solving of large batches."""
+
+    @staticmethod
+    def _two_towns() -> tuple[list[Driver], list[Passenger]]:
+        drivers = [
+            Driver(f"d{i}", f"Driver {i}", Location(lat, lon + i * 0.001), capacity=2)
+            for i, (lat, lon) in enumerate([(40.0, -74.0)] * 3 + [(41.0, -73.0)] * 3)
+        ]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", Location(lat + i * 0.001, lon))
+            for i, (lat, lon) in enumerate([(40.0, -74.0)] * 6 + [(41.0, -73.0)] * 4)
+        ]
+        return drivers, passengers
+
+    def test_partition_covers_everyone_once(self) -> None:
+        drivers, passengers = self._two_towns()
+
+        cells = partition_batch(drivers, passengers, max_cell_passengers=5)
+
+        assert len(cells) == 2
+        assert sorted(i for cell_drivers, _ in cells for i in cell_drivers) == list(
+            range(len(drivers))
+        )
+        assert sorted(i for _, cell_passengers in cells for i in cell_passengers) == (
+            list(range(len(passengers)))
+        )
+        for cell_drivers, cell_passengers in cells:
+            towns = {drivers[i].location.latitude > 40.5 for i in cell_drivers}
+            towns |= {passengers[i].location.latitude > 40.5 for i in cell_passengers}
+            assert len(towns) == 1
+
+    def test_rebalancing_moves_passengers_to_cells_with_seats(self) -> None:
+        drivers, passengers = self._two_towns()
+        passengers += [
+            Passenger(f"q{i}", f"Q{i}", Location(40.0 + i * 0.001, -74.0))
+            for i in range(2)
+        ]
+
+        cells = partition_batch(drivers, passengers, max_cell_passengers=6)
+
+        for cell_drivers, cell_passengers in cells:
+            seats = sum(drivers[i].capacity for i in cell_drivers)
+            demand = sum(passengers[i].seats_required for i in cell_passengers)
+            assert demand <= seats
+
+    def test_single_cell_matches_monolithic_solve(self) -> None:
+        drivers, passengers = self._two_towns()
+
+        expected_routes, expected_unassigned = assign_passengers_to_drivers(
+            drivers, passengers
+        )
+        routes, unassigned = assign_passengers_partitioned(drivers, passengers)
+
+        assert routes == expected_routes
+        assert unassigned == expected_unassigned
+
+    def test_parallel_cells_merge_into_caller_objects(self) -> None:
+        drivers, passengers = self._two_towns()
+        destination = Location(40.5, -73.5)
+
+        routes, unassigned = assign_passengers_partitioned(
+            drivers,
+            passengers,
+            destination=destination,
+            provider=HaversineProvider(),
+            max_cell_passengers=5,
+            max_workers=2,
+        )
+
+        assert unassigned == []
+        assert [route.driver for route in routes] == drivers
+        assert all(
+            any(p is passenger for passenger in passengers)
+            for route in routes
+            for p in route.pickup_order
+        )
+        assert sum(len(route.passengers) for route in routes) == len(passengers)
+        for route in routes:
+            assert route.unfilled_seats == route.driver.capacity - len(route.passengers)
+
+    def test_options_are_passed_to_each_cell(self) -> None:
+        drivers, passengers = self._two_towns()
+
+        routes, unassigned = assign_passengers_partitioned(
+            drivers, passengers, max_cell_passengers=5, max_workers=1, engine="vrp"
+        )
+
+        assert unassigned == []
+        assert len(routes) == len(drivers)
+
+    def test_providers_survive_pickling(self, tmp_path: Path) -> None:
+        cache = SQLiteMetricsCache(tmp_path / "osrm.sqlite")
+        cache.set("driving", (0.0, 0.0, 0.0, 1.0), (1.0, 2.0))
+        providers = [
+            OSRMProvider(persistent_cache=cache),
+            AsyncOSRMProvider(persistent_cache=cache),
+        ]
+
+        for provider in providers:
+            copy = pickle.loads(pickle.dumps(provider))
+            assert copy.persistent_cache.get("driving", (0.0, 0.0, 0.0, 1.0)) == (
+                1.0,
+                2.0,
+            )
+        copy.close()
+
+
+class TestAssignmentSession:
+    """Test incremental assignment updates."""
+
+    def test_add_passenger_uses_cheapest_insertion(self) -> None:
+        session = AssignmentSession(
+            [
+                Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2),
+                Driver("d2", "Driver B", Location(0.0, 1.0), capacity=2),
+            ]
+        )
+
+        near_b = Passenger("p1", "P1", Location(0.0, 1.1))
+        between = Passenger("p2", "P2", Location(0.0, 1.05))
+
+        assert session.add_passenger(near_b).driver.user_id == "d2"
+        route = session.add_passenger(between)
+
+        assert route is not None and route.driver.user_id == "d2"
+        assert [p.user_id for p in route.pickup_order] == ["p2", "p1"]
+        assert [p.user_id for p in route.passengers] == ["p1", "p2"]
+        assert route.unfilled_seats == 0
+        assert route.total_distance_km == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 1.0), Location(0.0, 1.1))
+        )
+
+    def test_matches_batch_totals_for_same_routes(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=3)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.3)),
+            Passenger("p2", "P2", Location(0.0, 0.1)),
+            Passenger("p3", "P3", Location(0.0, 0.2)),
+        ]
+        destination = Location(0.0, 0.5)
+
+        session = AssignmentSession(drivers, destination=destination)
+        for passenger in passengers:
+            session.add_passenger(passenger)
+        routes, _ = assign_passengers_to_drivers(drivers, passengers, destination)
+
+        assert session.routes[0].pickup_order == routes[0].pickup_order
+        assert session.routes[0].total_travel_time_minutes == pytest.approx(
+            routes[0].total_travel_time_minutes
+        )
+
+    def test_waiting_passengers_are_seated_when_room_appears(self) -> None:
+        session = AssignmentSession(
+            [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=1)]
+        )
+        session.add_passenger(Passenger("p1", "P1", Location(0.0, 0.1)))
+
+        assert session.add_passenger(Passenger("p2", "P2", Location(0.0, 0.2))) is None
+        assert [p.user_id for p in session.unassigned] == ["p2"]
+
+        session.remove_passenger("p1")
+        assert session.unassigned == []
+        assert session.route_for("p2") is session.routes[0]
+
+        session.add_passenger(Passenger("p3", "P3", Location(0.0, 0.3)))
+        route = session.add_driver(
+            Driver("d2", "Driver B", Location(0.0, 0.4), capacity=1)
+        )
+        assert [p.user_id for p in route.passengers] == ["p3"]
+
+    def test_remove_unknown_passenger_raises(self) -> None:
+        session = AssignmentSession()
+
+        with pytest.raises(KeyError):
+            session.remove_passenger("missing")
+
+    def test_duplicate_ids_are_rejected(self) -> None:
+        driver = Driver("d1", "Driver A", Location(0.0, 0.0))
+        passenger = Passenger("p1", "P1", Location(0.0, 0.1))
+        session = AssignmentSession([driver])
+        session.add_passenger(passenger)
+
+        with pytest.raises(ValueError):
+            session.add_driver(driver)
+        with pytest.raises(ValueError):
+            session.add_passenger(passenger)
+
+    def test_driver_moved_replans_pickups(self) -> None:
+        session = AssignmentSession(
+            [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)]
+        )
+        session.add_passenger(Passenger("p1", "P1", Location(0.0, 0.1)))
+        session.add_passenger(Passenger("p2", "P2", Location(0.0, 0.2)))
+
+        route = session.driver_moved("d1", Location(0.0, 0.3))
+
+        assert route.driver.location == Location(0.0, 0.3)
+        assert [p.user_id for p in route.pickup_order] == ["p2", "p1"]
+        assert route.total_distance_km == pytest.approx(
+            HaversineProvider().distance_km(Location(0.0, 0.3), Location(0.0, 0.1))
+        )
+
+    def test_events_reuse_cached_metrics(self) -> None:
+        provider = HaversineProvider()
+        session = AssignmentSession(
+            [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=4)],
+            destination=Location(0.0, 1.0),
+            provider=provider,
+        )
+
+        with patch.object(
+            provider, "matrix_metrics", wraps=provider.matrix_metrics
+        ) as matrix_metrics:
+            session.add_passenger(Passenger("p1", "P1", Location(0.0, 0.2)))
+            session.add_passenger(Passenger("p2", "P2", Location(0.0, 0.4)))
+
+        # One row and one column per new passenger, nothing recomputed.
+        sizes = [
+            (len(call.args[0]), len(call.args[1]))
+            for call in matrix_metrics.call_args_list
+        ]
+        assert sizes == [(1, 2), (2, 1), (1, 3), (3, 1)]
+
+
+    @pytest.mark.parametrize("driver_count", [20, 400])
+    def test_event_work_does_not_grow_with_fleet(self, driver_count: int) -> None:
+        locations = _random_locations(driver_count + 300, seed=5)
+        provider = HaversineProvider()
+        session = AssignmentSession(
+            [
+                Driver(f"d{i}", f"Driver {i}", location, capacity=3)
+                for i, location in enumerate(locations[:driver_count])
+            ],
+            destination=Location(40.75, -73.95),
+            provider=provider,
+            candidate_routes=4,
+        )
+
+        with patch.object(
+            provider, "matrix_metrics", wraps=provider.matrix_metrics
+        ) as matrix_metrics:
+            for i, location in enumerate(locations[driver_count:]):
+                session.add_passenger(Passenger(f"p{i}", f"P{i}", location))
+
+        # Each new passenger is scored against at most 4 routes of at most
+        # driver + 3 pickups + destination stops, in both directions.
+        cells = [
+            len(call.args[0]) * len(call.args[1])
+            for call in matrix_metrics.call_args_list
+        ]
+        assert max(cells) <= 4 * 5
+        # Only cells between nodes of the same route stay cached.
+        cached = sum(len(row) for row in session._metrics.values())
+        assert cached <= sum(
+            (len(route.pickup_order) + 2) ** 2 for route in session.routes
+        )
+
+class TestRouteLegs:
+    """Test per-leg metrics along multi-stop routes."""
+
+    def test_haversine_legs_match_scalar_calls(self) -> None:
+        provider = HaversineProvider()
+        stops = [Location(0.0, 0.0), Location(0.0, 0.1), Location(0.2, 0.1)]
+
+        legs = provider.route_legs(stops)
+
+        assert len(legs) == 2
+        for (origin, destination), (distance, travel_time) in zip(
+            zip(stops, stops[1:]), legs
+        ):
+            assert distance == pytest.approx(provider.distance_km(origin, destination))
+            assert travel_time == pytest.approx(
+                provider.travel_time_minutes(origin, destination)
+            )
+        assert provider.route_legs(stops[:1]) == []
+
+    def test_osrm_legs_use_one_route_request(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        stops = [Location(0.0, 0.0), Location(0.0, 0.01), Location(0.02, 0.01)]
+
+        legs = provider.route_legs(stops)
+        assert provider.route_legs(stops) == legs
+
+        assert legs == [pytest.approx((1.0, 100 / 60)), pytest.approx((2.0, 200 / 60))]
+        assert len(stub_osrm.paths) == 1
+        assert stub_osrm.paths[0].startswith("/route/v1/driving/0.0,0.0;0.01,0.0;")
+        assert provider.distance_km(stops[1], stops[2]) == pytest.approx(2.0)
+        assert len(stub_osrm.paths) == 1
+
+    def test_osrm_long_routes_are_split(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_route_waypoints=3,
+        )
+        stops = [Location(0.0, 0.01 * i) for i in range(6)]
+
+        legs = provider.route_legs(stops)
+
+        assert legs == [pytest.approx((1.0, 100 / 60))] * 5
+        assert len(stub_osrm.paths) == 3
+
+    def test_route_metrics_sums_legs(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        stops = [Location(0.0, 0.0), Location(0.0, 0.01), Location(0.02, 0.01)]
+
+        assert route_metrics(stops, provider) == pytest.approx((3.0, 5.0))
+        assert len(stub_osrm.paths) == 1
+        assert route_metrics(stops[:1], provider) == (0.0, 0.0)
+
+    def test_assignment_routes_report_legs(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 0.1)),
+            Passenger("p2", "P2", Location(0.0, 0.2)),
+        ]
+
+        for options in ({}, {"candidate_count": 1}):
+            routes, _ = assign_passengers_to_drivers(
+                drivers, passengers, destination=Location(0.0, 0.5), **options
+            )
+
+            route = routes[0]
+            assert len(route.leg_distances_km) == 3
+            assert len(route.leg_travel_times_minutes) == 3
+            assert sum(route.leg_distances_km) == pytest.approx(route.total_distance_km)
+            assert sum(route.leg_travel_times_minutes) == pytest.approx(
+                route.total_travel_time_minutes
+            )
+
+    def test_session_routes_report_legs(self) -> None:
+        session = AssignmentSession(
+            [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)],
+            destination=Location(0.0, 0.5),
+        )
+        session.add_passenger(Passenger("p1", "P1", Location(0.0, 0.1)))
+
+        route = session.routes[0]
+        assert len(route.leg_distances_km) == 2
+        assert sum(route.leg_distances_km) == pytest.approx(route.total_distance_km)
+
+
+class _ManhattanProvider(DistanceProvider):
+    """Minimal provider implementing only the combined metrics methods."""
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        distance_km = abs(origin.latitude - destination.latitude) + abs(
+            origin.longitude - destination.longitude
+        )
+        return distance_km, 2 * distance_km
+
+    def matrix_metrics(self, origins, destinations) -> np.ndarray:
+        return np.array(
+            [[self.metrics(o, d) for d in destinations] for o in origins],
+            dtype=METRICS_DTYPE,
+        )
+
+
+class _LegacyProvider(DistanceProvider):
+    """Provider written against the original four-method interface."""
+
+    def distance_km(self, origin: Location, destination: Location) -> float:
+        return abs(origin.latitude - destination.latitude)
+
+    def matrix_distances_km(self, origins, destinations) -> list[list[float]]:
+        return [[self.distance_km(o, d) for d in destinations] for o in origins]
+
+    def travel_time_minutes(self, origin: Location, destination: Location) -> float:
+        return 3 * self.distance_km(origin, destination)
+
+    def matrix_travel_times_minutes(self, origins, destinations) -> list[list[float]]:
+        return [
+            [self.travel_time_minutes(o, d) for d in destinations] for o in origins
+        ]
+
+
+class TestCombinedMetrics:
+    """Test the combined distance + travel time provider API."""
+
+    def test_single_quantity_methods_derive_from_metrics(self) -> None:
+        provider = _ManhattanProvider()
+        a, b, c = Location(0.0, 0.0), Location(1.0, 0.0), Location(1.0, 2.0)
+
+        assert provider.distance_km(a, c) == 3.0
+        assert provider.travel_time_minutes(a, c) == 6.0
+        assert provider.matrix_distances_km([a], [b, c]) == [[1.0, 3.0]]
+        assert provider.matrix_travel_times_minutes([a], [b, c]) == [[2.0, 6.0]]
+        assert provider.route_legs([a, b, c]) == [(1.0, 2.0), (2.0, 4.0)]
+
+    def test_legacy_four_method_provider_still_works(self) -> None:
+        provider = _LegacyProvider()
+        a, b, c = Location(0.0, 0.0), Location(1.0, 0.0), Location(3.0, 0.0)
+
+        assert provider.metrics(a, c) == (3.0, 9.0)
+        metrics = provider.matrix_metrics([a], [b, c])
+        assert metrics["distance_km"].tolist() == [[1.0, 3.0]]
+        assert metrics["travel_time_minutes"].tolist() == [[3.0, 9.0]]
+        assert provider.route_legs([a, b, c]) == [(1.0, 3.0), (2.0, 6.0)]
+
+    def test_provider_without_metrics_raises(self) -> None:
+        class _Empty(DistanceProvider):
+            pass
+
+        with pytest.raises(NotImplementedError):
+            _Empty().metrics(Location(0.0, 0.0), Location(1.0, 0.0))
+
+    def test_default_route_legs_only_requests_consecutive_pairs(self) -> None:
+        provider = _ManhattanProvider()
+        stops = LocationTable.from_locations(
+            [Location(0.0, 0.0), Location(1.0, 0.0), Location(1.0, 2.0)]
+        )
+
+        with patch.object(
+            _ManhattanProvider, "matrix_metrics", side_effect=AssertionError
+        ):
+            legs = provider.route_legs(stops)
+
+        assert legs == [(1.0, 2.0), (2.0, 4.0)]
+
+    def test_haversine_matrix_metrics_matches_separate_matrices(self) -> None:
+        provider = HaversineProvider(average_speed_kmph=30.0)
+        locations = _random_locations(20, seed=9)
+
+        metrics = provider.matrix_metrics(locations, locations[:5])
+
+        assert metrics.dtype == METRICS_DTYPE
+        assert metrics.shape == (20, 5)
+        assert np.allclose(
+            metrics["distance_km"],
+            provider.matrix_distances_km(locations, locations[:5]),
+        )
+        assert np.allclose(
+            metrics["travel_time_minutes"],
+            provider.matrix_travel_times_minutes(locations, locations[:5]),
+        )
+        distance_km, travel_time = provider.metrics(locations[0], locations[1])
+        assert distance_km == pytest.approx(metrics["distance_km"][0, 1])
+        assert travel_time == pytest.approx(distance_km * 2)
+
+    def test_osrm_matrix_metrics_uses_one_table_request(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        locations = [Location(0.0, 0.0), Location(0.0, 0.01)]
+
+        metrics = provider.matrix_metrics(locations, locations)
+
+        assert len(stub_osrm.paths) == 1
+        assert metrics["distance_km"].tolist() == [[0.0, 1.0], [1.0, 0.0]]
+        assert metrics["travel_time_minutes"][0, 1] == pytest.approx(100 / 60)
+        assert provider.metrics(locations[0], locations[1]) == pytest.approx(
+            (1.0, 100 / 60)
+        )
+        assert len(stub_osrm.paths) == 1
+
+    def test_assignment_accepts_metrics_only_provider(self) -> None:
+        drivers = [Driver("d1", "Driver A", Location(0.0, 0.0), capacity=2)]
+        passengers = [
+            Passenger("p1", "P1", Location(0.0, 2.0)),
+            Passenger("p2", "P2", Location(0.0, 1.0)),
+        ]
+
+        routes, _ = assign_passengers_to_drivers(
+            drivers, passengers, provider=_ManhattanProvider()
+        )
+
+        assert [p.user_id for p in routes[0].pickup_order] == ["p2", "p1"]
+        assert routes[0].total_distance_km == 2.0
+        assert routes[0].total_travel_time_minutes == 4.0
+        assert routes[0].leg_travel_times_minutes == [2.0, 2.0]
+
+
+class TestCondensedMatrix:
+    """Test upper-triangle storage for symmetric providers."""
+
+    def test_condensed_index_matches_triu_order(self) -> None:
+        rows, columns = np.triu_indices(6, k=1)
+
+        assert [condensed_index(6, i, j) for i, j in zip(rows, columns)] == list(
+            range(15)
+        )
+        assert condensed_index(6, 4, 1) == condensed_index(6, 1, 4)
+
+    def test_haversine_condensed_matches_full_matrix(self) -> None:
+        provider = HaversineProvider(average_speed_kmph=30.0)
+        locations = _random_locations(25, seed=4)
+
+        condensed = provider.condensed_matrix_metrics(locations)
+        full = provider.matrix_metrics(locations, locations)
+
+        assert provider.is_symmetric
+        assert len(condensed.values) == 25 * 24 // 2
+        for field in ("distance_km", "travel_time_minutes"):
+            assert np.allclose(condensed[field].to_dense(), full[field])
+            assert np.allclose(condensed[field][7], full[field][7])
+            nodes = [3, 0, 24, 3]
+            assert np.allclose(
+                condensed[field].submatrix(nodes), full[field][np.ix_(nodes, nodes)]
+            )
+        assert condensed["distance_km"][5, 5] == 0.0
+        assert condensed["distance_km"][9, 2] == pytest.approx(full["distance_km"][9, 2])
+
+    def test_asymmetric_provider_has_no_condensed_form(self) -> None:
+        with pytest.raises(ValueError, match="not symmetric"):
+            _ManhattanProvider().condensed_matrix_metrics([Location(0.0, 0.0)])
+
+    def test_default_condensed_form_for_symmetric_provider(self) -> None:
+        class SymmetricManhattan(_ManhattanProvider):
+            is_symmetric = True
+
+        locations = [Location(0.0, 0.0), Location(1.0, 0.0), Location(1.0, 2.0)]
+
+        condensed = SymmetricManhattan().condensed_matrix_metrics(locations)
+
+        assert condensed["distance_km"].values.tolist() == [1.0, 3.0, 2.0]
+
+    def test_tsp_consumes_condensed_matrix(self) -> None:
+        provider = HaversineProvider()
+        locations = _random_locations(12, seed=2)
+        condensed = provider.condensed_matrix_metrics(locations)["travel_time_minutes"]
+        dense = condensed.to_dense()
+        stops = list(range(1, 12))
+
+        assert isinstance(condensed, CondensedMatrix)
+        assert nearest_neighbor_order(condensed, 0, stops) == nearest_neighbor_order(
+            dense, 0, stops
+        )
+        assert solve_open_tsp(condensed, 0, stops, end=11) == solve_open_tsp(
+            dense, 0, stops, end=11
+        )
+
+    def test_symmetric_assignment_uses_condensed_matrix(self) -> None:
+        provider = HaversineProvider()
+        locations = _random_locations(30, seed=6)
+        drivers = [Driver(f"d{i}", "D", locations[i], capacity=4) for i in range(6)]
+        passengers = [
+            Passenger(f"p{i}", "P", location) for i, location in enumerate(locations[6:])
+        ]
+
+        with patch.object(
+            provider, "matrix_metrics", wraps=provider.matrix_metrics
+        ) as full_matrix:
+            routes, unassigned = assign_passengers_to_drivers(
+                drivers, passengers, destination=locations[0], provider=provider
+            )
+
+        full_matrix.assert_not_called()
+        assert not unassigned
+        for route in routes:
+            stops = [route.driver.location, *(p.location for p in route.pickup_order)]
+            stops.append(locations[0])
+            distance_km, travel_time = route_metrics(stops, provider)
+            assert route.total_distance_km == pytest.approx(distance_km)
+            assert route.total_travel_time_minutes == pytest.approx(travel_time)
+
+
+class TestProviderInstrumentation:
+    """Test call, cache, HTTP, retry and sleep instrumentation."""
+
+    def test_wrapper_counts_calls_and_preserves_results(self) -> None:
+        inner = HaversineProvider()
+        provider = InstrumentedProvider(inner)
+        locations = _random_locations(5, seed=1)
+
+        matrix = provider.matrix_metrics(locations, locations)
+        provider.distance_km(locations[0], locations[1])
+        provider.condensed_matrix_metrics(locations)
+
+        assert provider.is_symmetric
+        assert np.array_equal(matrix, inner.matrix_metrics(locations, locations))
+        snapshot = provider.instrumentation.snapshot()
+        assert snapshot["calls"] == {
+            "matrix_metrics": 1,
+            "metrics": 1,
+            "condensed_matrix_metrics": 1,
+        }
+        assert snapshot["call_latency"]["metrics"]["count"] == 1
+        assert snapshot["call_latency"]["metrics"]["buckets"]["+Inf"] == 1
+
+    def test_osrm_records_http_and_cache(self, stub_osrm: StubOSRMServer) -> None:
+        provider = InstrumentedProvider(
+            OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        )
+        locations = [Location(0.0, 0.0), Location(0.0, 0.01)]
+
+        provider.matrix_metrics(locations, locations)
+        provider.metrics(locations[0], locations[1])
+
+        snapshot = provider.instrumentation.snapshot()
+        assert snapshot["http"]["table"]["count"] == 1
+        assert snapshot["http"]["table"]["sum_seconds"] > 0.0
+        assert snapshot["cache"]["memory"] == {"hits": 1, "misses": 4}
+        assert snapshot["retries"] == 0
+
+    @patch("providers.osrm.time.sleep")
+    @patch("providers.osrm.requests.get")
+    def test_osrm_records_retries_and_backoff(
+        self, mock_get: MagicMock, mock_sleep: MagicMock
+    ) -> None:
+        rate_limited = MagicMock(status_code=429)
+        success = MagicMock(status_code=200)
+        success.json.return_value = {
+            "code": "Ok",
+            "routes": [{"distance": 5000, "duration": 300}],
+        }
+        mock_get.side_effect = [rate_limited, success]
+        metrics = ProviderMetrics()
+        provider = OSRMProvider(
+            requests_per_second=0.0,
+            max_retries=1,
+            retry_backoff_seconds=0.1,
+            instrumentation=metrics,
+        )
+
+        provider.distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+
+        snapshot = metrics.snapshot()
+        assert snapshot["retries"] == 1
+        assert snapshot["sleep_seconds"] == {"backoff": pytest.approx(0.1)}
+        assert snapshot["http"]["route"]["count"] == 2
+        assert snapshot["cache"]["memory"] == {"hits": 0, "misses": 1}
+
+    @patch("providers.osrm.time.sleep")
+    @patch("providers.osrm.requests.get")
+    def test_osrm_records_throttle_sleep(
+        self, mock_get: MagicMock, mock_sleep: MagicMock
+    ) -> None:
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"code": "Ok", "routes": [{"distance": 1000}]}
+        mock_get.return_value = response
+        metrics = ProviderMetrics()
+        provider = OSRMProvider(
+            requests_per_second=2.0, max_retries=0, instrumentation=metrics
+        )
+
+        provider.distance_km(Location(0.0, 0.0), Location(1.0, 1.0))
+        provider.distance_km(Location(0.0, 0.0), Location(2.0, 2.0))
+
+        assert metrics.snapshot()["sleep_seconds"]["throttle"] == pytest.approx(
+            mock_sleep.call_args[0][0]
+        )
+
+    def test_prometheus_text(self) -> None:
+        metrics = ProviderMetrics(latency_buckets=(0.1, 1.0))
+        metrics.record_call("matrix_metrics", 0.05)
+        metrics.record_http("table", 0.5)
+        metrics.record_cache("memory", 3, 1)
+        metrics.record_sleep("throttle", 0.25)
+
+        text = metrics.to_prometheus()
+
+        assert "# TYPE carpool_provider_calls_total counter" in text
+        assert 'carpool_provider_calls_total{method="matrix_metrics"} 1' in text
+        assert (
+            'carpool_provider_http_request_duration_seconds_bucket'
+            '{service="table",le="0.1"} 0'
+        ) in text
+        assert (
+            'carpool_provider_http_request_duration_seconds_bucket'
+            '{service="table",le="+Inf"} 1'
+        ) in text
+        assert 'carpool_provider_cache_hits_total{layer="memory"} 3' in text
+        assert 'carpool_provider_sleep_seconds_total{reason="throttle"} 0.25' in text
+        assert text.endswith("\n")
+
+    def test_uninstrumented_provider_records_nothing(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+
+        provider.distance_km(Location(0.0, 0.0), Location(0.0, 0.01))
+
+        assert provider.instrumentation is None
+        restored = pickle.loads(pickle.dumps(ProviderMetrics()))
+        restored.record_retry()
+        assert restored.snapshot()["retries"] == 1
+
+
+class TestTracing:
+    """Test phase spans emitted by assignment and TSP."""
+
+    def _scenario(self) -> tuple[list[Driver], list[Passenger], Location]:
+        locations = _random_locations(14, seed=8)
+        drivers = [Driver(f"d{i}", "D", locations[i], capacity=4) for i in range(3)]
+        passengers = [
+            Passenger(f"p{i}", "P", location) for i, location in enumerate(locations[3:])
+        ]
+        return drivers, passengers, locations[0]
+
+    def test_assignment_spans_and_counters(self) -> None:
+        drivers, passengers, destination = self._scenario()
+        tracer = RecordingTracer()
+
+        traced = assign_passengers_to_drivers(
+            drivers, passengers, destination, tracer=tracer
+        )
+        untraced = assign_passengers_to_drivers(drivers, passengers, destination)
+
+        assert traced == untraced
+        summary = tracer.summary()
+        assert set(summary) == {
+            "assign",
+            "assign;matrix",
+            "assign;greedy",
+            "assign;route",
+            "assign;route;pickup_order",
+            "assign;route;pickups",
+            "assign;route;route_metrics",
+        }
+        assert summary["assign;matrix"]["counters"]["provider_calls"] == 1
+        assert summary["assign;greedy"]["counters"]["candidates_scanned"] > 0
+        assert summary["assign;route"]["count"] == 3
+        route_spans = [span for span in tracer.spans if span.name == "route"]
+        assert [span.attributes["driver"] for span in route_spans] == [
+            route.driver.user_id for route in traced[0]
+        ]
+        assert summary["assign"]["seconds"] >= summary["assign;route"]["seconds"]
+
+    def test_pruned_assignment_counts_provider_calls(self) -> None:
+        drivers, passengers, destination = self._scenario()
+        tracer = RecordingTracer()
+
+        assign_passengers_to_drivers(
+            drivers, passengers, destination, candidate_count=3, tracer=tracer
+        )
+
+        summary = tracer.summary()
+        assert summary["assign;pruned_greedy"]["counters"]["provider_calls"] == len(
+            passengers
+        )
+        assert summary["assign;route;matrix"]["counters"]["provider_calls"] == 3
+
+    def test_folded_output_is_self_time_per_stack(self) -> None:
+        tracer = RecordingTracer()
+        with tracer.span("outer"):
+            with tracer.span("inner"):
+                time.sleep(0.01)
+            with tracer.span("inner"):
+                pass
+
+        lines = dict(line.rsplit(" ", 1) for line in tracer.folded().splitlines())
+
+        assert set(lines) == {"outer", "outer;inner"}
+        assert int(lines["outer;inner"]) >= 10_000
+        assert int(lines["outer"]) < int(lines["outer;inner"])
+
+    def test_nearest_neighbor_tsp_spans(self) -> None:
+        locations = _random_locations(6, seed=3)
+        tracer = RecordingTracer()
+
+        ordered = nearest_neighbor_tsp(locations[0], locations[1:], tracer=tracer)
+
+        assert ordered == nearest_neighbor_tsp(locations[0], locations[1:])
+        summary = tracer.summary()
+        assert summary["nearest_neighbor_tsp;matrix"]["counters"]["provider_calls"] == 1
+        assert (
+            summary["nearest_neighbor_tsp;order"]["counters"]["candidates_scanned"]
+            == 15
+        )
+
+
+class TestOSRMConcurrency:
+    """Test single-flight, coalescing and locking in the shared OSRM provider."""
+
+    def test_concurrent_scalar_misses_share_one_request(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.delay_seconds = 0.1
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        origin, destination = Location(0.0, 0.0), Location(0.0, 0.01)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(
+                executor.map(
+                    lambda call: call(origin, destination),
+                    [provider.distance_km, provider.travel_time_minutes] * 3,
+                )
+            )
+
+        assert len(stub_osrm.paths) == 1
+        assert results == pytest.approx([1.0, 100 / 60] * 3)
+
+    def test_concurrent_matrices_share_table_tiles(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.delay_seconds = 0.1
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        locations = [Location(0.0, 0.01 * i) for i in range(4)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            matrices = list(
+                executor.map(
+                    lambda _: provider.matrix_metrics(locations, locations), range(4)
+                )
+            )
+
+        assert len(stub_osrm.paths) == 1
+        for matrix in matrices:
+            assert np.array_equal(matrix, matrices[0])
+
+    def test_scalar_misses_coalesce_into_one_table_call(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            coalesce_window_seconds=0.2,
+        )
+        origin = Location(0.0, 0.0)
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            distances = list(
+                executor.map(
+                    lambda destination: provider.distance_km(origin, destination),
+                    destinations,
+                )
+            )
+
+        assert distances == pytest.approx([1.0, 2.0, 3.0, 4.0, 5.0])
+        assert len(stub_osrm.paths) == 1
+        assert stub_osrm.paths[0].startswith("/table/")
+
+    def test_throttle_spaces_requests_across_threads(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=20.0)
+        origin = Location(0.0, 0.0)
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            list(
+                executor.map(
+                    lambda destination: provider.distance_km(origin, destination),
+                    destinations,
+                )
+            )
+
+        assert len(stub_osrm.paths) == 5
+        assert time.monotonic() - started >= 4 * 0.05 - 0.01
+
+    def test_provider_stays_picklable(self, stub_osrm: StubOSRMServer) -> None:
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        provider.distance_km(Location(0.0, 0.0), Location(0.0, 0.01))
+
+        copy = pickle.loads(pickle.dumps(provider))
+
+        assert copy.distance_km(Location(0.0, 0.0), Location(0.0, 0.01)) == 1.0
+        assert copy.distance_km(Location(0.0, 0.0), Location(0.0, 0.02)) == 2.0
+        assert len(stub_osrm.paths) == 2
+
+
+class TestOSRMResilience:
+    """Test the negative cache, circuit breaker and fallback provider."""
+
+    def test_unroutable_pair_is_not_refetched_within_ttl(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.no_route = True
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        origin, destination = Location(0.0, 0.0), Location(0.0, 0.01)
+
+        expected = pytest.approx(HaversineProvider().metrics(origin, destination))
+        assert provider.metrics(origin, destination) == expected
+        assert provider.metrics(origin, destination) == expected
+        assert len(stub_osrm.paths) == 1
+
+    def test_http_400_no_route_is_negative_cached(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.no_route = True
+        stub_osrm.no_route_status = 400
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            circuit_breaker_threshold=2,
+        )
+        origin, destination = Location(0.0, 0.0), Location(0.0, 0.01)
+
+        expected = pytest.approx(HaversineProvider().metrics(origin, destination))
+        for _ in range(5):
+            assert provider.metrics(origin, destination) == expected
+
+        assert len(stub_osrm.paths) == 1
+        assert provider._consecutive_failures == 0
+
+    def test_null_route_leg_is_not_cached_as_free(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.null_leg = 1
+        haversine = HaversineProvider()
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            fallback_provider=haversine,
+        )
+        stops = [Location(0.0, 0.0), Location(0.0, 0.01), Location(0.0, 0.03)]
+
+        legs = provider.route_legs(stops)
+        assert provider.route_legs(stops) == legs
+
+        assert legs[0] == pytest.approx((1.0, 100 / 60))
+        assert legs[1] == pytest.approx(haversine.metrics(stops[1], stops[2]))
+        assert len(stub_osrm.paths) == 1
+
+    def test_unroutable_table_cells_are_not_refetched_within_ttl(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.no_route = True
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        locations = [Location(0.0, 0.01 * i) for i in range(3)]
+
+        provider.matrix_metrics(locations, locations)
+        matrix = provider.matrix_metrics(locations, locations)
+
+        assert len(stub_osrm.paths) == 1
+        assert matrix["distance_km"] == pytest.approx(
+            HaversineProvider().matrix_distances_km_array(locations, locations)
+        )
+
+    def test_unroutable_passenger_is_not_ranked_nearest(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.unroutable.add((0.05, 0.0))
+        provider = OSRMProvider(base_url=stub_osrm.base_url, requests_per_second=0.0)
+        drivers = [Driver("d1", "Driver", Location(0.0, 0.0), capacity=1)]
+        passengers = [
+            Passenger("island", "Island", Location(0.0, 0.05)),
+            Passenger("near", "Near", Location(0.0, 0.01)),
+        ]
+
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, provider=provider
+        )
+
+        assert [p.user_id for p in routes[0].passengers] == ["near"]
+        assert [p.user_id for p in unassigned] == ["island"]
+
+    def test_unroutable_pair_is_retried_after_ttl(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.no_route = True
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            negative_cache_ttl_seconds=0.05,
+        )
+        origin, destination = Location(0.0, 0.0), Location(0.0, 0.01)
+
+        provider.metrics(origin, destination)
+        time.sleep(0.06)
+        stub_osrm.no_route = False
+
+        assert provider.distance_km(origin, destination) == pytest.approx(1.0)
+        assert len(stub_osrm.paths) == 2
+
+    def test_circuit_opens_after_consecutive_failures(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.failures_remaining = 100
+        metrics = ProviderMetrics()
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_retries=0,
+            circuit_breaker_threshold=2,
+            circuit_breaker_reset_seconds=60.0,
+            instrumentation=metrics,
+        )
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        for destination in destinations:
+            provider.metrics(Location(0.0, 0.0), destination)
+
+        assert len(stub_osrm.paths) == 2
+        assert metrics.snapshot()["events"]["circuit_open"] == 3
+
+    def test_circuit_half_opens_after_reset(self, stub_osrm: StubOSRMServer) -> None:
+        stub_osrm.failures_remaining = 2
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_retries=0,
+            circuit_breaker_threshold=2,
+            circuit_breaker_reset_seconds=0.05,
+        )
+        origin = Location(0.0, 0.0)
+
+        provider.metrics(origin, Location(0.0, 0.01))
+        provider.metrics(origin, Location(0.0, 0.02))
+        # Open circuit without a fallback_provider: haversine estimate.
+        assert provider.distance_km(origin, Location(0.0, 0.03)) == pytest.approx(
+            HaversineProvider().distance_km(origin, Location(0.0, 0.03))
+        )
+        time.sleep(0.06)
+
+        assert provider.distance_km(origin, Location(0.0, 0.04)) == pytest.approx(4.0)
+        assert provider.distance_km(origin, Location(0.0, 0.05)) == pytest.approx(5.0)
+        assert len(stub_osrm.paths) == 4
+
+    def test_client_errors_count_as_circuit_failures(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.client_error_status = 400
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            circuit_breaker_threshold=2,
+            circuit_breaker_reset_seconds=0.05,
+        )
+        origin = Location(0.0, 0.0)
+
+        for index in range(1, 4):
+            provider.metrics(origin, Location(0.0, 0.01 * index))
+        assert len(stub_osrm.paths) == 2
+
+        # A half-open probe answered with another client error reopens the
+        # circuit instead of leaving the trial unsettled.
+        time.sleep(0.06)
+        provider.metrics(origin, Location(0.0, 0.04))
+        provider.metrics(origin, Location(0.0, 0.05))
+        assert len(stub_osrm.paths) == 3
+        assert provider._consecutive_failures == 3
+
+        time.sleep(0.06)
+        stub_osrm.client_error_status = None
+        assert provider.distance_km(origin, Location(0.0, 0.06)) == pytest.approx(6.0)
+        assert provider._consecutive_failures == 0
+
+    def test_falls_back_when_osrm_is_down(self, stub_osrm: StubOSRMServer) -> None:
+        stub_osrm.failures_remaining = 100
+        haversine = HaversineProvider()
+        metrics = ProviderMetrics()
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            max_retries=0,
+            fallback_provider=haversine,
+            instrumentation=metrics,
+        )
+        locations = [Location(-37.81 + 0.01 * i, 144.96) for i in range(3)]
+
+        matrix = provider.matrix_metrics(locations, locations)
+        scalar = provider.metrics(locations[0], locations[2])
+
+        assert np.allclose(
+            matrix["distance_km"],
+            haversine.matrix_metrics(locations, locations)["distance_km"],
+        )
+        assert scalar == pytest.approx(haversine.metrics(locations[0], locations[2]))
+        assert metrics.snapshot()["events"]["fallback_cells"] == 10
+
+    def test_fallback_fills_only_unresolved_cells(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        haversine = HaversineProvider()
+        provider = OSRMProvider(
+            base_url=stub_osrm.base_url,
+            requests_per_second=0.0,
+            fallback_provider=haversine,
+        )
+        origin = Location(0.0, 0.0)
+        routed, unroutable = Location(0.0, 0.01), Location(0.0, 0.02)
+        provider.metrics(origin, routed)
+        stub_osrm.no_route = True
+
+        matrix = provider.matrix_metrics([origin], [routed, unroutable])
+
+        assert matrix["distance_km"][0, 0] == pytest.approx(1.0)
+        assert matrix["distance_km"][0, 1] == pytest.approx(
+            haversine.distance_km(origin, unroutable)
+        )
+        assert "sources=0&destinations=1" in stub_osrm.paths[-1]
+
+
+class _UnevenDetourProvider(DistanceProvider):
+    """Haversine with a detour factor that varies from pair to pair."""
+
+    def metrics(self, origin: Location, destination: Location) -> tuple[float, float]:
+        distance_km, travel_time = HaversineProvider().metrics(origin, destination)
+        detour = 1.0 + 2.0 * abs(
+            math.sin(1000.0 * (origin.latitude + 2.0 * destination.longitude))
+        )
+        return distance_km * detour, travel_time * detour * detour
+
+
+class TestTieredProvider:
+    """Test haversine ranking with refinement of the top candidates."""
+
+    def test_refines_top_k_cells_per_row_in_one_batch(self) -> None:
+        fine = InstrumentedProvider(_ManhattanProvider())
+        provider = TieredProvider(fine, top_k=2)
+        origins = [Location(0.0, 0.0), Location(1.0, 1.0)]
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        matrix = provider.matrix_metrics(origins, destinations)
+
+        assert fine.instrumentation.snapshot()["calls"] == {"pair_metrics": 1}
+        assert provider.ranking_stats()["refined_cells"] == 4
+        assert provider.ranking_stats()["coarse_cells"] == 6
+        assert matrix[0, 0]["distance_km"] == pytest.approx(0.01)
+        assert matrix[0, 1]["distance_km"] == pytest.approx(0.02)
+
+    def test_unrefined_cells_never_outrank_refined_ones(self) -> None:
+        provider = TieredProvider(_ManhattanProvider(), top_k=2, learn_detour=False)
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        times = provider.matrix_metrics(origins, destinations)["travel_time_minutes"]
+
+        assert times[0, 2:].min() >= times[0, :2].max()
+
+    def test_reports_coarse_and_refined_ranking_disagreement(self) -> None:
+        provider = TieredProvider(_ManhattanProvider(), top_k=2)
+        # B is closer as the crow flies, A is closer on a grid.
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(0.0, 0.10), Location(0.06, 0.06), Location(1.0, 1.0)]
+
+        times = provider.matrix_metrics(origins, destinations)["travel_time_minutes"]
+
+        assert int(np.argmin(times[0])) == 0
+        stats = provider.ranking_stats()
+        assert stats["disagreements"] == 1
+        assert stats["disagreement_rate"] == 1.0
+
+    def test_learns_detour_factors_from_refined_cells(self) -> None:
+        provider = TieredProvider(HaversineProvider(average_speed_kmph=20.0), top_k=2)
+        origins = [Location(0.0, 0.0)]
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 7)]
+
+        matrix = provider.matrix_metrics(origins, destinations)
+
+        assert provider.distance_factor == pytest.approx(1.0)
+        assert provider.time_factor == pytest.approx(2.0)
+        expected = HaversineProvider(average_speed_kmph=20.0).matrix_metrics(
+            origins, destinations
+        )
+        assert np.allclose(
+            matrix["travel_time_minutes"], expected["travel_time_minutes"]
+        )
+
+    def test_refines_only_candidate_columns(self) -> None:
+        fine = InstrumentedProvider(_ManhattanProvider())
+        provider = TieredProvider(fine, top_k=2, learn_detour=False)
+        origins = [Location(0.0, 0.0), Location(1.0, 1.0)]
+        destinations = [Location(0.0, 0.01 * i) for i in range(1, 6)]
+
+        matrix = provider.matrix_metrics(
+            origins, destinations, candidate_columns=[2, 3, 4]
+        )
+
+        assert provider.ranking_stats()["refined_cells"] == 4
+        assert matrix[0, 2]["distance_km"] == pytest.approx(0.03)
+        assert matrix[0, 3]["distance_km"] == pytest.approx(0.04)
+        coarse = HaversineProvider().matrix_metrics(origins, destinations[:2])
+        assert np.allclose(matrix["distance_km"][:, :2], coarse["distance_km"])
+        wrapped = InstrumentedProvider(
+            TieredProvider(_ManhattanProvider(), top_k=2, learn_detour=False)
+        )
+        assert np.array_equal(
+            wrapped.matrix_metrics(origins, destinations, candidate_columns=[2, 3, 4]),
+            matrix,
+        )
+
+    def test_assignment_refines_only_passenger_columns(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        # Drivers and the destination sit between the passengers, so they
+        # would take refinement slots if every column were ranked.
+        drivers = [
+            Driver(f"d{i}", f"Driver {i}", Location(0.0, 0.03 * i), capacity=2)
+            for i in range(3)
+        ]
+        passengers = [
+            Passenger(
+                f"p{i}", f"P{i}", Location(0.0, 0.03 * (i // 2) + 0.01 * (i % 2 + 1))
+            )
+            for i in range(6)
+        ]
+        destination = Location(0.0, 0.09)
+        locations = [
+            *(driver.location for driver in drivers),
+            *(passenger.location for passenger in passengers),
+            destination,
+        ]
+        pickups = {(p.location.longitude, p.location.latitude) for p in passengers}
+
+        def refined_destinations(
+            run: Callable[[TieredProvider], object],
+        ) -> list[tuple[float, float]]:
+            stub_osrm.paths.clear()
+            # One table request per refined cell.
+            run(
+                TieredProvider(
+                    OSRMProvider(
+                        stub_osrm.base_url, requests_per_second=0.0, max_table_size=1
+                    ),
+                    top_k=2,
+                )
+            )
+            points = [
+                urlsplit(path).path.rsplit("/", 1)[1].split(";")[-1]
+                for path in stub_osrm.paths
+                if path.startswith("/table")
+            ]
+            return [
+                tuple(float(value) for value in point.split(",")) for point in points
+            ]
+
+        every_column = refined_destinations(
+            lambda tiered: tiered.matrix_metrics(locations, locations)
+        )
+        passenger_columns = refined_destinations(
+            lambda tiered: assign_passengers_to_drivers(
+                drivers, passengers, destination=destination, provider=tiered
+            )
+        )
+
+        assert len(passenger_columns) <= len(every_column)
+        assert set(passenger_columns) <= pickups
+        assert not set(every_column) <= pickups
+
+    def test_scalar_metrics_and_legs_use_the_fine_provider(self) -> None:
+        provider = TieredProvider(_ManhattanProvider())
+        stops = [Location(0.0, 0.0), Location(0.1, 0.1), Location(0.1, 0.2)]
+
+        assert provider.metrics(stops[0], stops[1]) == pytest.approx((0.2, 0.4))
+        assert provider.route_legs(stops) == pytest.approx([(0.2, 0.4), (0.1, 0.2)])
+
+    def test_osrm_pair_metrics_tiles_sparse_pairs(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(
+            stub_osrm.base_url, requests_per_second=0.0, max_table_size=2
+        )
+        origins = [Location(0.0, 0.1 * i) for i in range(4)]
+        destinations = [Location(0.01, 0.1 * i) for i in range(4)]
+
+        metrics = provider.pair_metrics(origins, destinations)
+
+        assert metrics["distance_km"] == pytest.approx([1.0] * 4)
+        assert len(stub_osrm.paths) == 2
+
+    def test_assignment_matches_osrm_with_fewer_cells(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        locations = _random_locations(24, seed=3)
+        drivers = [
+            Driver(f"d{i}", f"Driver {i}", location, capacity=5)
+            for i, location in enumerate(locations[:4])
+        ]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", location)
+            for i, location in enumerate(locations[4:])
+        ]
+        osrm = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        tiered = TieredProvider(
+            OSRMProvider(stub_osrm.base_url, requests_per_second=0.0), top_k=6
+        )
+
+        expected, _ = assign_passengers_to_drivers(drivers, passengers, provider=osrm)
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers, passengers, provider=tiered
+        )
+
+        assert not unassigned
+        assert sum(route.total_travel_time_minutes for route in routes) <= 1.05 * sum(
+            route.total_travel_time_minutes for route in expected
+        )
+        assert tiered.ranking_stats()["refined_cells"] < 24 * 24 / 2
+        for route in routes:
+            stops = [route.driver.location, *(p.location for p in route.pickup_order)]
+            assert (
+                route.total_distance_km,
+                route.total_travel_time_minutes,
+            ) == pytest.approx(route_metrics(stops, osrm))
+
+    @pytest.mark.parametrize("engine", ["greedy", "vrp"])
+    def test_route_totals_are_fine_leg_sums(self, engine: str) -> None:
+        locations = _random_locations(30, seed=11)
+        destination = Location(40.75, -73.95)
+        drivers = [
+            Driver(f"d{i}", f"Driver {i}", location, capacity=3)
+            for i, location in enumerate(locations[:6])
+        ]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", location)
+            for i, location in enumerate(locations[6:])
+        ]
+        fine = _UnevenDetourProvider()
+        tiered = TieredProvider(fine, top_k=3)
+
+        routes, _ = assign_passengers_to_drivers(
+            drivers,
+            passengers,
+            destination=destination,
+            provider=tiered,
+            engine=engine,
+            time_limit_seconds=0.5,
+        )
+
+        for route in routes:
+            stops = [
+                route.driver.location,
+                *(p.location for p in route.pickup_order),
+                destination,
+            ]
+            legs = fine.route_legs(stops)
+            assert route.leg_distances_km == pytest.approx([leg[0] for leg in legs])
+            assert route.leg_travel_times_minutes == pytest.approx(
+                [leg[1] for leg in legs]
+            )
+            assert (
+                route.total_distance_km,
+                route.total_travel_time_minutes,
+            ) == pytest.approx(route_metrics(stops, fine))
+
+
+def _two_region_samples(count: int, seed: int) -> dict[tuple, tuple[float, float]]:
+    """Road metrics where north of the equator is twisty and slow."""
+    rng = random.Random(seed)
+    haversine = HaversineProvider()
+    samples = {}
+    for _ in range(count):
+        origin = Location(rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1))
+        destination = Location(rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1))
+        detours, paces = zip(
+            *[
+                (1.5, 3.0) if location.latitude > 0 else (1.2, 1.0)
+                for location in (origin, destination)
+            ]
+        )
+        road_km = haversine.distance_km(origin, destination) * sum(detours) / 2
+        samples[
+            (
+                origin.latitude,
+                origin.longitude,
+                destination.latitude,
+                destination.longitude,
+            )
+        ] = (road_km, road_km * sum(paces) / 2)
+    return samples
+
+
+class TestCalibratedProvider:
+    """Test the grid-calibrated travel-time model."""
+
+    def test_unfitted_model_is_scaled_haversine(self) -> None:
+        provider = CalibratedProvider(detour_factor=1.5, average_speed_kmph=30.0)
+        origin, destination = Location(0.0, 0.0), Location(0.0, 0.1)
+        crow_km = HaversineProvider().distance_km(origin, destination)
+
+        assert provider.metrics(origin, destination) == pytest.approx(
+            (1.5 * crow_km, 1.5 * crow_km * 2.0)
+        )
+
+    def test_fit_recovers_regional_factors_on_held_out_samples(self) -> None:
+        provider = CalibratedProvider(cell_size_km=5.0)
+
+        report = provider.fit(_two_region_samples(2000, seed=1), prior_samples=0.1)
+
+        assert report.holdout_samples > 0
+        assert report.samples > report.holdout_samples
+        assert report.travel_time_mape < 0.02
+        assert report.distance_mape < 0.02
+        assert report.baseline_travel_time_mape > 0.3
+        north = provider.metrics(Location(0.05, 0.0), Location(0.05, 0.05))
+        south = provider.metrics(Location(-0.05, 0.0), Location(-0.05, 0.05))
+        assert north[1] / north[0] == pytest.approx(3.0, rel=0.05)
+        assert south[1] / south[0] == pytest.approx(1.0, rel=0.05)
+
+    def test_matrix_forms_agree_with_scalar_metrics(self) -> None:
+        provider = CalibratedProvider(cell_size_km=5.0)
+        provider.fit(_two_region_samples(500, seed=2))
+        rng = random.Random(4)
+        locations = [
+            Location(rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1)) for _ in range(6)
+        ]
+
+        matrix = provider.matrix_metrics(locations, locations)
+        condensed = provider.condensed_matrix_metrics(locations).to_dense()
+        legs = provider.route_legs(locations)
+
+        assert np.allclose(
+            matrix["travel_time_minutes"], condensed["travel_time_minutes"]
+        )
+        assert matrix[1, 4].tolist() == pytest.approx(
+            provider.metrics(locations[1], locations[4])
+        )
+        assert legs[2] == pytest.approx(matrix[2, 3].tolist())
+
+    def test_save_and_load_round_trip(self, tmp_path: Path) -> None:
+        provider = CalibratedProvider(cell_size_km=5.0)
+        provider.fit(_two_region_samples(500, seed=3))
+        locations = [Location(0.05, 0.01), Location(-0.02, 0.03), Location(0.5, 0.5)]
+
+        provider.save(tmp_path / "calibration.json")
+        loaded = CalibratedProvider.load(tmp_path / "calibration.json")
+
+        assert loaded.cells == provider.cells
+        assert np.array_equal(
+            loaded.matrix_metrics(locations, locations),
+            provider.matrix_metrics(locations, locations),
+        )
+
+    def test_fit_without_usable_samples_fails(self) -> None:
+        with pytest.raises(ValueError):
+            CalibratedProvider().fit({(0.0, 0.0, 0.0, 0.0): (0.0, 0.0)})
+
+    def test_fits_from_osrm_cached_samples(self, stub_osrm: StubOSRMServer) -> None:
+        osrm = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        locations = [Location(0.0, 0.01 * i) for i in range(8)]
+        osrm.matrix_metrics(locations, locations)
+        samples = osrm.cached_samples()
+        provider = CalibratedProvider()
+
+        report = provider.fit(samples, holdout_fraction=0.0)
+
+        assert len(samples) == 64
+        assert report.samples == 56
+        assert provider.distance_km(locations[0], locations[5]) == pytest.approx(
+            5.0, rel=0.01
+        )
+
+
+class TestServerSideOrdering:
+    """Test OSRM /trip ordering and its use by candidate-pruned assignment."""
+
+    def test_osrm_solve_order_uses_one_trip_request(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        stops = [Location(0.0, 0.03), Location(0.0, 0.01), Location(0.0, 0.02)]
+
+        order = provider.solve_order(Location(0.0, 0.0), stops, end=Location(0.0, 0.1))
+
+        assert order == [1, 2, 0]
+        assert len(stub_osrm.paths) == 1
+        assert stub_osrm.paths[0].startswith("/trip/")
+        assert "roundtrip=false&source=first&destination=last" in stub_osrm.paths[0]
+
+        legs = provider.route_legs(
+            [Location(0.0, 0.0), *(stops[i] for i in order), Location(0.0, 0.1)]
+        )
+
+        assert [leg[0] for leg in legs] == pytest.approx([1.0, 1.0, 1.0, 7.0])
+        assert len(stub_osrm.paths) == 1
+
+    def test_osrm_solve_order_needs_a_fixed_end(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        provider = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        stops = [Location(0.0, 0.03), Location(0.0, 0.01)]
+
+        assert provider.solve_order(Location(0.0, 0.0), stops) is None
+        assert provider.solve_order(Location(0.0, 0.0), stops[:1]) == [0]
+        assert stub_osrm.paths == []
+
+    def test_osrm_solve_order_failure_returns_none(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        stub_osrm.failures_remaining = 1
+        provider = OSRMProvider(
+            stub_osrm.base_url, requests_per_second=0.0, max_retries=0
+        )
+        stops = [Location(0.0, 0.03), Location(0.0, 0.01)]
+
+        order = provider.solve_order(Location(0.0, 0.0), stops, Location(0.0, 0.1))
+
+        assert order is None
+
+    def test_base_provider_has_no_solver(self) -> None:
+        assert HaversineProvider().solve_order(Location(0.0, 0.0), []) is None
+
+    def test_pruned_assignment_orders_routes_on_the_server(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        drivers = [
+            Driver("d1", "Driver 1", Location(0.0, 0.0), capacity=3),
+            Driver("d2", "Driver 2", Location(0.5, 0.0), capacity=3),
+        ]
+        passengers = [
+            Passenger(f"p{i}", f"P{i}", Location(0.5 * (i % 2), 0.01 * (i + 1)))
+            for i in range(6)
+        ]
+        destination = Location(0.2, 0.2)
+        provider = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        tracer = RecordingTracer()
+
+        routes, unassigned = assign_passengers_to_drivers(
+            drivers,
+            passengers,
+            destination,
+            provider=provider,
+            candidate_count=2,
+            tracer=tracer,
+        )
+        local_routes, _ = assign_passengers_to_drivers(
+            drivers,
+            passengers,
+            destination,
+            provider=_ManhattanProvider(),
+            candidate_count=2,
+        )
+
+        assert not unassigned
+        services = [path.split("/")[1] for path in stub_osrm.paths]
+        assert services.count("trip") == 2
+        assert services.count("route") == 0
+        summary = tracer.summary()
+        assert summary["assign;route;solve_order"]["count"] == 2
+        assert "assign;route;matrix" not in summary
+        assert [
+            [passenger.user_id for passenger in route.pickup_order] for route in routes
+        ] == [
+            [passenger.user_id for passenger in route.pickup_order]
+            for route in local_routes
+        ]
+        for route in routes:
+            assert route.total_distance_km == pytest.approx(
+                sum(route.leg_distances_km)
+            )
+
+    def test_single_pickup_routes_count_no_solve_order_call(
+        self, stub_osrm: StubOSRMServer
+    ) -> None:
+        drivers = [
+            Driver("d1", "Driver 1", Location(0.0, 0.0), capacity=3),
+            Driver("d2", "Driver 2", Location(0.5, 0.0), capacity=1),
+        ]
+        passengers = [
+            *(Passenger(f"p{i}", f"P{i}", Location(0.0, 0.01 * i)) for i in (1, 2, 3)),
+            Passenger("p4", "P4", Location(0.5, 0.01)),
+        ]
+        provider = OSRMProvider(stub_osrm.base_url, requests_per_second=0.0)
+        tracer = RecordingTracer()
+
+        routes, _ = assign_passengers_to_drivers(
+            drivers,
+            passengers,
+            Location(0.2, 0.2),
+            provider=provider,
+            candidate_count=2,
+            tracer=tracer,
+        )
+
+        assert [len(route.passengers) for route in routes] == [3, 1]
+        services = [path.split("/")[1] for path in stub_osrm.paths]
+        counters = tracer.summary()["assign;route;solve_order"]["counters"]
+        assert counters["provider_calls"] == services.count("trip") == 1